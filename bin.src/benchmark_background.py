@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# This file is part of meas_algorithms.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Benchmark the statistics engines of SubtractBackgroundTask.
+
+A CCD-sized exposure is simulated, with a smooth sky gradient, stars,
+Poisson noise, and a fraction of the pixels masked as DETECTED (as when the
+background is re-estimated after detection) or BAD. The background is fit
+``--repeat`` times with each value of ``statisticsEngine`` (and, for the
+numpy engine, each of ``--numThreads``), and the median wall time is
+reported along with the largest difference from the ``afw`` background, in
+units of the noise per pixel.
+
+Example usage:
+    benchmark_background.py --size 4096 --statistic MEANCLIP --numThreads 1 4
+"""
+
+import time
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+from lsst.meas.algorithms import SubtractBackgroundTask
+
+
+def makeExposure(size, rng, sky=1000.0, maskedFraction=0.05, numStars=2000, psfSigma=2.0):
+    """Simulate an exposure with a sky gradient, stars and masked pixels."""
+    yy, xx = np.mgrid[0:size, 0:size]/size
+    model = sky*(1.0 + 0.05*xx - 0.03*yy + 0.02*xx*yy)
+    radius = int(5*psfSigma) + 1
+    for x, y, flux in zip(rng.uniform(radius, size - radius - 1, numStars),
+                          rng.uniform(radius, size - radius - 1, numStars),
+                          np.exp(rng.uniform(np.log(1.0e3), np.log(1.0e6), numStars))):
+        x0, y0 = int(x) - radius, int(y) - radius
+        sy, sx = np.mgrid[y0:y0 + 2*radius + 1, x0:x0 + 2*radius + 1]
+        model[y0:y0 + 2*radius + 1, x0:x0 + 2*radius + 1] += (
+            flux/(2*np.pi*psfSigma**2)*np.exp(-0.5*((sx - x)**2 + (sy - y)**2)/psfSigma**2))
+
+    exposure = afwImage.ExposureF(size, size)
+    exposure.image.array[:] = rng.poisson(model)
+    exposure.variance.array[:] = model
+    mask = exposure.mask
+    bits = mask.getPlaneBitMask("DETECTED") | mask.getPlaneBitMask("BAD")
+    mask.array[rng.uniform(size=(size, size)) < maskedFraction] = bits
+    return exposure, np.sqrt(sky)
+
+
+def timeFit(exposure, config, repeat):
+    """Fit the background of an exposure repeatedly.
+
+    Returns
+    -------
+    time : `float`
+        Median wall time of the fits (seconds).
+    background : `numpy.ndarray`
+        Background image from the last fit.
+    """
+    task = SubtractBackgroundTask(config=config)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        bg = task.fitBackground(exposure.maskedImage)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), bg.getImageF(config.algorithm, config.undersampleStyle).array
+
+
+def main():
+    import argparse
+
+    class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=CustomFormatter)
+    parser.add_argument("--size", default=4096, type=int,
+                        help="Width and height of the simulated exposure (pixels).")
+    parser.add_argument("--binSize", default=128, type=int,
+                        help="Size of the background bins (pixels).")
+    parser.add_argument("--statistic", default="MEANCLIP", choices=("MEANCLIP", "MEAN", "MEDIAN"),
+                        help="Statistic of the bins.")
+    parser.add_argument("--numThreads", default=[1], type=int, nargs="+",
+                        help="Numbers of threads with which to run the numpy engine.")
+    parser.add_argument("--repeat", default=3, type=int,
+                        help="Number of times to fit the background with each engine.")
+    parser.add_argument("--seed", default=1, type=int,
+                        help="Seed for the random number generator used to simulate the exposure.")
+    args = parser.parse_args()
+
+    exposure, noise = makeExposure(args.size, np.random.RandomState(args.seed))
+
+    config = SubtractBackgroundTask.ConfigClass()
+    config.binSize = args.binSize
+    config.statisticsProperty = args.statistic
+    config.ignoredPixelMask = ["BAD", "DETECTED"]
+    afwTime, afwBackground = timeFit(exposure, config, args.repeat)
+
+    print(f"{'engine':>6} {'threads':>7} {'time (s)':>9} {'max diff (sigma)':>17}")
+    print(f"{'afw':>6} {'-':>7} {afwTime:>9.3f} {'-':>17}")
+    config.statisticsEngine = "numpy"
+    for numThreads in args.numThreads:
+        config.numThreads = numThreads
+        numpyTime, numpyBackground = timeFit(exposure, config, args.repeat)
+        maxDiff = np.max(np.abs(numpyBackground - afwBackground))/noise
+        print(f"{'numpy':>6} {numThreads:>7} {numpyTime:>9.3f} {maxDiff:>17.4f}")
+
+
+if __name__ == "__main__":
+    main()
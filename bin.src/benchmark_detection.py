@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# This file is part of meas_algorithms.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Benchmark the stages of SourceDetectionTask on synthetic fields.
+
+Three kinds of field are simulated, with Gaussian stars on a flat sky and
+Poisson noise:
+
+sparse
+    A few hundred isolated stars.
+crowded
+    A star every 20x20 pixels on average, so many are blended.
+nebulous
+    Stars and extended galaxies on top of smooth nebulosity on scales of
+    tens to hundreds of pixels.
+
+Detection is run ``--repeat`` times on a fresh copy of each field, and the
+median wall time of each stage recorded by the task (see
+``SourceDetectionTask.profileStage``) is reported, with the peak memory
+allocated by Python and numpy if ``--profileMemory`` is given. With
+``--output``, the results are appended as JSON lines (one per field, with
+the package version) so they can be tracked across releases.
+
+With ``--runMany``, ``SourceDetectionTask.runMany`` is also timed on
+``--numExposures`` copies of each field, and compared with calling
+``SourceDetectionTask.run`` on each copy with a new task.
+
+Example usage:
+    benchmark_detection.py --size 2048 --repeat 5 --profileMemory --output detection_benchmarks.jsonl
+    benchmark_detection.py --fields sparse --runMany --numExposures 8
+"""
+
+import datetime
+import json
+import time
+
+import numpy as np
+
+import lsst.afw.detection as afwDet
+import lsst.afw.image as afwImage
+import lsst.afw.table as afwTable
+from lsst.meas.algorithms import SourceDetectionTask
+from lsst.meas.algorithms.version import __version__
+
+STAGES = ("convolve", "threshold", "tempLocalBackground", "grow", "reEstimateBackground", "makeSources")
+FIELDS = ("sparse", "crowded", "nebulous")
+
+
+def addGaussian(model, x, y, flux, sigma):
+    """Add a circular Gaussian to an image array, truncated at 5 sigma."""
+    radius = int(5*sigma) + 1
+    x0, x1 = max(int(x) - radius, 0), min(int(x) + radius + 1, model.shape[1])
+    y0, y1 = max(int(y) - radius, 0), min(int(y) + radius + 1, model.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+    yy, xx = np.mgrid[y0:y1, x0:x1]
+    model[y0:y1, x0:x1] += (flux/(2*np.pi*sigma**2)
+                            * np.exp(-0.5*((xx - x)**2 + (yy - y)**2)/sigma**2))
+
+
+def makeField(kind, size, rng, sky=1000.0, psfSigma=2.0):
+    """Simulate an exposure of one of the kinds of field.
+
+    Parameters
+    ----------
+    kind : `str`
+        One of ``FIELDS``.
+    size : `int`
+        Width and height of the exposure (pixels).
+    rng : `numpy.random.RandomState`
+        Random number generator.
+    sky : `float`, optional
+        Sky level (counts), subtracted after adding the noise.
+    psfSigma : `float`, optional
+        Gaussian sigma of the PSF (pixels).
+
+    Returns
+    -------
+    exposure : `lsst.afw.image.ExposureF`
+        Simulated exposure, with a Gaussian PSF.
+    numSources : `int`
+        Number of stars and galaxies simulated.
+    """
+    model = np.zeros((size, size))
+    numStars = {"sparse": 300, "crowded": size**2//400, "nebulous": 300}[kind]
+    minFlux = 500.0 if kind == "crowded" else 2000.0
+    for x, y, flux in zip(rng.uniform(0, size, numStars), rng.uniform(0, size, numStars),
+                          np.exp(rng.uniform(np.log(minFlux), np.log(1.0e6), numStars))):
+        addGaussian(model, x, y, flux, psfSigma)
+    numSources = numStars
+    if kind == "nebulous":
+        numGalaxies = 100
+        for x, y, flux, sigma in zip(rng.uniform(0, size, numGalaxies), rng.uniform(0, size, numGalaxies),
+                                     np.exp(rng.uniform(np.log(1.0e4), np.log(1.0e6), numGalaxies)),
+                                     rng.uniform(3.0, 12.0, numGalaxies)):
+            addGaussian(model, x, y, flux, sigma)
+        numSources += numGalaxies
+        yy, xx = np.mgrid[0:size, 0:size]
+        for x, y, amplitude, scale in zip(rng.uniform(0, size, 6), rng.uniform(0, size, 6),
+                                          rng.uniform(20.0, 200.0, 6), rng.uniform(30.0, 300.0, 6)):
+            model += amplitude*np.exp(-0.5*((xx - x)**2 + (yy - y)**2)/scale**2)
+
+    exposure = afwImage.ExposureF(size, size)
+    exposure.image.array[:] = rng.poisson(model + sky) - sky
+    exposure.variance.array[:] = model + sky
+    kernelSize = 2*int(5*psfSigma) + 1
+    exposure.setPsf(afwDet.GaussianPsf(kernelSize, kernelSize, psfSigma))
+    return exposure, numSources
+
+
+def benchmark(exposure, repeat, profileMemory):
+    """Run detection on copies of an exposure, and summarise the cost of
+    each stage.
+
+    Returns
+    -------
+    summary : `dict`
+        For each stage that was run, and ``"total"``, the median wall time
+        (``"time"``, seconds) and, if ``profileMemory``, the maximum peak
+        memory (``"peakMemory"``, bytes) over the repeats; and the median
+        number of sources detected (``"numDetected"``).
+    """
+    stats = {}
+    numDetected = []
+    schema = afwTable.SourceTable.makeMinimalSchema()
+    for _ in range(repeat):
+        config = SourceDetectionTask.ConfigClass()
+        config.doProfileMemory = profileMemory
+        task = SourceDetectionTask(config=config, schema=schema)
+        table = afwTable.SourceTable.make(schema)
+        copy = exposure.clone()
+        start = time.perf_counter()
+        results = task.run(table, copy)
+        total = time.perf_counter() - start
+        numDetected.append(len(results.sources))
+        for stage in STAGES:
+            if not task.metadata.exists(stage + "Time"):
+                continue
+            stageStats = stats.setdefault(stage, {"time": [], "peakMemory": []})
+            stageStats["time"].append(sum(task.metadata.getArray(stage + "Time")))
+            if profileMemory:
+                stageStats["peakMemory"].append(max(task.metadata.getArray(stage + "PeakMemory")))
+        stats.setdefault("total", {"time": [], "peakMemory": []})["time"].append(total)
+
+    summary = {"numDetected": int(np.median(numDetected))}
+    for stage, stageStats in stats.items():
+        summary[stage] = {"time": float(np.median(stageStats["time"]))}
+        if stageStats["peakMemory"]:
+            summary[stage]["peakMemory"] = int(max(stageStats["peakMemory"]))
+    return summary
+
+
+def benchmarkRunMany(exposure, numExposures, repeat):
+    """Time detection on copies of an exposure with ``runMany``, and with
+    ``run`` and a new task for each copy.
+
+    Returns
+    -------
+    times : `dict` [`str`, `float`]
+        Median wall time (seconds) of ``run`` and of ``runMany``.
+    """
+    durations = {"run": [], "runMany": []}
+    for _ in range(repeat):
+        copies = [exposure.clone() for _ in range(numExposures)]
+        start = time.perf_counter()
+        for copy in copies:
+            schema = afwTable.SourceTable.makeMinimalSchema()
+            SourceDetectionTask(schema=schema).run(afwTable.SourceTable.make(schema), copy)
+        durations["run"].append(time.perf_counter() - start)
+
+        copies = [exposure.clone() for _ in range(numExposures)]
+        start = time.perf_counter()
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        SourceDetectionTask(schema=schema).runMany(afwTable.SourceTable.make(schema), copies)
+        durations["runMany"].append(time.perf_counter() - start)
+    return {method: float(np.median(times)) for method, times in durations.items()}
+
+
+def main():
+    import argparse
+
+    class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=CustomFormatter)
+    parser.add_argument("--fields", default=list(FIELDS), choices=FIELDS, nargs="+",
+                        help="Kinds of field to benchmark.")
+    parser.add_argument("--size", default=1024, type=int,
+                        help="Width and height of the simulated exposures (pixels).")
+    parser.add_argument("--repeat", default=3, type=int,
+                        help="Number of times to run detection on each field.")
+    parser.add_argument("--profileMemory", action="store_true", default=False,
+                        help="Record the peak memory of each stage with tracemalloc (slower).")
+    parser.add_argument("--seed", default=1, type=int,
+                        help="Seed for the random number generator used to simulate the fields.")
+    parser.add_argument("--output", default=None,
+                        help="File to which to append the results, as JSON lines.")
+    parser.add_argument("--runMany", action="store_true", default=False,
+                        help="Also time runMany against run on several copies of each field.")
+    parser.add_argument("--numExposures", default=4, type=int,
+                        help="Number of copies of each field to detect on with runMany.")
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    print(f"{'field':>9} {'stage':>20} {'time (s)':>9} {'peak (MB)':>10}")
+    for kind in args.fields:
+        exposure, numSources = makeField(kind, args.size, rng)
+        summary = benchmark(exposure, args.repeat, args.profileMemory)
+        for stage in STAGES + ("total",):
+            if stage not in summary:
+                continue
+            peakMemory = summary[stage].get("peakMemory")
+            peakMemory = f"{peakMemory/2**20:>10.1f}" if peakMemory is not None else f"{'-':>10}"
+            print(f"{kind:>9} {stage:>20} {summary[stage]['time']:>9.3f} {peakMemory}")
+        print(f"{kind:>9} {'sources/detected':>20} {numSources:>9} {summary['numDetected']:>10}")
+        if args.runMany:
+            runManyTimes = benchmarkRunMany(exposure, args.numExposures, args.repeat)
+            speedup = runManyTimes["run"]/runManyTimes["runMany"]
+            for method, duration in runManyTimes.items():
+                print(f"{kind:>9} {method + ' x' + str(args.numExposures):>20} {duration:>9.3f}")
+            print(f"{kind:>9} {'runMany speedup':>20} {speedup:>9.2f}")
+            summary["runMany"] = runManyTimes
+
+        if args.output:
+            record = dict(version=__version__, date=datetime.datetime.now().isoformat(), field=kind,
+                          size=args.size, seed=args.seed, repeat=args.repeat, numSources=numSources,
+                          **summary)
+            with open(args.output, "a") as stream:
+                stream.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
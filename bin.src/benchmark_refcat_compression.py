@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# This file is part of meas_algorithms.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Benchmark reading reference catalog shards as a function of the shard
+compression level (see ``DatasetConfig.compression``).
+
+A sample of the shards of an existing refcat is copied to a scratch directory
+and compressed at each requested level (0 means uncompressed). For each level
+the total size and the time to read all of the sampled shards are reported,
+both with a cold page cache (the files are evicted with ``posix_fadvise``
+before reading) and a warm one (the files were just read).
+
+Example usage:
+    benchmark_refcat_compression.py refcat/ref_cats/gaia_dr2 --nShards 200 --levels 0 1 6 9
+"""
+
+import glob
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import lsst.afw.table as afwTable
+from lsst.meas.algorithms.ingestIndexManager import IngestIndexManager
+
+
+def evict(filenames):
+    """Ask the kernel to drop the files from the page cache."""
+    for filename in filenames:
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def readAll(filenames):
+    """Return the time taken to read all of the shards, and their total
+    number of rows.
+    """
+    start = time.perf_counter()
+    nRows = sum(len(afwTable.SimpleCatalog.readFits(filename)) for filename in filenames)
+    return time.perf_counter() - start, nRows
+
+
+def main():
+    import argparse
+
+    class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=CustomFormatter)
+    parser.add_argument("refCatDir",
+                        help="Directory containing the shard files of an ingested reference catalog.")
+    parser.add_argument("--nShards", default=100, type=int,
+                        help="Number of shards to benchmark (randomly selected).")
+    parser.add_argument("--levels", default=[0, 1, 3, 6, 9], type=int, nargs="+",
+                        help="Compression levels to benchmark; 0 means uncompressed.")
+    parser.add_argument("--scratch", default=None,
+                        help="Scratch directory to copy the shards to; should be on the filesystem "
+                        "being benchmarked.")
+    args = parser.parse_args()
+
+    shards = [filename for filename in glob.glob(os.path.join(args.refCatDir, "*.fits"))
+              if not os.path.basename(filename).startswith("master_schema")]
+    shards = random.sample(shards, min(args.nShards, len(shards)))
+
+    print(f"{'level':>5} {'size (MB)':>10} {'ratio':>6} {'cold (s)':>9} {'warm (s)':>9} {'rows':>10}")
+    baseSize = None
+    for level in args.levels:
+        scratch = tempfile.mkdtemp(dir=args.scratch)
+        try:
+            filenames = []
+            for shard in shards:
+                filename = os.path.join(scratch, os.path.basename(shard))
+                shutil.copyfile(shard, filename)
+                if level > 0:
+                    IngestIndexManager.compressShard(filename, level)
+                filenames.append(filename)
+            size = sum(os.path.getsize(filename) for filename in filenames)
+            if baseSize is None:
+                baseSize = size
+
+            evict(filenames)
+            coldTime, nRows = readAll(filenames)
+            warmTime, _ = readAll(filenames)
+            print(f"{level:>5} {size/2**20:>10.1f} {baseSize/size:>6.2f} {coldTime:>9.3f} {warmTime:>9.3f} "
+                  f"{nRows:>10}")
+        finally:
+            shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
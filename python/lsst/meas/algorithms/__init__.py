@@ -51,6 +51,7 @@ from .loadReferenceObjects import *
 from .objectSizeStarSelector import *
 from .makeCoaddApCorrMap import *
 from .subtractBackground import *
+from .focalPlaneBackground import *
 from .measureApCorr import *
 from .flaggedSourceSelector import *
 from .sourceSelector import *
@@ -24,8 +24,14 @@
 __all__ = ("SourceDetectionConfig", "SourceDetectionTask", "addExposures")
 
 from contextlib import contextmanager
+import itertools
+import time
+import tracemalloc
 
 import numpy as np
+import scipy.ndimage
+import scipy.sparse
+import scipy.sparse.csgraph
 
 import lsst.geom
 import lsst.afw.display as afwDisplay
@@ -34,6 +40,7 @@ import lsst.afw.geom as afwGeom
 import lsst.afw.image as afwImage
 import lsst.afw.math as afwMath
 import lsst.afw.table as afwTable
+import lsst.daf.base as dafBase
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
 from .subtractBackground import SubtractBackgroundTask
@@ -54,6 +61,16 @@ class SourceDetectionConfig(pexConfig.Config):
         doc="Grow all footprints at the same time? This allows disconnected footprints to merge.",
         dtype=bool, default=True,
     )
+    growEngine = pexConfig.ChoiceField(
+        doc="Algorithm used to grow footprints",
+        dtype=str, default="afw",
+        allowed={
+            "afw": "Dilate each footprint (or the whole set, if combinedGrow) with afw",
+            "distance": "Threshold a single distance transform of all the footprints; if not combinedGrow, "
+                        "the grown footprints don't merge, and each grown pixel goes to the nearest "
+                        "footprint rather than to all the footprints that reach it",
+        },
+    )
     nSigmaToGrow = pexConfig.Field(
         doc="Grow detections by nSigmaToGrow * [PSF RMS width]; if 0 then do not grow",
         dtype=float, default=2.4,  # 2.4 pixels/sigma is roughly one pixel/FWHM
@@ -103,6 +120,13 @@ class SourceDetectionConfig(pexConfig.Config):
         doc="Background re-estimation; ignored if reEstimateBackground false",
         target=SubtractBackgroundTask,
     )
+    doIncrementalBackground = pexConfig.Field(
+        dtype=bool,
+        doc=("Keep the statistics of the background bins between re-estimations of the background of "
+             "the same image, and only measure again the bins whose good pixels have changed (e.g., "
+             "by new detections)? Requires background.statisticsEngine='numpy'."),
+        default=False,
+    )
     tempLocalBackground = pexConfig.ConfigurableField(
         doc=("A local (small-scale), temporary background estimation step run between "
              "detecting above-threshold regions and detecting the peaks within "
@@ -125,6 +149,13 @@ class SourceDetectionConfig(pexConfig.Config):
         doc="Do temporary wide (large-scale) background subtraction before footprint detection?",
         default=False,
     )
+    doCacheTempWideBackground = pexConfig.Field(
+        dtype=bool,
+        doc=("Reuse the temporary wide background model of the last exposure if its pixels are unchanged? "
+             "Changes are tracked through markImageModified, so pixels modified outside the task between "
+             "calls must be registered with it."),
+        default=False,
+    )
     nPeaksMaxSimple = pexConfig.Field(
         dtype=int,
         doc=("The maximum number of peaks in a Footprint before trying to "
@@ -142,6 +173,46 @@ class SourceDetectionConfig(pexConfig.Config):
         doc="Mask planes to ignore when calculating statistics of image (for thresholdType=stdev)",
         default=['BAD', 'SAT', 'EDGE', 'NO_DATA'],
     )
+    convolutionEngine = pexConfig.ChoiceField(
+        dtype=str,
+        doc="Algorithm used to smooth the image with the Gaussian kernel",
+        default="direct",
+        allowed={
+            "direct": "Direct separable convolution",
+            "fft": "Convolution with fast Fourier transforms; cost independent of the kernel width",
+            "auto": "Choose whichever of direct and fft is expected to be faster for the image and kernel",
+        },
+    )
+    binFactor = pexConfig.RangeField(
+        dtype=int,
+        doc=("Factor by which to bin the image before detection; the smoothing sigma is reduced by the "
+             "same factor, and the footprints and peaks are mapped back to the unbinned pixels. "
+             "Useful for large-scale, low-surface-brightness detection. If 1, no binning is done."),
+        default=1, min=1,
+    )
+    stripHeight = pexConfig.RangeField(
+        dtype=int,
+        doc=("Height (pixels) of the horizontal strips in which the image is convolved and thresholded, "
+             "to bound the memory used for large images; footprints crossing strips are joined. "
+             "Requires a thresholdType other than 'stdev' and doTempLocalBackground=False. "
+             "If 0, the image is processed in one piece."),
+        default=0, min=0,
+    )
+    doProfileMemory = pexConfig.Field(
+        dtype=bool,
+        doc=("Record the peak memory allocated in each stage of detection, using tracemalloc (which only "
+             "sees allocations by Python and numpy, and slows them down); not meaningful when detecting "
+             "in several threads with runMany. The wall time of each stage is always recorded."),
+        default=False,
+    )
+    thresholdHierarchyFactors = pexConfig.ListField(
+        dtype=float,
+        doc=("Multipliers for the configured threshold at which to detect a hierarchy of nested footprints, "
+             "found in a single pass over the convolved image and returned as ``hierarchy`` by "
+             "detectFootprints (in addition to the usual detections). Requires binFactor=1 and "
+             "stripHeight=0. If empty, no hierarchy is made."),
+        default=[],
+    )
 
     def setDefaults(self):
         self.tempLocalBackground.binSize = 64
@@ -157,6 +228,33 @@ class SourceDetectionConfig(pexConfig.Config):
             if maskPlane in self.tempWideBackground.ignoredPixelMask:
                 self.tempWideBackground.ignoredPixelMask.remove(maskPlane)
 
+    def validate(self):
+        pexConfig.Config.validate(self)
+        if self.stripHeight > 0:
+            if self.thresholdType == "stdev":
+                raise pexConfig.FieldValidationError(
+                    SourceDetectionConfig.stripHeight, self,
+                    "Strip detection cannot measure the standard deviation of the whole convolved image; "
+                    "use a per-pixel thresholdType")
+            if self.doTempLocalBackground:
+                raise pexConfig.FieldValidationError(SourceDetectionConfig.stripHeight, self,
+                                                     "Strip detection does not support doTempLocalBackground")
+            if self.binFactor > 1:
+                raise pexConfig.FieldValidationError(SourceDetectionConfig.stripHeight, self,
+                                                     "Strip detection does not support binFactor > 1")
+        if self.thresholdHierarchyFactors:
+            if self.binFactor > 1 or self.stripHeight > 0:
+                raise pexConfig.FieldValidationError(
+                    SourceDetectionConfig.thresholdHierarchyFactors, self,
+                    "A threshold hierarchy requires binFactor=1 and stripHeight=0")
+            if min(self.thresholdHierarchyFactors) <= 0:
+                raise pexConfig.FieldValidationError(SourceDetectionConfig.thresholdHierarchyFactors, self,
+                                                     "Threshold factors must be positive")
+        if self.doIncrementalBackground and self.background.statisticsEngine != "numpy":
+            raise pexConfig.FieldValidationError(SourceDetectionConfig.doIncrementalBackground, self,
+                                                 "Incremental background re-estimation requires "
+                                                 "background.statisticsEngine='numpy'")
+
 
 class SourceDetectionTask(pipeBase.Task):
     """Create the detection task.  Most arguments are simply passed onto pipe.base.Task.
@@ -199,6 +297,17 @@ class SourceDetectionTask(pipeBase.Task):
             self.makeSubtask("tempLocalBackground")
         if self.config.doTempWideBackground:
             self.makeSubtask("tempWideBackground")
+        # Convolved images, keyed by image version and kernel; enabled by convolveCacheContext
+        self._convolveCache = None
+        # Smoothing kernels, keyed by sigma and width
+        self._kernelCache = {}
+        # Statistics of the bins of the re-estimated background of the last image; see
+        # _getBackgroundBinStatistics
+        self._backgroundBinStatistics = None
+        # Key, model and statistics of the last temporary wide background; see subtractTempWideBackground
+        self._wideBackgroundCache = None
+        self._imageVersionCounter = itertools.count()
+        self._imageVersion = next(self._imageVersionCounter)
 
     @pipeBase.timeMethod
     def run(self, table, exposure, doSmooth=True, sigma=None, clearMask=True, expId=None):
@@ -248,17 +357,306 @@ class SourceDetectionTask(pipeBase.Task):
             raise ValueError("Table has incorrect Schema")
         results = self.detectFootprints(exposure=exposure, doSmooth=doSmooth, sigma=sigma,
                                         clearMask=clearMask, expId=expId)
-        sources = afwTable.SourceCatalog(table)
-        sources.reserve(results.numPos + results.numNeg)
-        if results.negative:
-            results.negative.makeSources(sources)
-            if self.negativeFlagKey:
-                for record in sources:
-                    record.set(self.negativeFlagKey, True)
-        if results.positive:
-            results.positive.makeSources(sources)
+        self.makeSourceCatalog(table, results)
+        return results
+
+    @pipeBase.timeMethod
+    def runMany(self, table, exposures, doSmooth=True, sigma=None, clearMask=True, expIds=None,
+                sigmaTolerance=1.0e-3):
+        """Run source detection on several exposures, e.g. all the
+        detectors of a visit.
+
+        The exposures are detected in turn by this task, so the task and its
+        schema are set up once, and the source catalogs are made from the
+        single ``table``, so source IDs are assigned in the order of
+        ``exposures``. The Gaussian sigma of each distinct PSF object is
+        measured once, and PSFs whose sigmas agree to within
+        ``sigmaTolerance`` share a sigma, and hence a smoothing kernel.
+        The metadata recorded while detecting each exposure is returned
+        with its results, and combined into this task's metadata in the
+        order of ``exposures``.
+
+        Parameters
+        ----------
+        table : `lsst.afw.table.SourceTable`
+            Table object that will be used to create the SourceCatalogs.
+        exposures : `list` of `lsst.afw.image.Exposure`
+            Exposures to process; DETECTED mask planes will be set in-place.
+        doSmooth : `bool`
+            If True, smooth the images before detection; see `run`.
+        sigma : `float`
+            Sigma of PSF (pixels) for all exposures; if None then measure the
+            sigma of the PSF of each exposure.
+        clearMask : `bool`
+            Clear DETECTED{,_NEGATIVE} planes before running detection.
+        expIds : `list` of `int`, optional
+            Exposure identifiers, one for each exposure.
+        sigmaTolerance : `float`, optional
+            Relative difference below which the sigmas of two PSFs are
+            considered to agree.
+
+        Returns
+        -------
+        results : `list` of `lsst.pipe.base.Struct`
+            Results of `run` for each exposure, in the same order, each with
+            an additional ``metadata`` attribute
+            (`lsst.daf.base.PropertyList`) holding the metadata recorded
+            while detecting that exposure.
+
+        Raises
+        ------
+        ValueError
+            If flags.negative is needed, but isn't in table's schema, or if
+            the number of ``expIds`` doesn't match the number of exposures.
+        """
+        if self.negativeFlagKey is not None and self.negativeFlagKey not in table.getSchema():
+            raise ValueError("Table has incorrect Schema")
+        if expIds is None:
+            expIds = [None]*len(exposures)
+        if len(expIds) != len(exposures):
+            raise ValueError("Number of expIds (%d) does not match number of exposures (%d)" %
+                             (len(expIds), len(exposures)))
+
+        sigmas = []
+        psfSigmas = {}
+        distinctSigmas = []
+        for exposure in exposures:
+            psf = exposure.getPsf()
+            if sigma is None and psf is not None:
+                if id(psf) not in psfSigmas:
+                    psfSigma = psf.computeShape().getDeterminantRadius()
+                    for other in distinctSigmas:
+                        if abs(psfSigma - other) <= sigmaTolerance*other:
+                            psfSigma = other
+                            break
+                    else:
+                        distinctSigmas.append(psfSigma)
+                    # Holding the PSF keeps its id from being reused by another PSF
+                    psfSigmas[id(psf)] = (psf, psfSigma)
+                sigmas.append(psfSigmas[id(psf)][1])
+            else:
+                sigmas.append(sigma)
+
+        self.metadata.set("runManyNumExposures", len(exposures))
+        self.metadata.set("runManyNumPsfs", len(distinctSigmas))
+        metadata = self.metadata
+        detectionTime = 0.0
+        resultsList = []
+        for exposure, expSigma, expId in zip(exposures, sigmas, expIds):
+            self.metadata = dafBase.PropertyList()
+            try:
+                start = time.perf_counter()
+                results = self.detectFootprints(exposure=exposure, doSmooth=doSmooth, sigma=expSigma,
+                                                clearMask=clearMask, expId=expId)
+                duration = time.perf_counter() - start
+                results.metadata = self.metadata
+            finally:
+                self.metadata = metadata
+            self.metadata.combine(results.metadata)
+            self.metadata.add("runManyExposureDetectionTime", duration)
+            detectionTime += duration
+            self.makeSourceCatalog(table, results)
+            resultsList.append(results)
+        self.metadata.set("runManyDetectionTime", detectionTime)
+        return resultsList
+
+    def makeSourceCatalog(self, table, results):
+        """Make a SourceCatalog from detection results
+
+        Parameters
+        ----------
+        table : `lsst.afw.table.SourceTable`
+            Table object that will be used to create the SourceCatalog.
+        results : `lsst.pipe.base.Struct`
+            Results of `detectFootprints`; ``sources`` (the
+            `lsst.afw.table.SourceCatalog`) and ``fpSets`` are added.
+
+        Returns
+        -------
+        sources : `lsst.afw.table.SourceCatalog`
+            The detected sources.
+        """
+        with self.profileStage("makeSources"):
+            sources = afwTable.SourceCatalog(table)
+            # Reserving the records preallocates them in the table, so the catalog is contiguous
+            sources.reserve(results.numPos + results.numNeg)
+            if results.negative:
+                results.negative.makeSources(sources)
+                if self.negativeFlagKey:
+                    # Only the negative sources have been made so far
+                    for record in sources:
+                        record.set(self.negativeFlagKey, True)
+            if results.positive:
+                results.positive.makeSources(sources)
         results.fpSets = results.copy()  # Backward compatibility
         results.sources = sources
+        return sources
+
+    @pipeBase.timeMethod
+    def redetect(self, exposure, previous, dirtyBBoxes, doSmooth=True, sigma=None):
+        """Update detections after parts of an exposure have changed
+
+        Rather than detecting on the whole exposure again, only the regions
+        that may be affected by the changes are reconvolved and
+        rethresholded. Each dirty box is extended by the half-width of the
+        smoothing kernel and then, repeatedly, by the bounding boxes of the
+        previous footprints within ``2*nGrow + 1`` pixels of it, which might
+        change or merge with new detections. The previous footprints (and
+        sources) in the extended region are replaced by the new detections in
+        it, and the DETECTED{,_NEGATIVE} mask planes are updated there.
+
+        Provided that ``doSmooth`` and ``sigma`` are as for the previous
+        detection, the footprints, peaks and mask planes are as from
+        `detectFootprints` on the whole exposure, except that the footprints
+        are no longer in raster order (and groups of pixels above threshold
+        too small to be kept previously are not considered when extending the
+        regions). The background is not re-estimated.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Exposure that has changed; the DETECTED{,_NEGATIVE} mask planes
+            are updated in-place.
+        previous : `lsst.pipe.base.Struct`
+            Results of `run`, `detectFootprints` or this method for
+            ``exposure`` before it was changed; not modified.
+        dirtyBBoxes : iterable of `lsst.geom.Box2I`
+            Boxes (in PARENT coordinates) containing all of the changed
+            pixels.
+        doSmooth : `bool`, optional
+            Smooth the image before detection?
+        sigma : `float`, optional
+            Gaussian sigma of PSF (pixels); if `None` then measure the sigma
+            of the PSF of the exposure.
+
+        Returns
+        -------
+        results : `lsst.pipe.base.Struct`
+            Updated detection results, as for `detectFootprints`, with:
+
+            ``redetectedBBoxes``
+                Regions in which detection was repeated (`list` of
+                `lsst.geom.Box2I`).
+
+            If ``previous`` has ``sources`` (as made by `makeSourceCatalog`),
+            ``sources`` and ``fpSets`` are added as for `run`: the records of
+            the unaffected footprints are retained, with their IDs, and new
+            records are made for the new footprints.
+
+        Raises
+        ------
+        RuntimeError
+            If detection depends upon statistics over the whole exposure
+            (``thresholdType="stdev"`` or temporary backgrounds), or is
+            binned.
+        ValueError
+            If ``previous.sources`` doesn't match the previous footprints.
+        """
+        if (self.config.thresholdType == "stdev" or self.config.doTempLocalBackground
+                or self.config.doTempWideBackground or self.config.binFactor > 1):
+            raise RuntimeError("Incremental detection requires a per-pixel thresholdType, "
+                               "no temporary backgrounds and no binning")
+        maskedImage = exposure.maskedImage
+        mask = maskedImage.mask
+        bbox = maskedImage.getBBox()
+        sigma = self.getPsf(exposure, sigma=sigma).computeShape().getDeterminantRadius()
+        kWidth = self.calculateKernelSize(sigma) if doSmooth else 1
+        nGrow = int((self.config.nSigmaToGrow * sigma) + 0.5) if self.config.nSigmaToGrow > 0 else 0
+        goodBBox = lsst.geom.Box2I(bbox)
+        goodBBox.grow(-(kWidth//2))
+        factor = getattr(previous, "factor", 1.0)
+        detectedBits = mask.getPlaneBitMask(["DETECTED", "DETECTED_NEGATIVE"])
+
+        polarities = ("positive", "negative")
+        footprints = {}
+        for polarity in polarities:
+            fpSet = getattr(previous, polarity, None)
+            footprints[polarity] = list(fpSet.getFootprints()) if fpSet is not None else []
+        records = None
+        sources = getattr(previous, "sources", None)
+        if sources is not None:
+            numNeg = len(footprints["negative"])
+            if len(sources) != numNeg + len(footprints["positive"]):
+                raise ValueError("Number of previous sources (%d) does not match number of footprints (%d)" %
+                                 (len(sources), numNeg + len(footprints["positive"])))
+            records = {"negative": list(sources)[:numNeg], "positive": list(sources)[numNeg:]}
+
+        redetected = []
+        for dirty in dirtyBBoxes:
+            # Convolved pixels that may have changed
+            work = lsst.geom.Box2I(dirty)
+            work.grow(kWidth//2)
+            work.clip(goodBBox)
+            if work.isEmpty():
+                continue
+            # Extend to previous footprints that could change, or merge with new ones
+            affected = {polarity: set() for polarity in polarities}
+            while True:
+                search = lsst.geom.Box2I(work)
+                search.grow(2*nGrow + 1)
+                newlyAffected = [(polarity, ii) for polarity in polarities
+                                 for ii, fp in enumerate(footprints[polarity])
+                                 if ii not in affected[polarity] and search.overlaps(fp.getBBox())]
+                if not newlyAffected:
+                    break
+                for polarity, ii in newlyAffected:
+                    affected[polarity].add(ii)
+                    work.include(footprints[polarity][ii].getBBox())
+            redetected.append(lsst.geom.Box2I(work))
+
+            # Clear the old detections, including their growth
+            clearBBox = lsst.geom.Box2I(work)
+            clearBBox.grow(nGrow)
+            clearBBox.clip(bbox)
+            subMask = mask.Factory(mask, clearBBox, afwImage.PARENT, False)
+            subMask &= ~detectedBits
+
+            thresholdBBox = lsst.geom.Box2I(work)
+            thresholdBBox.clip(goodBBox)
+            inputBBox = lsst.geom.Box2I(thresholdBBox)
+            inputBBox.grow(kWidth//2)
+            subImage = maskedImage.Factory(maskedImage, inputBBox, afwImage.PARENT, False)
+            middle = self.convolveGaussian(subImage, sigma, kWidth) if doSmooth else subImage
+            results = self.applyThreshold(middle, bbox, factor)
+            self.finalizeFootprints(mask, results, sigma, factor)
+            self.clearUnwantedResults(mask, results)
+
+            for polarity in polarities:
+                fpSet = getattr(results, polarity)
+                footprints[polarity] = [fp for ii, fp in enumerate(footprints[polarity])
+                                        if ii not in affected[polarity]]
+                if fpSet is not None:
+                    footprints[polarity] += list(fpSet.getFootprints())
+                if records is not None:
+                    newSources = afwTable.SourceCatalog(sources.getTable())
+                    if fpSet is not None:
+                        newSources.reserve(len(fpSet.getFootprints()))
+                        fpSet.makeSources(newSources)
+                    if polarity == "negative" and self.negativeFlagKey:
+                        for record in newSources:
+                            record.set(self.negativeFlagKey, True)
+                    records[polarity] = [record for ii, record in enumerate(records[polarity])
+                                         if ii not in affected[polarity]] + list(newSources)
+        self.metadata.set("numRedetectedBBoxes", len(redetected))
+        self.metadata.set("redetectedArea", sum(box.getArea() for box in redetected))
+
+        results = pipeBase.Struct(positive=None, negative=None, numPos=0, numPosPeaks=0, numNeg=0,
+                                  numNegPeaks=0, factor=factor, redetectedBBoxes=redetected,
+                                  background=getattr(previous, "background", None))
+        for polarity, short in (("positive", "Pos"), ("negative", "Neg")):
+            if self.config.thresholdPolarity not in (polarity, "both"):
+                continue
+            fpSet = afwDet.FootprintSet(bbox)
+            fpSet.setFootprints(footprints[polarity])
+            setattr(results, polarity, fpSet)
+            setattr(results, "num" + short, len(footprints[polarity]))
+            setattr(results, "num" + short + "Peaks", sum(len(fp.getPeaks()) for fp in footprints[polarity]))
+        if records is not None:
+            results.fpSets = results.copy()  # Backward compatibility
+            results.sources = afwTable.SourceCatalog(sources.getTable())
+            results.sources.reserve(results.numPos + results.numNeg)
+            for record in records["negative"] + records["positive"]:
+                results.sources.append(record)
         return results
 
     def display(self, exposure, results, convolvedImage=None):
@@ -337,19 +735,26 @@ class SourceDetectionTask(pipeBase.Task):
             plot). This is a `Struct` with ``positive`` and ``negative``
             elements that are of type `lsst.afw.detection.FootprintSet`.
         """
-        # Subtract the local background from the smoothed image. Since we
-        # never use the smoothed again we don't need to worry about adding
-        # it back in.
-        bg = self.tempLocalBackground.fitBackground(exposure.getMaskedImage())
-        bgImage = bg.getImageF(self.tempLocalBackground.config.algorithm,
-                               self.tempLocalBackground.config.undersampleStyle)
-        middle -= bgImage.Factory(bgImage, middle.getBBox())
-        thresholdPos = self.makeThreshold(middle, "positive")
-        thresholdNeg = self.makeThreshold(middle, "negative")
-        if self.config.thresholdPolarity != "negative":
-            self.updatePeaks(results.positive, middle, thresholdPos)
-        if self.config.thresholdPolarity != "positive":
-            self.updatePeaks(results.negative, middle, thresholdNeg)
+        # The smoothed image may be a view of the exposure (doSmooth=False)
+        # or a cached convolution, so it must not be modified: the local
+        # background is only subtracted from copies of the regions searched
+        # for peaks.
+        with self.profileStage("tempLocalBackground"):
+            bg = self.tempLocalBackground.fitBackground(exposure.getMaskedImage())
+            bgImage = bg.getImageF(self.tempLocalBackground.config.algorithm,
+                                   self.tempLocalBackground.config.undersampleStyle)
+            bgImage = bgImage.Factory(bgImage, middle.getBBox())
+            if self.config.thresholdType == "stdev":
+                # The threshold is measured from the whole background-subtracted image
+                middle = middle.Factory(middle, True)
+                middle.image -= bgImage
+                bgImage = None
+            thresholdPos = self.makeThreshold(middle, "positive")
+            thresholdNeg = self.makeThreshold(middle, "negative")
+            if self.config.thresholdPolarity != "negative":
+                self.updatePeaks(results.positive, middle, thresholdPos, background=bgImage)
+            if self.config.thresholdPolarity != "positive":
+                self.updatePeaks(results.negative, middle, thresholdNeg, background=bgImage)
 
     def clearMask(self, mask):
         """Clear the DETECTED and DETECTED_NEGATIVE mask planes
@@ -419,10 +824,17 @@ class SourceDetectionTask(pipeBase.Task):
         correlation rather than a convolution, but since we use a symmetric
         Gaussian there's no difference.
 
-        The convolution can be disabled with ``doSmooth=False``. If we do
-        convolve, we mask the edges as ``EDGE`` and return the convolved image
-        with the edges removed. This is because we can't convolve the edges
-        because the kernel would extend off the image.
+        The convolution can be disabled with ``doSmooth=False``, in which
+        case a view of the input image is returned rather than a copy. If we
+        do convolve, we mask the edges as ``EDGE`` and return the convolved
+        image with the edges removed. This is because we can't convolve the
+        edges because the kernel would extend off the image.
+
+        Within `convolveCacheContext`, the convolved image is cached and
+        reused by later calls for the same image and kernel, provided that
+        the image has not been modified in the meantime (the task's own
+        modifications are registered with `markImageModified`). In either
+        case, the returned image must not be modified by the caller.
 
         Parameters
         ----------
@@ -447,30 +859,268 @@ class SourceDetectionTask(pipeBase.Task):
         self.metadata.set("sigma", sigma)
 
         if not doSmooth:
-            middle = maskedImage.Factory(maskedImage, deep=True)
+            # Thresholding only reads the image, so there is no need to copy it
+            middle = maskedImage.Factory(maskedImage, deep=False)
             return pipeBase.Struct(middle=middle, sigma=sigma)
 
         # Smooth using a Gaussian (which is separable, hence fast) of width sigma
         # Make a SingleGaussian (separable) kernel with the 'sigma'
         kWidth = self.calculateKernelSize(sigma)
         self.metadata.set("smoothingKernelWidth", kWidth)
-        gaussFunc = afwMath.GaussianFunction1D(sigma)
-        gaussKernel = afwMath.SeparableKernel(kWidth, kWidth, gaussFunc, gaussFunc)
+        cacheKey = self._getConvolveCacheKey(maskedImage, sigma, kWidth)
+        cached = self._convolveCache.get(cacheKey) if self._convolveCache is not None else None
+        if cached is not None:
+            middle = cached.middle
+            self.log.debug("Reusing convolved image for sigma=%g, kernel width %d", sigma, kWidth)
+            goodBBox = middle.getBBox()
+        else:
+            middle = self.convolveGaussian(maskedImage, sigma, kWidth)
+            goodBBox = middle.getBBox()
+            if self._convolveCache is not None:
+                # Holding the input keeps its address from being reused by another image
+                self._convolveCache[cacheKey] = pipeBase.Struct(input=maskedImage, middle=middle)
+        #
+        # Mark the parts of the image outside goodBBox as EDGE
+        #
+        self.setEdgeBits(maskedImage, goodBBox, maskedImage.getMask().getPlaneBitMask("EDGE"))
+
+        return pipeBase.Struct(middle=middle, sigma=sigma)
 
-        convolvedImage = maskedImage.Factory(maskedImage.getBBox())
+    def convolveGaussian(self, maskedImage, sigma, kWidth):
+        """Convolve an image with a Gaussian, using the configured engine
+
+        Parameters
+        ----------
+        maskedImage : `lsst.afw.image.MaskedImage`
+            Image to convolve; not modified.
+        sigma : `float`
+            Gaussian sigma of the kernel.
+        kWidth : `int`
+            Width of the kernel.
 
-        afwMath.convolve(convolvedImage, maskedImage, gaussKernel, afwMath.ConvolutionControl())
+        Returns
+        -------
+        middle : `lsst.afw.image.MaskedImage`
+            Convolved image, without the edges affected by the kernel
+            overhanging the image.
+        """
+        gaussKernel = self._kernelCache.get((sigma, kWidth))
+        if gaussKernel is None:
+            gaussFunc = afwMath.GaussianFunction1D(sigma)
+            gaussKernel = afwMath.SeparableKernel(kWidth, kWidth, gaussFunc, gaussFunc)
+            self._kernelCache[(sigma, kWidth)] = gaussKernel
+
+        engine = self.chooseConvolutionEngine(maskedImage.getBBox(), kWidth)
+        self.metadata.set("convolutionEngine", engine)
+        with self.profileStage("convolve"):
+            convolvedImage = maskedImage.Factory(maskedImage.getBBox())
+            if engine == "fft":
+                self.convolveFft(convolvedImage, maskedImage, gaussKernel)
+            else:
+                afwMath.convolve(convolvedImage, maskedImage, gaussKernel, afwMath.ConvolutionControl())
         #
         # Only search psf-smoothed part of frame
         #
         goodBBox = gaussKernel.shrinkBBox(convolvedImage.getBBox())
-        middle = convolvedImage.Factory(convolvedImage, goodBBox, afwImage.PARENT, False)
-        #
-        # Mark the parts of the image outside goodBBox as EDGE
-        #
-        self.setEdgeBits(maskedImage, goodBBox, maskedImage.getMask().getPlaneBitMask("EDGE"))
+        return convolvedImage.Factory(convolvedImage, goodBBox, afwImage.PARENT, False)
 
-        return pipeBase.Struct(middle=middle, sigma=sigma)
+    @contextmanager
+    def convolveCacheContext(self):
+        """Context manager enabling the reuse of convolved images
+
+        Within the context, `convolveImage` caches the convolved image,
+        keyed by the image, its version, and the smoothing kernel. The
+        version is advanced by `markImageModified` whenever the task
+        modifies the image, so a cached convolution is only reused if the
+        pixels are unchanged. The cache is discarded on exit; nested uses
+        share the outermost cache.
+
+        Returns
+        -------
+        context : context manager
+            Context manager that will discard the cache on exit.
+        """
+        if self._convolveCache is not None:
+            yield
+            return
+        self._convolveCache = {}
+        try:
+            yield
+        finally:
+            self._convolveCache = None
+
+    @contextmanager
+    def profileStage(self, stage):
+        """Context manager recording the cost of a stage of detection
+
+        The wall time is added to the ``<stage>Time`` entry of the task
+        metadata (seconds) and, if ``doProfileMemory``, the peak memory
+        allocated above that at the start of the stage to the
+        ``<stage>PeakMemory`` entry (bytes). Entries are added each time the
+        stage is run.
+
+        Parameters
+        ----------
+        stage : `str`
+            Name of the stage.
+
+        Returns
+        -------
+        context : context manager
+            Context manager that will record the cost on exit.
+        """
+        wasTracing = tracemalloc.is_tracing()
+        if self.config.doProfileMemory:
+            if not wasTracing:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            startMemory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.metadata.add(stage + "Time", time.perf_counter() - start)
+            if self.config.doProfileMemory:
+                self.metadata.add(stage + "PeakMemory", tracemalloc.get_traced_memory()[1] - startMemory)
+                if not wasTracing:
+                    tracemalloc.stop()
+
+    def markImageModified(self, maskedImage):
+        """Record that the pixels of an image have been modified
+
+        Convolved images cached by `convolveImage` are invalidated.
+
+        Parameters
+        ----------
+        maskedImage : `lsst.afw.image.MaskedImage`
+            Image that was modified.
+        """
+        self._imageVersion = next(self._imageVersionCounter)
+        if self._convolveCache is not None:
+            self._convolveCache = {}
+
+    def _getConvolveCacheKey(self, maskedImage, sigma, kWidth):
+        """Return the key for caching the convolution of an image
+
+        Parameters
+        ----------
+        maskedImage : `lsst.afw.image.MaskedImage`
+            Image to convolve.
+        sigma : `float`
+            Gaussian sigma of the smoothing kernel.
+        kWidth : `int`
+            Width of the smoothing kernel.
+
+        Returns
+        -------
+        key : `tuple`
+            Image version, pixel address, bounding box and kernel parameters.
+        """
+        bbox = maskedImage.getBBox()
+        return (self._imageVersion, maskedImage.image.array.ctypes.data,
+                bbox.getMinX(), bbox.getMinY(), bbox.getWidth(), bbox.getHeight(), sigma, kWidth)
+
+    def chooseConvolutionEngine(self, bbox, kWidth):
+        """Choose the algorithm used to convolve an image
+
+        For ``convolutionEngine="auto"``, the direct separable convolution
+        (two passes, each costing ``kWidth`` operations per pixel) is compared
+        with the fast Fourier transform (forward and inverse transforms of
+        the image and variance, each costing of order ``log2(numPixels)``
+        operations per pixel).
+
+        Parameters
+        ----------
+        bbox : `lsst.geom.Box2I`
+            Bounding box of the image to convolve.
+        kWidth : `int`
+            Width of the smoothing kernel.
+
+        Returns
+        -------
+        engine : `str`
+            Either ``"direct"`` or ``"fft"``.
+        """
+        if self.config.convolutionEngine != "auto":
+            return self.config.convolutionEngine
+        return "fft" if kWidth > 2*np.log2(max(bbox.getArea(), 2)) else "direct"
+
+    def convolveFft(self, convolvedImage, maskedImage, kernel):
+        """Convolve an image using fast Fourier transforms
+
+        The result matches that of `lsst.afw.math.convolve` to within
+        floating-point rounding: the image is convolved with the kernel, the
+        variance with the square of the kernel, and each mask bit is set if
+        it is set anywhere under the (non-zero part of the) kernel. Pixels
+        with a non-finite image or variance value under the kernel produce
+        NaN, rather than propagating into the whole image.
+
+        Parameters
+        ----------
+        convolvedImage : `lsst.afw.image.MaskedImage`
+            Image into which to write the convolution; the same size as
+            ``maskedImage``. Only the region not affected by the kernel
+            overhanging the edge is set.
+        maskedImage : `lsst.afw.image.MaskedImage`
+            Image to convolve.
+        kernel : `lsst.afw.math.Kernel`
+            Convolution kernel.
+        """
+        kernelImage = afwImage.ImageD(kernel.getDimensions())
+        kernel.computeImage(kernelImage, True)
+        kernelArray = kernelImage.array
+        kHeight, kWidth = kernelArray.shape
+        height, width = maskedImage.image.array.shape
+        goodBBox = kernel.shrinkBBox(maskedImage.getBBox())
+        if goodBBox.isEmpty():
+            return
+        goodSlices = (slice(kernel.getCtr().getY(), kernel.getCtr().getY() + goodBBox.getHeight()),
+                      slice(kernel.getCtr().getX(), kernel.getCtr().getX() + goodBBox.getWidth()))
+
+        # Non-zero part of the kernel, over which mask bits are OR-ed
+        rows = np.nonzero(np.any(kernelArray != 0, axis=1))[0]
+        cols = np.nonzero(np.any(kernelArray != 0, axis=0))[0]
+        support = (rows[0], cols[0], rows[-1] - rows[0] + 1, cols[-1] - cols[0] + 1)
+
+        def anyUnderKernel(flags):
+            """Return whether any of ``flags`` is set under the kernel, for
+            each pixel of the good region"""
+            # A separable running maximum of the booleans over the kernel
+            # support is their OR; each output pixel takes the window
+            # starting at that pixel
+            y0, x0, ny, nx = support
+            flags = flags[y0:y0 + goodBBox.getHeight() + ny - 1,
+                          x0:x0 + goodBBox.getWidth() + nx - 1].view(np.uint8)
+            result = scipy.ndimage.maximum_filter1d(flags, ny, axis=0, origin=-(ny//2))
+            result = scipy.ndimage.maximum_filter1d(result, nx, axis=1, origin=-(nx//2))
+            return result[:goodBBox.getHeight(), :goodBBox.getWidth()].view(bool)
+
+        def convolvePlane(array, kernelArray):
+            """Return the convolution of ``array``, for the good region"""
+            bad = ~np.isfinite(array)
+            array = np.where(bad, 0.0, array)
+            # Correlation is convolution with the flipped kernel; the valid
+            # part of the (circular) result is unaffected by wrap-around
+            kernelFft = np.fft.rfft2(kernelArray[::-1, ::-1], s=(height, width))
+            result = np.fft.irfft2(np.fft.rfft2(array, s=(height, width))*kernelFft, s=(height, width))
+            result = result[kHeight - 1:, kWidth - 1:]
+            if np.any(bad):
+                result[anyUnderKernel(bad)] = np.nan
+            return result
+
+        convolvedImage.image.array[goodSlices] = convolvePlane(maskedImage.image.array, kernelArray)
+        convolvedImage.variance.array[goodSlices] = convolvePlane(maskedImage.variance.array,
+                                                                  kernelArray**2)
+
+        unsigned = np.dtype("u%d" % maskedImage.mask.array.dtype.itemsize)
+        mask = maskedImage.mask.array.view(unsigned)
+        outMask = convolvedImage.mask.array.view(unsigned)[goodSlices]
+        allBits = int(np.bitwise_or.reduce(mask, axis=None))
+        for bit in range(8*unsigned.itemsize):
+            if allBits & (1 << bit):
+                value = unsigned.type(1 << bit)
+                outMask[anyUnderKernel((mask & value) != 0)] |= value
 
     def applyThreshold(self, middle, bbox, factor=1.0):
         """Apply thresholds to the convolved image
@@ -499,27 +1149,489 @@ class SourceDetectionTask(pipeBase.Task):
             Multiplier for the configured threshold.
         """
         results = pipeBase.Struct(positive=None, negative=None, factor=factor)
-        # Detect the Footprints (peaks may be replaced if doTempLocalBackground)
+        # Detect the Footprints (peaks may be replaced if doTempLocalBackground).
+        # No mask plane is set, as ``middle`` may be a view of the unconvolved image;
+        # the mask planes are set by finalizeFootprints.
+        with self.profileStage("threshold"):
+            if self.config.reEstimateBackground or self.config.thresholdPolarity != "negative":
+                threshold = self.makeThreshold(middle, "positive", factor=factor)
+                results.positive = afwDet.FootprintSet(
+                    middle,
+                    threshold,
+                    "",
+                    self.config.minPixels
+                )
+                results.positive.setRegion(bbox)
+            if self.config.reEstimateBackground or self.config.thresholdPolarity != "positive":
+                threshold = self.makeThreshold(middle, "negative", factor=factor)
+                results.negative = afwDet.FootprintSet(
+                    middle,
+                    threshold,
+                    "",
+                    self.config.minPixels
+                )
+                results.negative.setRegion(bbox)
+
+        return results
+
+    def applyThresholdHierarchy(self, middle, bbox, factors, factor=1.0):
+        """Detect nested footprints at several thresholds in a single pass
+
+        The pixels above the lowest threshold are found in one pass over the
+        convolved image, and their 8-connected neighbour pairs are weighted
+        by the fainter pixel of each pair. The footprints at each threshold
+        are then the connected components of the pixels and pairs above it,
+        so the cost of the higher levels scales with the number of detected
+        pixels rather than the size of the image. As for `applyThreshold`,
+        a footprint is only kept if its brightest pixel reaches
+        ``includeThresholdMultiplier`` times the threshold, footprints with
+        fewer than ``minPixels`` pixels are dropped, and the peaks are the
+        local maxima of the convolved image.
+
+        Parameters
+        ----------
+        middle : `lsst.afw.image.MaskedImage`
+            Convolved image to threshold.
+        bbox : `lsst.geom.Box2I`
+            Bounding box of unconvolved image.
+        factors : `list` of `float`
+            Multipliers for the configured threshold, one per level.
+        factor : `float`, optional
+            Additional multiplier for all of the levels.
+
+        Returns
+        -------
+        hierarchy : `list` of `lsst.pipe.base.Struct`
+            Detections at each level, in order of increasing threshold, with
+            components:
+
+            - ``factor``: multiplier for the configured threshold (`float`).
+            - ``positive``, ``negative``: footprints, as for `applyThreshold`
+              (`lsst.afw.detection.FootprintSet` or `None`).
+            - ``positiveParents``, ``negativeParents``: index of the footprint
+              at the previous level that contains each footprint, or -1 for
+              the first level (`numpy.ndarray` of `int` or `None`).
+        """
+        factors = sorted(factors)
+        hierarchy = [pipeBase.Struct(factor=level*factor, positive=None, negative=None,
+                                     positiveParents=None, negativeParents=None) for level in factors]
+        polarities = []
         if self.config.reEstimateBackground or self.config.thresholdPolarity != "negative":
-            threshold = self.makeThreshold(middle, "positive", factor=factor)
-            results.positive = afwDet.FootprintSet(
-                middle,
-                threshold,
-                "DETECTED",
-                self.config.minPixels
-            )
-            results.positive.setRegion(bbox)
+            polarities.append("positive")
         if self.config.reEstimateBackground or self.config.thresholdPolarity != "positive":
-            threshold = self.makeThreshold(middle, "negative", factor=factor)
-            results.negative = afwDet.FootprintSet(
-                middle,
-                threshold,
-                "DETECTED_NEGATIVE",
-                self.config.minPixels
-            )
-            results.negative.setRegion(bbox)
+            polarities.append("negative")
+        if not factors or not polarities:
+            return hierarchy
+
+        image = middle.image.array
+        scaled = self._scaleToThreshold(middle)
+        height, width = scaled.shape
+        x0, y0 = middle.getXY0()
+        thresholds = [self.config.thresholdValue*level*factor for level in factors]
+        multiplier = self.config.includeThresholdMultiplier
+
+        for polarity in polarities:
+            significance = scaled if polarity == "positive" else -scaled
+            with np.errstate(invalid="ignore"):
+                ys, xs = np.nonzero(significance >= thresholds[0])
+            values = significance[ys, xs]
+            index = np.full(scaled.shape, -1, dtype=np.int64)
+            index[ys, xs] = np.arange(len(values))
+            # Neighbouring pairs, each weighted by the lowest threshold at which it's connected
+            begins = []
+            ends = []
+            for dy, dx in ((0, 1), (1, -1), (1, 0), (1, 1)):
+                first = index[:height - dy, max(-dx, 0):width - max(dx, 0)]
+                second = index[dy:, max(dx, 0):width - max(-dx, 0)]
+                connected = (first >= 0) & (second >= 0)
+                begins.append(first[connected])
+                ends.append(second[connected])
+            begins = np.concatenate(begins)
+            ends = np.concatenate(ends)
+            weights = np.minimum(values[begins], values[ends])
+            filled = np.where(np.isnan(significance), -np.inf, significance)
+            localMax = scipy.ndimage.maximum_filter(filled, size=3, mode="constant", cval=-np.inf)
+            isPeak = filled[ys, xs] == localMax[ys, xs]
+
+            previousLabels = None
+            previousIndex = None
+            for level, threshold in zip(hierarchy, thresholds):
+                nodes = np.nonzero(values >= threshold)[0]
+                select = weights >= threshold
+                graph = scipy.sparse.coo_matrix((np.ones(select.sum(), dtype=np.int8),
+                                                 (begins[select], ends[select])),
+                                                shape=(len(values), len(values)))
+                numLabels, labels = scipy.sparse.csgraph.connected_components(graph, directed=False)
+                area = np.bincount(labels[nodes], minlength=numLabels)
+                brightest = np.full(numLabels, -np.inf)
+                np.maximum.at(brightest, labels[nodes], values[nodes])
+                keep = (area >= max(self.config.minPixels, 1)) & (brightest >= threshold*multiplier)
+
+                # Pixels of the kept footprints, in raster order within each footprint
+                order = nodes[np.lexsort((xs[nodes], ys[nodes], labels[nodes]))]
+                order = order[keep[labels[order]]]
+                isFirst = np.ones(len(order), dtype=bool)
+                isFirst[1:] = labels[order[1:]] != labels[order[:-1]]
+                firsts = order[isFirst]
+                # Footprints are in raster order of their first pixels, as from afw
+                footprintOrder = np.lexsort((xs[firsts], ys[firsts]))
+                footprintIndex = np.full(numLabels, -1, dtype=np.int64)
+                footprintIndex[labels[firsts[footprintOrder]]] = np.arange(len(firsts))
+
+                isRunStart = isFirst.copy()
+                isRunStart[1:] |= (ys[order[1:]] != ys[order[:-1]]) | (xs[order[1:]] != xs[order[:-1]] + 1)
+                runStarts = np.nonzero(isRunStart)[0]
+                runEnds = np.append(runStarts[1:], len(order))[:len(runStarts)] - 1
+                spans = [[] for _ in range(len(firsts))]
+                for start, end in zip(order[runStarts], order[runEnds]):
+                    spans[footprintIndex[labels[start]]].append(
+                        afwGeom.Span(int(y0 + ys[start]), int(x0 + xs[start]), int(x0 + xs[end])))
+                peaks = [[] for _ in range(len(firsts))]
+                for pixel in order[isPeak[order]]:
+                    peaks[footprintIndex[labels[pixel]]].append((int(x0 + xs[pixel]), int(y0 + ys[pixel]),
+                                                                 float(image[ys[pixel], xs[pixel]])))
+                footprints = []
+                for footprintSpans, footprintPeaks in zip(spans, peaks):
+                    fp = afwDet.Footprint(afwGeom.SpanSet(footprintSpans), bbox)
+                    for x, y, value in sorted(footprintPeaks, key=lambda peak: -abs(peak[2])):
+                        fp.addPeak(x, y, value)
+                    footprints.append(fp)
+                fpSet = afwDet.FootprintSet(bbox)
+                fpSet.setFootprints(footprints)
+                setattr(level, polarity, fpSet)
+
+                # A footprint lies within a single footprint at the previous level
+                if previousLabels is None:
+                    parents = np.full(len(firsts), -1, dtype=np.int64)
+                else:
+                    parents = previousIndex[previousLabels[firsts[footprintOrder]]]
+                setattr(level, polarity + "Parents", parents)
+                previousLabels = labels
+                previousIndex = footprintIndex
+        return hierarchy
+
+    def applyBinnedThreshold(self, exposure, psf, doSmooth=True, factor=1.0):
+        """Detect footprints on a binned copy of an exposure
+
+        The image is binned by ``binFactor`` and convolved with a Gaussian
+        that is narrower by the same factor, thresholded (including the
+        temporary local background, if configured), and the resulting
+        footprints and peaks are mapped back to the unbinned pixels. The
+        ``EDGE`` mask plane of the exposure is set for the pixels whose
+        binned counterparts could not be convolved.
 
-        return results
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Exposure on which to detect.
+        psf : `lsst.afw.detection.Psf`
+            PSF of the unbinned exposure (actually its Gaussian width is
+            used).
+        doSmooth : `bool`, optional
+            Convolve the binned image?
+        factor : `float`, optional
+            Multiplier for the configured threshold.
+
+        Returns
+        -------
+        results : `lsst.pipe.base.Struct`
+            Results struct with components:
+
+            - ``results``: detection results, as returned by
+              `applyThreshold`, in unbinned pixels
+              (`lsst.pipe.base.Struct`).
+            - ``middle``: convolved binned image
+              (`lsst.afw.image.MaskedImage`).
+            - ``sigma``: Gaussian sigma of the unbinned PSF (`float`).
+        """
+        binFactor = self.config.binFactor
+        maskedImage = exposure.maskedImage
+        bbox = maskedImage.getBBox()
+        binned = self.binImage(maskedImage, binFactor)
+        sigma = psf.computeShape().getDeterminantRadius()
+        binnedPsf = self.getPsf(exposure, sigma=sigma/binFactor)
+        middle = self.convolveImage(binned, binnedPsf, doSmooth=doSmooth).middle
+        self.metadata.set("sigma", sigma)
+
+        binnedResults = self.applyThreshold(middle, binned.getBBox(), factor)
+        if self.config.doTempLocalBackground:
+            self.applyTempLocalBackground(afwImage.makeExposure(binned), middle, binnedResults)
+
+        results = pipeBase.Struct(positive=None, negative=None, factor=factor)
+        for polarity in ("positive", "negative"):
+            fpSet = getattr(binnedResults, polarity)
+            if fpSet is not None:
+                setattr(results, polarity, self.unbinFootprints(fpSet, binFactor, bbox))
+
+        middleBBox = middle.getBBox()
+        goodBBox = lsst.geom.Box2I(
+            bbox.getMin() + lsst.geom.Extent2I(middleBBox.getMin())*binFactor,
+            middleBBox.getDimensions()*binFactor
+        )
+        self.setEdgeBits(maskedImage, goodBBox, maskedImage.getMask().getPlaneBitMask("EDGE"))
+        return pipeBase.Struct(results=results, middle=middle, sigma=sigma)
+
+    @staticmethod
+    def binImage(maskedImage, binFactor):
+        """Bin a masked image, propagating the variance
+
+        Each binned pixel is the mean of ``binFactor`` x ``binFactor``
+        pixels, its variance is the variance of that mean, and its mask is
+        the OR of their masks. Pixels that do not fill a whole bin at the
+        upper edges of the image are dropped.
+
+        Parameters
+        ----------
+        maskedImage : `lsst.afw.image.MaskedImage`
+            Image to bin.
+        binFactor : `int`
+            Binning factor.
+
+        Returns
+        -------
+        binned : `lsst.afw.image.MaskedImage`
+            Binned image, with its origin at ``(0, 0)``: binned pixel
+            ``(i, j)`` covers the pixels from ``xy0 + binFactor*(i, j)``.
+        """
+        height = maskedImage.getHeight()//binFactor
+        width = maskedImage.getWidth()//binFactor
+        binned = maskedImage.Factory(width, height)
+        shape = (height, binFactor, width, binFactor)
+
+        def blocks(array):
+            return array[:height*binFactor, :width*binFactor].reshape(shape)
+
+        binned.image.array[:] = blocks(maskedImage.image.array).mean(axis=(1, 3))
+        binned.variance.array[:] = blocks(maskedImage.variance.array).sum(axis=(1, 3))/binFactor**4
+        binned.mask.array[:] = np.bitwise_or.reduce(blocks(maskedImage.mask.array), axis=(1, 3))
+        return binned
+
+    @staticmethod
+    def unbinFootprints(fpSet, binFactor, bbox):
+        """Map footprints detected on a binned image to unbinned pixels
+
+        Each binned pixel of a footprint becomes the ``binFactor`` x
+        ``binFactor`` block of pixels that it was binned from, and each peak
+        is placed at the center of its block.
+
+        Parameters
+        ----------
+        fpSet : `lsst.afw.detection.FootprintSet`
+            Footprints on an image binned by `binImage`.
+        binFactor : `int`
+            Binning factor.
+        bbox : `lsst.geom.Box2I`
+            Bounding box of the unbinned image.
+
+        Returns
+        -------
+        unbinned : `lsst.afw.detection.FootprintSet`
+            Footprints in the pixels of the unbinned image.
+        """
+        x0, y0 = bbox.getMinX(), bbox.getMinY()
+        footprints = []
+        for fp in fpSet.getFootprints():
+            spans = [afwGeom.Span(y0 + span.getY()*binFactor + dy, x0 + span.getMinX()*binFactor,
+                                  x0 + (span.getMaxX() + 1)*binFactor - 1)
+                     for span in fp.spans for dy in range(binFactor)]
+            unbinned = afwDet.Footprint(afwGeom.SpanSet(spans), bbox)
+            for peak in fp.getPeaks():
+                unbinned.addPeak(x0 + peak.getIx()*binFactor + binFactor//2,
+                                 y0 + peak.getIy()*binFactor + binFactor//2, peak.getPeakValue())
+            footprints.append(unbinned)
+        unbinnedSet = afwDet.FootprintSet(bbox)
+        unbinnedSet.setFootprints(footprints)
+        return unbinnedSet
+
+    def _scaleToThreshold(self, middle):
+        """Scale a convolved image so that the thresholds are multiples of
+        ``thresholdValue``
+
+        Parameters
+        ----------
+        middle : `lsst.afw.image.MaskedImage`
+            Convolved image.
+
+        Returns
+        -------
+        scaled : `numpy.ndarray`
+            Scaled image, with NaN for pixels that are not finite.
+        """
+        image = middle.image.array
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if self.config.thresholdType == "pixel_stdev":
+                scaled = image/np.sqrt(middle.variance.array)
+            elif self.config.thresholdType == "variance":
+                scaled = image/middle.variance.array
+            elif self.config.thresholdType == "stdev":
+                scaled = image/self.measureStdev(middle)
+            else:
+                scaled = image.astype(float)
+        scaled[~np.isfinite(scaled)] = np.nan
+        return scaled
+
+    def applyStripThreshold(self, exposure, psf, doSmooth=True, factor=1.0):
+        """Detect footprints by convolving and thresholding in strips
+
+        The image is processed in horizontal strips of ``stripHeight`` rows,
+        each convolved from a sub-image extended by the kernel half-width,
+        so that no more than one strip of convolved data is held at a time.
+        Adjacent strips overlap by a row on either side, so footprints that
+        cross a strip boundary share pixels and are joined, and peaks are
+        found against all of their neighbours. The strips are thresholded
+        without ``includeThresholdMultiplier``, which is applied to the
+        joined footprints, since the brightest pixel of a footprint may lie
+        in another strip. The result is the same as for `applyThreshold` on
+        the whole convolved image.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Exposure on which to detect; the ``EDGE`` mask plane is set.
+        psf : `lsst.afw.detection.Psf`
+            PSF to convolve with (actually with a Gaussian approximation
+            to it).
+        doSmooth : `bool`, optional
+            Convolve the image?
+        factor : `float`, optional
+            Multiplier for the configured threshold.
+
+        Returns
+        -------
+        results : `lsst.pipe.base.Struct`
+            Results struct with components:
+
+            - ``results``: detection results, as returned by
+              `applyThreshold` (`lsst.pipe.base.Struct`).
+            - ``sigma``: Gaussian sigma used for the convolution (`float`).
+        """
+        maskedImage = exposure.maskedImage
+        bbox = maskedImage.getBBox()
+        sigma = psf.computeShape().getDeterminantRadius()
+        self.metadata.set("doSmooth", doSmooth)
+        self.metadata.set("sigma", sigma)
+        kWidth = self.calculateKernelSize(sigma) if doSmooth else 1
+        self.metadata.set("smoothingKernelWidth", kWidth)
+        goodBBox = lsst.geom.Box2I(bbox)
+        goodBBox.grow(-(kWidth//2))
+
+        polarities = []
+        if self.config.reEstimateBackground or self.config.thresholdPolarity != "negative":
+            polarities.append("positive")
+        if self.config.reEstimateBackground or self.config.thresholdPolarity != "positive":
+            polarities.append("negative")
+        openPieces = {polarity: [] for polarity in polarities}
+        closedPieces = {polarity: [] for polarity in polarities}
+        multiplier = self.config.includeThresholdMultiplier
+
+        numStrips = 0
+        for y0 in range(goodBBox.getBeginY(), goodBBox.getEndY(), self.config.stripHeight):
+            y1 = min(y0 + self.config.stripHeight, goodBBox.getEndY())
+            # Overlap by a row either side, to join footprints and to test peaks against their neighbours
+            rowBegin = max(y0 - 1, goodBBox.getBeginY())
+            rowEnd = min(y1 + 1, goodBBox.getEndY())
+            inputBBox = lsst.geom.Box2I(lsst.geom.Point2I(bbox.getMinX(), rowBegin - kWidth//2),
+                                        lsst.geom.Point2I(bbox.getMaxX(), rowEnd - 1 + kWidth//2))
+            strip = maskedImage.Factory(maskedImage, inputBBox, afwImage.PARENT, False)
+            middle = self.convolveGaussian(strip, sigma, kWidth) if doSmooth else strip
+            numStrips += 1
+            scaled = self._scaleToThreshold(middle) if multiplier != 1.0 else None
+
+            for polarity in polarities:
+                threshold = self.makeThreshold(middle, polarity, factor=factor)
+                threshold.setIncludeMultiplier(1.0)
+                pieces = []
+                for fp in afwDet.FootprintSet(middle, threshold, "", 1).getFootprints():
+                    peaks = [(peak.getIx(), peak.getIy(), peak.getPeakValue()) for peak in fp.getPeaks()
+                             if y0 <= peak.getIy() < y1]
+                    brightest = np.inf
+                    if scaled is not None:
+                        values = fp.spans.flatten(scaled if polarity == "positive" else -scaled,
+                                                  middle.getXY0())
+                        brightest = np.max(np.where(np.isnan(values), -np.inf, values))
+                    pieces.append(pipeBase.Struct(spans=fp.spans, peaks=peaks, brightest=brightest))
+                merged = self._joinFootprintPieces(openPieces[polarity], pieces, rowBegin)
+                isOpen = [y1 < goodBBox.getEndY() and piece.spans.getBBox().getMaxY() >= y1 - 1
+                          for piece in merged]
+                openPieces[polarity] = [piece for piece, flag in zip(merged, isOpen) if flag]
+                closedPieces[polarity] += [piece for piece, flag in zip(merged, isOpen) if not flag]
+        self.metadata.set("numDetectionStrips", numStrips)
+
+        def firstPixel(piece):
+            span = next(iter(piece.spans))
+            return span.getY(), span.getMinX()
+
+        results = pipeBase.Struct(positive=None, negative=None, factor=factor)
+        for polarity in polarities:
+            pieces = sorted(closedPieces[polarity] + openPieces[polarity], key=firstPixel)
+            footprints = []
+            for piece in pieces:
+                if piece.spans.getArea() < self.config.minPixels:
+                    continue
+                if piece.brightest < self.config.thresholdValue*factor*multiplier:
+                    continue
+                fp = afwDet.Footprint(piece.spans, bbox)
+                for x, y, value in sorted(piece.peaks, key=lambda peak: -abs(peak[2])):
+                    fp.addPeak(x, y, value)
+                footprints.append(fp)
+            fpSet = afwDet.FootprintSet(bbox)
+            fpSet.setFootprints(footprints)
+            setattr(results, polarity, fpSet)
+
+        self.setEdgeBits(maskedImage, goodBBox, maskedImage.getMask().getPlaneBitMask("EDGE"))
+        return pipeBase.Struct(results=results, sigma=sigma)
+
+    @staticmethod
+    def _joinFootprintPieces(openPieces, newPieces, rowBegin):
+        """Join the pieces of footprints from adjacent strips
+
+        Parameters
+        ----------
+        openPieces : `list` of `lsst.pipe.base.Struct`
+            Pieces from previous strips that reach the current strip, each
+            with ``spans`` (`lsst.afw.geom.SpanSet`), ``peaks`` (`list`
+            of ``(x, y, value)``) and ``brightest`` (`float`, the largest
+            pixel value in units of ``thresholdValue``).
+        newPieces : `list` of `lsst.pipe.base.Struct`
+            Pieces detected in the current strip.
+        rowBegin : `int`
+            First row of the current strip, including its overlap; only new
+            pieces reaching this row can join an open piece.
+
+        Returns
+        -------
+        merged : `list` of `lsst.pipe.base.Struct`
+            Pieces, with all overlapping pieces joined.
+        """
+        pieces = openPieces + newPieces
+        parent = list(range(len(pieces)))
+
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+
+        for ii, old in enumerate(openPieces):
+            oldBBox = old.spans.getBBox()
+            for jj, new in enumerate(newPieces, len(openPieces)):
+                newBBox = new.spans.getBBox()
+                if newBBox.getMinY() > rowBegin + 1 or not oldBBox.overlaps(newBBox):
+                    continue
+                if old.spans.overlaps(new.spans):
+                    parent[find(jj)] = find(ii)
+
+        groups = {}
+        for index, piece in enumerate(pieces):
+            groups.setdefault(find(index), []).append(piece)
+        merged = []
+        for group in groups.values():
+            spans = group[0].spans
+            for piece in group[1:]:
+                spans = spans.union(piece.spans)
+            merged.append(pipeBase.Struct(spans=spans, peaks=sum((piece.peaks for piece in group), []),
+                                          brightest=max(piece.brightest for piece in group)))
+        return merged
 
     def finalizeFootprints(self, mask, results, sigma, factor=1.0):
         """Finalize the detected footprints
@@ -551,13 +1663,16 @@ class SourceDetectionTask(pipeBase.Task):
             if self.config.nSigmaToGrow > 0:
                 nGrow = int((self.config.nSigmaToGrow * sigma) + 0.5)
                 self.metadata.set("nGrow", nGrow)
-                if self.config.combinedGrow:
-                    fpSet = afwDet.FootprintSet(fpSet, nGrow, self.config.isotropicGrow)
-                else:
-                    stencil = (afwGeom.Stencil.CIRCLE if self.config.isotropicGrow else
-                               afwGeom.Stencil.MANHATTAN)
-                    for fp in fpSet:
-                        fp.dilate(nGrow, stencil)
+                with self.profileStage("grow"):
+                    if self.config.growEngine == "distance":
+                        fpSet = self.growFootprintsByDistance(fpSet, nGrow)
+                    elif self.config.combinedGrow:
+                        fpSet = afwDet.FootprintSet(fpSet, nGrow, self.config.isotropicGrow)
+                    else:
+                        stencil = (afwGeom.Stencil.CIRCLE if self.config.isotropicGrow else
+                                   afwGeom.Stencil.MANHATTAN)
+                        for fp in fpSet:
+                            fp.dilate(nGrow, stencil)
             fpSet.setMask(mask, maskName)
             if not self.config.returnOriginalFootprints:
                 setattr(results, polarity, fpSet)
@@ -583,9 +1698,143 @@ class SourceDetectionTask(pipeBase.Task):
                        self.config.thresholdValue*self.config.includeThresholdMultiplier*factor,
                        "DN" if self.config.thresholdType == "value" else "sigma"))
 
+    def growFootprintsByDistance(self, fpSet, nGrow):
+        """Grow footprints using a single distance transform
+
+        The distance of every pixel from the nearest footprint is computed
+        once (Euclidean if ``isotropicGrow``, otherwise Manhattan), and the
+        pixels within ``nGrow`` are added. If ``combinedGrow``, footprints
+        that touch after growing are merged, as for
+        `lsst.afw.detection.FootprintSet` growing. Otherwise each grown pixel
+        is assigned to its nearest footprint, so the footprints never merge
+        (nor overlap). Either way, the union of the grown footprints is the
+        same as for growing with afw.
+
+        Parameters
+        ----------
+        fpSet : `lsst.afw.detection.FootprintSet`
+            Footprints to grow.
+        nGrow : `int`
+            Number of pixels by which to grow.
+
+        Returns
+        -------
+        grown : `lsst.afw.detection.FootprintSet`
+            Grown footprints, with the peaks of the original footprints.
+        """
+        region = fpSet.getRegion()
+        footprints = list(fpSet.getFootprints())
+        grown = afwDet.FootprintSet(region)
+        if not footprints:
+            return grown
+        labels = self._labelFootprints(footprints, region)
+        isBackground = labels == 0
+
+        if self.config.isotropicGrow:
+            if self.config.combinedGrow:
+                distance = scipy.ndimage.distance_transform_edt(isBackground)
+            else:
+                distance, indices = scipy.ndimage.distance_transform_edt(isBackground, return_indices=True)
+            inGrown = np.rint(distance**2) <= nGrow**2
+        else:
+            if self.config.combinedGrow:
+                distance = scipy.ndimage.distance_transform_cdt(isBackground, metric="taxicab")
+            else:
+                distance, indices = scipy.ndimage.distance_transform_cdt(isBackground, metric="taxicab",
+                                                                         return_indices=True)
+            inGrown = distance <= nGrow
+
+        if self.config.combinedGrow:
+            # Let afw find the connected regions, so they are the same as for afw growing
+            grownMask = afwImage.Mask(region)
+            grownMask.array[:] = np.where(inGrown, 1, 0)
+            grown = afwDet.FootprintSet(grownMask, afwDet.Threshold(1, afwDet.Threshold.BITMASK))
+            grown.setRegion(region)
+            grownFootprints = list(grown.getFootprints())
+            grownLabels = self._labelFootprints(grownFootprints, region)
+            for fp in footprints:
+                peaks = fp.getPeaks()
+                if len(peaks) == 0:
+                    continue
+                first = peaks[0]
+                target = grownFootprints[grownLabels[first.getIy() - region.getMinY(),
+                                                     first.getIx() - region.getMinX()] - 1]
+                for peak in peaks:
+                    target.addPeak(peak.getFx(), peak.getFy(), peak.getPeakValue())
+            for fp in grownFootprints:
+                fp.sortPeaks()
+            return grown
+
+        nearest = np.where(inGrown, labels[tuple(indices)], 0)
+        slices = scipy.ndimage.find_objects(nearest, max_label=len(footprints))
+        grownFootprints = []
+        for label, (fp, objectSlice) in enumerate(zip(footprints, slices), 1):
+            spans = self._makeSpanSet(nearest[objectSlice] == label,
+                                      region.getMinX() + objectSlice[1].start,
+                                      region.getMinY() + objectSlice[0].start)
+            grownFp = afwDet.Footprint(spans, region)
+            for peak in fp.getPeaks():
+                grownFp.addPeak(peak.getFx(), peak.getFy(), peak.getPeakValue())
+            grownFootprints.append(grownFp)
+        grown.setFootprints(grownFootprints)
+        return grown
+
+    @staticmethod
+    def _labelFootprints(footprints, region):
+        """Make an array labelling the pixels of each footprint
+
+        Parameters
+        ----------
+        footprints : `list` of `lsst.afw.detection.Footprint`
+            Non-overlapping footprints.
+        region : `lsst.geom.Box2I`
+            Bounding box of the array.
+
+        Returns
+        -------
+        labels : `numpy.ndarray` of `int`
+            Index (starting at 1) of the footprint containing each pixel, or
+            0 for pixels in no footprint.
+        """
+        labels = np.zeros((region.getHeight(), region.getWidth()), dtype=np.int32)
+        x0, y0 = region.getMinX(), region.getMinY()
+        for label, fp in enumerate(footprints, 1):
+            for span in fp.spans:
+                labels[span.getY() - y0, span.getMinX() - x0:span.getMaxX() + 1 - x0] = label
+        return labels
+
+    @staticmethod
+    def _makeSpanSet(array, x0, y0):
+        """Make a SpanSet from the set pixels of a boolean array
+
+        Parameters
+        ----------
+        array : `numpy.ndarray` of `bool`, (N, M)
+            Pixels to include.
+        x0, y0 : `int`
+            Position of ``array[0, 0]``.
+
+        Returns
+        -------
+        spans : `lsst.afw.geom.SpanSet`
+            Set pixels of ``array``.
+        """
+        padded = np.zeros((array.shape[0], array.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = array
+        edges = np.diff(padded, axis=1)
+        rows, starts = np.nonzero(edges == 1)
+        _, ends = np.nonzero(edges == -1)
+        return afwGeom.SpanSet([afwGeom.Span(int(y0 + yy), int(x0 + start), int(x0 + end - 1))
+                                for yy, start, end in zip(rows, starts, ends)])
+
     def reEstimateBackground(self, maskedImage, backgrounds):
         """Estimate the background after detection
 
+        With ``doIncrementalBackground``, the statistics of the background
+        bins are kept between calls for the same image, and only the bins
+        whose good pixels have changed (e.g., by new detections) are
+        measured again.
+
         Parameters
         ----------
         maskedImage : `lsst.afw.image.MaskedImage`
@@ -598,13 +1847,20 @@ class SourceDetectionTask(pipeBase.Task):
         bg : `lsst.afw.math.backgroundMI`
             Empirical background model.
         """
-        bg = self.background.fitBackground(maskedImage)
-        if self.config.adjustBackground:
-            self.log.warn("Fiddling the background by %g", self.config.adjustBackground)
-            bg += self.config.adjustBackground
-        self.log.info("Resubtracting the background after object detection")
-        maskedImage -= bg.getImageF(self.background.config.algorithm,
-                                    self.background.config.undersampleStyle)
+        with self.profileStage("reEstimateBackground"):
+            binStats = None
+            if self.config.doIncrementalBackground:
+                binStats = self._getBackgroundBinStatistics(maskedImage)
+            bg = self.background.fitBackground(maskedImage, binStats=binStats)
+            if self.config.adjustBackground:
+                self.log.warn("Fiddling the background by %g", self.config.adjustBackground)
+                bg += self.config.adjustBackground
+            self.log.info("Resubtracting the background after object detection")
+            bgImage = self.background.subtractBackgroundModel(maskedImage, bg)
+            self.markImageModified(maskedImage)
+            if binStats is not None:
+                self.metadata.add("numMeasuredBackgroundBins", binStats.numMeasured)
+                self._updateBackgroundBinStatistics(maskedImage, bgImage.array if bgImage is not None else bg)
 
         actrl = bg.getBackgroundControl().getApproximateControl()
         backgrounds.append((bg, getattr(afwMath.Interpolate, self.background.config.algorithm),
@@ -612,6 +1868,66 @@ class SourceDetectionTask(pipeBase.Task):
                             actrl.getOrderY(), actrl.getWeighting()))
         return bg
 
+    def _getBackgroundBinStatistics(self, maskedImage):
+        """Return the statistics of the background bins kept for an image
+
+        Only the statistics for the last image whose background was
+        re-estimated are kept. They are validated bin by bin by
+        `SubtractBackgroundTask.fitBackground`, so pixels modified outside
+        this task only cause the affected bins to be measured again.
+
+        Parameters
+        ----------
+        maskedImage : `lsst.afw.image.MaskedImage`
+            Image whose background is to be re-estimated.
+
+        Returns
+        -------
+        binStats : `lsst.pipe.base.Struct`
+            Statistics of the background bins; empty if none are kept for
+            ``maskedImage``.
+        """
+        key = self._getBackgroundBinStatisticsKey(maskedImage)
+        if self._backgroundBinStatistics is None or self._backgroundBinStatistics[0] != key:
+            self._backgroundBinStatistics = (key, pipeBase.Struct())
+        return self._backgroundBinStatistics[1]
+
+    def _updateBackgroundBinStatistics(self, maskedImage, model):
+        """Update the statistics of the background bins kept for an image
+        after a model is subtracted from it
+
+        Parameters
+        ----------
+        maskedImage : `lsst.afw.image.MaskedImage`
+            Image from which ``model`` has been subtracted.
+        model : `float`, `numpy.ndarray` or `lsst.afw.math.Background`
+            Model that has been subtracted.
+        """
+        if self._backgroundBinStatistics is None:
+            return
+        key, binStats = self._backgroundBinStatistics
+        if key == self._getBackgroundBinStatisticsKey(maskedImage) and hasattr(binStats, "value"):
+            self.background.updateBinStatistics(binStats, maskedImage, model)
+
+    @staticmethod
+    def _getBackgroundBinStatisticsKey(maskedImage):
+        """Return the key identifying the image whose background bin
+        statistics are kept
+
+        Parameters
+        ----------
+        maskedImage : `lsst.afw.image.MaskedImage`
+            Image whose background is re-estimated.
+
+        Returns
+        -------
+        key : `tuple`
+            Address of the pixels and bounding box of the image.
+        """
+        bbox = maskedImage.getBBox()
+        return (maskedImage.image.array.ctypes.data, bbox.getMinX(), bbox.getMinY(),
+                bbox.getWidth(), bbox.getHeight())
+
     def clearUnwantedResults(self, mask, results):
         """Clear unwanted results from the Struct of results
 
@@ -678,6 +1994,9 @@ class SourceDetectionTask(pipeBase.Task):
         factor : `float`
             Multiplication factor applied to the configured detection
             threshold.
+        hierarchy : `list` of `lsst.pipe.base.Struct`
+            Footprints at each of ``thresholdHierarchyFactors``, as returned
+            by `applyThresholdHierarchy`; only if that is set.
         """
         maskedImage = exposure.maskedImage
 
@@ -685,15 +2004,29 @@ class SourceDetectionTask(pipeBase.Task):
             self.clearMask(maskedImage.getMask())
 
         psf = self.getPsf(exposure, sigma=sigma)
-        with self.tempWideBackgroundContext(exposure):
-            convolveResults = self.convolveImage(maskedImage, psf, doSmooth=doSmooth)
-            middle = convolveResults.middle
-            sigma = convolveResults.sigma
-
-            results = self.applyThreshold(middle, maskedImage.getBBox())
+        with self.convolveCacheContext(), self.tempWideBackgroundContext(exposure):
+            if self.config.binFactor > 1:
+                binResults = self.applyBinnedThreshold(exposure, psf, doSmooth=doSmooth)
+                results = binResults.results
+                middle = binResults.middle
+                sigma = binResults.sigma
+            elif self.config.stripHeight > 0:
+                stripResults = self.applyStripThreshold(exposure, psf, doSmooth=doSmooth)
+                results = stripResults.results
+                middle = None
+                sigma = stripResults.sigma
+            else:
+                convolveResults = self.convolveImage(maskedImage, psf, doSmooth=doSmooth)
+                middle = convolveResults.middle
+                sigma = convolveResults.sigma
+
+                results = self.applyThreshold(middle, maskedImage.getBBox())
+                if self.config.thresholdHierarchyFactors:
+                    results.hierarchy = self.applyThresholdHierarchy(
+                        middle, maskedImage.getBBox(), self.config.thresholdHierarchyFactors)
+                if self.config.doTempLocalBackground:
+                    self.applyTempLocalBackground(exposure, middle, results)
             results.background = afwMath.BackgroundList()
-            if self.config.doTempLocalBackground:
-                self.applyTempLocalBackground(exposure, middle, results)
             self.finalizeFootprints(maskedImage.mask, results, sigma)
 
             if self.config.reEstimateBackground:
@@ -728,18 +2061,35 @@ class SourceDetectionTask(pipeBase.Task):
         thresholdValue = self.config.thresholdValue
         thresholdType = self.config.thresholdType
         if self.config.thresholdType == 'stdev':
-            bad = image.getMask().getPlaneBitMask(self.config.statsMask)
-            sctrl = afwMath.StatisticsControl()
-            sctrl.setAndMask(bad)
-            stats = afwMath.makeStatistics(image, afwMath.STDEVCLIP, sctrl)
-            thresholdValue *= stats.getValue(afwMath.STDEVCLIP)
+            thresholdValue *= self.measureStdev(image)
             thresholdType = 'value'
 
         threshold = afwDet.createThreshold(thresholdValue*factor, thresholdType, parity)
         threshold.setIncludeMultiplier(self.config.includeThresholdMultiplier)
         return threshold
 
-    def updatePeaks(self, fpSet, image, threshold):
+    def measureStdev(self, image):
+        """Measure the clipped standard deviation of an image, for
+        ``thresholdType="stdev"``
+
+        Parameters
+        ----------
+        image : `lsst.afw.image.MaskedImage`
+            Image to measure; pixels with ``statsMask`` planes set are
+            ignored.
+
+        Returns
+        -------
+        stdev : `float`
+            Clipped standard deviation.
+        """
+        bad = image.getMask().getPlaneBitMask(self.config.statsMask)
+        sctrl = afwMath.StatisticsControl()
+        sctrl.setAndMask(bad)
+        stats = afwMath.makeStatistics(image, afwMath.STDEVCLIP, sctrl)
+        return stats.getValue(afwMath.STDEVCLIP)
+
+    def updatePeaks(self, fpSet, image, threshold, background=None):
         """Update the Peaks in a FootprintSet by detecting new Footprints and
         Peaks in an image and using the new Peaks instead of the old ones.
 
@@ -751,35 +2101,51 @@ class SourceDetectionTask(pipeBase.Task):
             Image to detect new Footprints and Peak in.
         threshold : `afw.detection.Threshold`
             Threshold object for detection.
+        background : `afw.image.ImageF`, optional
+            Background to subtract from ``image`` before detection. Only the
+            pixels within the bounding boxes of the Footprints whose Peaks are
+            updated are copied and subtracted; ``image`` is not modified.
 
         Input Footprints with fewer Peaks than self.config.nPeaksMaxSimple
         are not modified, and if no new Peaks are detected in an input
         Footprint, the brightest original Peak in that Footprint is kept.
+
+        The new Footprints are detected within each non-simple Footprint's
+        bounding box, so the work scales with the area of those Footprints,
+        and each new Peak is kept if it lies within the Footprint, as found
+        from an image of the Footprint's pixels.
         """
+        numUpdated = 0
         for footprint in fpSet.getFootprints():
             oldPeaks = footprint.getPeaks()
             if len(oldPeaks) <= self.config.nPeaksMaxSimple:
                 continue
+            numUpdated += 1
             # We detect a new FootprintSet within each non-simple Footprint's
             # bbox to avoid a big O(N^2) comparison between the two sets of
             # Footprints.
-            sub = image.Factory(image, footprint.getBBox())
+            bbox = footprint.getBBox()
+            sub = image.Factory(image, bbox, afwImage.PARENT, background is not None)
+            if background is not None:
+                sub.image -= background.Factory(background, bbox, afwImage.PARENT, False)
             fpSetForPeaks = afwDet.FootprintSet(
                 sub,
                 threshold,
                 "",  # don't set a mask plane
                 self.config.minPixels
             )
+            inside = self._labelFootprints([footprint], bbox)
             newPeaks = afwDet.PeakCatalog(oldPeaks.getTable())
             for fpForPeaks in fpSetForPeaks.getFootprints():
                 for peak in fpForPeaks.getPeaks():
-                    if footprint.contains(peak.getI()):
+                    if inside[peak.getIy() - bbox.getMinY(), peak.getIx() - bbox.getMinX()]:
                         newPeaks.append(peak)
             if len(newPeaks) > 0:
                 del oldPeaks[:]
                 oldPeaks.extend(newPeaks)
             else:
                 del oldPeaks[1:]
+        self.metadata.set("numUpdatedPeakFootprints", numUpdated)
 
     @staticmethod
     def setEdgeBits(maskedImage, goodBBox, edgeBitmask):
@@ -811,6 +2177,63 @@ class SourceDetectionTask(pipeBase.Task):
                                                        lsst.geom.ExtentI(w, h)), afwImage.LOCAL)
             edgeMask |= edgeBitmask
 
+    def subtractTempWideBackground(self, exposure):
+        """Fit and subtract the temporary wide background
+
+        With ``doCacheTempWideBackground``, the model of the last exposure
+        is reused if the exposure's pixels are unchanged, as recorded by
+        `markImageModified`, and no pixels have gained or lost the mask
+        planes ignored by ``tempWideBackground``; the statistics of the
+        model are recorded in the exposure's metadata as for a new fit.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Exposure from which to subtract the wide background; modified.
+        """
+        if not self.config.doCacheTempWideBackground:
+            self.tempWideBackground.run(exposure)
+            return
+        key = self._getWideBackgroundKey(exposure)
+        if self._wideBackgroundCache is not None and self._wideBackgroundCache[0] == key:
+            self.log.debug("Reusing the temporary wide background")
+            _, background, (bgMean, bgVar) = self._wideBackgroundCache
+            for bg, *_ in background:
+                self.tempWideBackground.subtractBackgroundModel(exposure.maskedImage, bg)
+            metadata = exposure.getMetadata()
+            metadata.addDouble("BGMEAN", bgMean)
+            metadata.addDouble("BGVAR", bgVar)
+            return
+        background = self.tempWideBackground.run(exposure).background
+        metadata = exposure.getMetadata()
+        stats = (metadata.getArray("BGMEAN")[-1], metadata.getArray("BGVAR")[-1])
+        self._wideBackgroundCache = (key, background, stats)
+
+    def _getWideBackgroundKey(self, exposure):
+        """Return the key identifying the pixels from which the temporary
+        wide background is fit
+
+        afw masks have no generation counter, so changes to the mask planes
+        ignored by ``tempWideBackground`` are detected by the number of
+        pixels that have them set.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Exposure whose background is to be fit.
+
+        Returns
+        -------
+        key : `tuple`
+            Image version, address of the pixels, bounding box, and number
+            of pixels with ignored mask planes set.
+        """
+        mask = exposure.mask
+        ignored = mask.getPlaneBitMask(self.tempWideBackground.config.ignoredPixelMask)
+        bbox = exposure.getBBox()
+        return (self._imageVersion, exposure.image.array.ctypes.data, bbox.getMinX(), bbox.getMinY(),
+                bbox.getWidth(), bbox.getHeight(), np.count_nonzero(mask.array & ignored))
+
     @contextmanager
     def tempWideBackgroundContext(self, exposure):
         """Context manager for removing wide (large-scale) background
@@ -837,7 +2260,8 @@ class SourceDetectionTask(pipeBase.Task):
         if doTempWideBackground:
             self.log.info("Applying temporary wide background subtraction")
             original = exposure.maskedImage.image.array[:].copy()
-            self.tempWideBackground.run(exposure).background
+            originalVersion = self._imageVersion
+            self.subtractTempWideBackground(exposure)
             # Remove NO_DATA regions (e.g., edge of the field-of-view); these can cause detections after
             # subtraction because of extrapolation of the background model into areas with no constraints.
             image = exposure.maskedImage.image
@@ -845,11 +2269,14 @@ class SourceDetectionTask(pipeBase.Task):
             noData = mask.array & mask.getPlaneBitMask("NO_DATA") > 0
             isGood = mask.array & mask.getPlaneBitMask(self.config.statsMask) == 0
             image.array[noData] = np.median(image.array[~noData & isGood])
+            self.markImageModified(exposure.maskedImage)
         try:
             yield
         finally:
             if doTempWideBackground:
                 exposure.maskedImage.image.array[:] = original
+                # The pixels are restored exactly, so products of the original pixels remain valid
+                self._imageVersion = originalVersion
 
 
 def addExposures(exposureList):
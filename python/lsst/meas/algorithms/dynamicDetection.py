@@ -1,9 +1,11 @@
 
 __all__ = ["DynamicDetectionConfig", "DynamicDetectionTask"]
 
+import warnings
+
 import numpy as np
 
-from lsst.pex.config import Field, ConfigurableField
+from lsst.pex.config import Field, ConfigurableField, FieldValidationError
 from lsst.pipe.base import Struct
 
 from .detection import SourceDetectionConfig, SourceDetectionTask
@@ -28,11 +30,24 @@ class DynamicDetectionConfig(SourceDetectionConfig):
     minNumSources = Field(dtype=int, default=10,
                           doc="Minimum number of sky sources in statistical sample; "
                               "if below this number, we refuse to modify the threshold.")
+    doFastSkyPhotometry = Field(dtype=bool, default=False,
+                                doc="Measure the sky objects with vectorized numpy photometry instead of "
+                                    "the forced measurement plugins? The local background uses the "
+                                    "configuration of the base_LocalBackground plugin.")
 
     def setDefaults(self):
         SourceDetectionConfig.setDefaults(self)
         self.skyObjects.nSources = 1000  # For good statistics
 
+    def validate(self):
+        SourceDetectionConfig.validate(self)
+        if self.binFactor != 1:
+            raise FieldValidationError(DynamicDetectionConfig.binFactor, self,
+                                       "Binned detection is not supported by DynamicDetectionTask")
+        if self.stripHeight != 0:
+            raise FieldValidationError(DynamicDetectionConfig.stripHeight, self,
+                                       "Strip detection is not supported by DynamicDetectionTask")
+
 
 class DynamicDetectionTask(SourceDetectionTask):
     """Detection of sources on an image with a dynamic threshold
@@ -101,8 +116,57 @@ class DynamicDetectionTask(SourceDetectionTask):
         """
         # Make a catalog of sky objects
         fp = self.skyObjects.run(exposure.maskedImage.mask, seed)
+        if self.config.doFastSkyPhotometry:
+            photometry = self.measureSkyObjects(exposure, fp)
+        else:
+            photometry = self.measureSkyObjectsWithPlugins(exposure, fp)
+
+        # Calculate new threshold
+        fluxes = photometry.instFlux
+        fluxErrs = photometry.instFluxErr
+        area = photometry.area
+        bg = photometry.background
+
+        good = (~photometry.flag & np.isfinite(fluxes) & np.isfinite(area) & np.isfinite(bg))
+
+        if good.sum() < self.config.minNumSources:
+            self.log.warn("Insufficient good flux measurements (%d < %d) for dynamic threshold calculation",
+                          good.sum(), self.config.minNumSources)
+            return Struct(multiplicative=1.0, additive=0.0)
+
+        bgMedian = np.median((fluxes/area)[good])
+
+        lq, uq = np.percentile((fluxes - bg*area)[good], [25.0, 75.0])
+        stdevMeas = 0.741*(uq - lq)
+        medianError = np.median(fluxErrs[good])
+        return Struct(multiplicative=medianError/stdevMeas, additive=bgMedian)
+
+    def measureSkyObjectsWithPlugins(self, exposure, footprints):
+        """Measure sky objects with the forced measurement plugins
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Exposure on which to measure.
+        footprints : `list` of `lsst.afw.detection.Footprint`
+            Footprints of the sky objects, each with a single peak.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Result struct with components, each an array with an element for
+            each sky object:
+
+            - ``instFlux``: PSF flux (`numpy.ndarray`).
+            - ``instFluxErr``: PSF flux error (`numpy.ndarray`).
+            - ``area``: effective area of the PSF (`numpy.ndarray`).
+            - ``background``: local background level per pixel
+              (`numpy.ndarray`).
+            - ``flag``: whether the measurement failed
+              (`numpy.ndarray` of `bool`).
+        """
         skyFootprints = FootprintSet(exposure.getBBox())
-        skyFootprints.setFootprints(fp)
+        skyFootprints.setFootprints(footprints)
         table = SourceTable.make(self.skyMeasurement.schema)
         catalog = SourceCatalog(table)
         catalog.reserve(len(skyFootprints.getFootprints()))
@@ -117,25 +181,90 @@ class DynamicDetectionTask(SourceDetectionTask):
         # Forced photometry on sky objects
         self.skyMeasurement.run(catalog, exposure, catalog, exposure.getWcs())
 
-        # Calculate new threshold
-        fluxes = catalog["base_PsfFlux_instFlux"]
-        area = catalog["base_PsfFlux_area"]
-        bg = catalog["base_LocalBackground_instFlux"]
+        return Struct(instFlux=catalog["base_PsfFlux_instFlux"],
+                      instFluxErr=catalog["base_PsfFlux_instFluxErr"],
+                      area=catalog["base_PsfFlux_area"],
+                      background=catalog["base_LocalBackground_instFlux"],
+                      flag=catalog["base_PsfFlux_flag"] | catalog["base_LocalBackground_flag"])
 
-        good = (~catalog["base_PsfFlux_flag"] & ~catalog["base_LocalBackground_flag"]
-                & np.isfinite(fluxes) & np.isfinite(area) & np.isfinite(bg))
+    def measureSkyObjects(self, exposure, footprints):
+        """Measure sky objects with vectorized numpy photometry
 
-        if good.sum() < self.config.minNumSources:
-            self.log.warn("Insufficient good flux measurements (%d < %d) for dynamic threshold calculation",
-                          good.sum(), self.config.minNumSources)
-            return Struct(multiplicative=1.0, additive=0.0)
+        This computes the same quantities as the ``base_PsfFlux`` and
+        ``base_LocalBackground`` plugins, for all sky objects at once from
+        stacked cutouts: the PSF-weighted flux and its error, the effective
+        area of the PSF, and the clipped mean of the pixels in an annulus.
+        The PSF is realised once, at the center of the exposure, which is
+        sufficient for the statistics of the sky objects.
 
-        bgMedian = np.median((fluxes/area)[good])
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Exposure on which to measure.
+        footprints : `list` of `lsst.afw.detection.Footprint`
+            Footprints of the sky objects, each with a single peak.
 
-        lq, uq = np.percentile((fluxes - bg*area)[good], [25.0, 75.0])
-        stdevMeas = 0.741*(uq - lq)
-        medianError = np.median(catalog["base_PsfFlux_instFluxErr"][good])
-        return Struct(multiplicative=medianError/stdevMeas, additive=bgMedian)
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Result struct with the same components as returned by
+            `measureSkyObjectsWithPlugins`.
+        """
+        numSources = len(footprints)
+        xx = np.array([fp.getPeaks()[0].getIx() for fp in footprints], dtype=int) - exposure.getX0()
+        yy = np.array([fp.getPeaks()[0].getIy() for fp in footprints], dtype=int) - exposure.getY0()
+        image = exposure.image.array
+        variance = exposure.variance.array
+        mask = exposure.mask.array
+        height, width = image.shape
+
+        # PSF-weighted flux, with the PSF model realised once
+        psfImage = exposure.getPsf().computeKernelImage(exposure.getBBox().getCenter())
+        model = psfImage.array.astype(float)
+        model /= model.sum()
+        psfX0 = psfImage.getX0()  # offset of the kernel image from its center
+        psfY0 = psfImage.getY0()
+        psfHeight, psfWidth = model.shape
+        onImage = ((xx + psfX0 >= 0) & (xx + psfX0 + psfWidth <= width)
+                   & (yy + psfY0 >= 0) & (yy + psfY0 + psfHeight <= height))
+        rows = np.clip(yy[:, np.newaxis, np.newaxis] + psfY0 + np.arange(psfHeight)[:, np.newaxis],
+                       0, height - 1)
+        cols = np.clip(xx[:, np.newaxis, np.newaxis] + psfX0 + np.arange(psfWidth), 0, width - 1)
+        modelSumSq = np.sum(model**2)
+        instFlux = np.einsum("nij,ij->n", image[rows, cols], model)/modelSumSq
+        instFluxErr = np.sqrt(np.einsum("nij,ij->n", variance[rows, cols], model**2))/modelSumSq
+        area = np.full(numSources, model.sum()**2/modelSumSq)
+
+        # Clipped mean in an annulus, configured as for the base_LocalBackground plugin
+        bgConfig = self.skyMeasurement.config.plugins["base_LocalBackground"]
+        radius = int(np.ceil(bgConfig.annulusOuter))
+        dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+        distSq = dx**2 + dy**2
+        inAnnulus = (distSq >= bgConfig.annulusInner**2) & (distSq <= bgConfig.annulusOuter**2)
+        dx = dx[inAnnulus]
+        dy = dy[inAnnulus]
+        rows = yy[:, np.newaxis] + dy
+        cols = xx[:, np.newaxis] + dx
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        rows = np.clip(rows, 0, height - 1)
+        cols = np.clip(cols, 0, width - 1)
+        badBits = exposure.mask.getPlaneBitMask(bgConfig.badMaskPlanes)
+        values = np.where(inside & (mask[rows, cols] & badBits == 0), image[rows, cols], np.nan)
+        with warnings.catch_warnings():
+            # Sky objects with no good pixels in the annulus produce NaN, and are flagged
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            center = np.nanmedian(values, axis=1)
+            lq, uq = np.nanpercentile(values, [25.0, 75.0], axis=1)
+            stdev = 0.741*(uq - lq)
+            for _ in range(bgConfig.bgIter):
+                clipped = np.where(np.abs(values - center[:, np.newaxis])
+                                   <= bgConfig.bgRej*stdev[:, np.newaxis], values, np.nan)
+                center = np.nanmean(clipped, axis=1)
+                stdev = np.nanstd(clipped, axis=1)
+        numGood = np.sum(np.isfinite(values), axis=1)
+
+        return Struct(instFlux=instFlux, instFluxErr=instFluxErr, area=area, background=center,
+                      flag=~onImage | (numGood == 0))
 
     def detectFootprints(self, exposure, doSmooth=True, sigma=None, clearMask=True, expId=None):
         """Detect footprints with a dynamic threshold
@@ -184,6 +313,9 @@ class DynamicDetectionTask(SourceDetectionTask):
             threshold.
         prelim : `lsst.pipe.base.Struct`
             Results from preliminary detection pass.
+        hierarchy : `list` of `lsst.pipe.base.Struct`
+            Footprints at each of ``thresholdHierarchyFactors``, as returned
+            by `applyThresholdHierarchy`; only if that is set.
         """
         maskedImage = exposure.maskedImage
 
@@ -193,61 +325,68 @@ class DynamicDetectionTask(SourceDetectionTask):
             oldDetected = maskedImage.mask.array & maskedImage.mask.getPlaneBitMask(["DETECTED",
                                                                                      "DETECTED_NEGATIVE"])
 
-        with self.tempWideBackgroundContext(exposure):
-            # Could potentially smooth with a wider kernel than the PSF in order to better pick up the
-            # wings of stars and galaxies, but for now sticking with the PSF as that's more simple.
-            psf = self.getPsf(exposure, sigma=sigma)
-            convolveResults = self.convolveImage(maskedImage, psf, doSmooth=doSmooth)
-            middle = convolveResults.middle
-            sigma = convolveResults.sigma
-            prelim = self.applyThreshold(middle, maskedImage.getBBox(), self.config.prelimThresholdFactor)
-            self.finalizeFootprints(maskedImage.mask, prelim, sigma, self.config.prelimThresholdFactor)
-
-            # Calculate the proper threshold
-            # seed needs to fit in a C++ 'int' so pybind doesn't choke on it
-            seed = (expId if expId is not None else int(maskedImage.image.array.sum())) % (2**31 - 1)
-            threshResults = self.calculateThreshold(exposure, seed, sigma=sigma)
-            factor = threshResults.multiplicative
-            self.log.info("Modifying configured detection threshold by factor %f to %f",
-                          factor, factor*self.config.thresholdValue)
-
-            # Blow away preliminary (low threshold) detection mask
-            self.clearMask(maskedImage.mask)
-            if not clearMask:
-                maskedImage.mask.array |= oldDetected
-
-            # Rinse and repeat thresholding with new calculated threshold
-            results = self.applyThreshold(middle, maskedImage.getBBox(), factor)
-            results.prelim = prelim
-            results.background = lsst.afw.math.BackgroundList()
-            if self.config.doTempLocalBackground:
-                self.applyTempLocalBackground(exposure, middle, results)
-            self.finalizeFootprints(maskedImage.mask, results, sigma, factor)
-
-            self.clearUnwantedResults(maskedImage.mask, results)
-
-        if self.config.reEstimateBackground:
-            self.reEstimateBackground(maskedImage, results.background)
-
-        self.display(exposure, results, middle)
-
-        if self.config.doBackgroundTweak:
-            # Re-do the background tweak after any temporary backgrounds have been restored
-            #
-            # But we want to keep any large-scale background (e.g., scattered light from bright stars)
-            # from being selected for sky objects in the calculation, so do another detection pass without
-            # either the local or wide temporary background subtraction; the DETECTED pixels will mark
-            # the area to ignore.
-            originalMask = maskedImage.mask.array.copy()
-            try:
-                self.clearMask(exposure.mask)
+        # Convolutions are reused between passes while the image is unchanged
+        with self.convolveCacheContext():
+            with self.tempWideBackgroundContext(exposure):
+                # Could potentially smooth with a wider kernel than the PSF in order to better pick up the
+                # wings of stars and galaxies, but for now sticking with the PSF as that's more simple.
+                psf = self.getPsf(exposure, sigma=sigma)
                 convolveResults = self.convolveImage(maskedImage, psf, doSmooth=doSmooth)
-                tweakDetResults = self.applyThreshold(convolveResults.middle, maskedImage.getBBox(), factor)
-                self.finalizeFootprints(maskedImage.mask, tweakDetResults, sigma, factor)
-                bgLevel = self.calculateThreshold(exposure, seed, sigma=sigma).additive
-            finally:
-                maskedImage.mask.array[:] = originalMask
-            self.tweakBackground(exposure, bgLevel, results.background)
+                middle = convolveResults.middle
+                sigma = convolveResults.sigma
+                prelim = self.applyThreshold(middle, maskedImage.getBBox(), self.config.prelimThresholdFactor)
+                self.finalizeFootprints(maskedImage.mask, prelim, sigma, self.config.prelimThresholdFactor)
+
+                # Calculate the proper threshold
+                # seed needs to fit in a C++ 'int' so pybind doesn't choke on it
+                seed = (expId if expId is not None else int(maskedImage.image.array.sum())) % (2**31 - 1)
+                threshResults = self.calculateThreshold(exposure, seed, sigma=sigma)
+                factor = threshResults.multiplicative
+                self.log.info("Modifying configured detection threshold by factor %f to %f",
+                              factor, factor*self.config.thresholdValue)
+
+                # Blow away preliminary (low threshold) detection mask
+                self.clearMask(maskedImage.mask)
+                if not clearMask:
+                    maskedImage.mask.array |= oldDetected
+
+                # Rinse and repeat thresholding with new calculated threshold
+                results = self.applyThreshold(middle, maskedImage.getBBox(), factor)
+                if self.config.thresholdHierarchyFactors:
+                    results.hierarchy = self.applyThresholdHierarchy(
+                        middle, maskedImage.getBBox(), self.config.thresholdHierarchyFactors, factor)
+                results.prelim = prelim
+                results.background = lsst.afw.math.BackgroundList()
+                if self.config.doTempLocalBackground:
+                    self.applyTempLocalBackground(exposure, middle, results)
+                self.finalizeFootprints(maskedImage.mask, results, sigma, factor)
+
+                self.clearUnwantedResults(maskedImage.mask, results)
+
+            if self.config.reEstimateBackground:
+                self.reEstimateBackground(maskedImage, results.background)
+
+            self.display(exposure, results, middle)
+
+            if self.config.doBackgroundTweak:
+                # Re-do the background tweak after any temporary backgrounds have been restored
+                #
+                # But we want to keep any large-scale background (e.g., scattered light from bright
+                # stars) from being selected for sky objects in the calculation, so do another detection
+                # pass without either the local or wide temporary background subtraction; the DETECTED
+                # pixels will mark the area to ignore. If the image is unchanged since the first pass,
+                # its convolution is reused.
+                originalMask = maskedImage.mask.array.copy()
+                try:
+                    self.clearMask(exposure.mask)
+                    convolveResults = self.convolveImage(maskedImage, psf, doSmooth=doSmooth)
+                    tweakDetResults = self.applyThreshold(convolveResults.middle, maskedImage.getBBox(),
+                                                          factor)
+                    self.finalizeFootprints(maskedImage.mask, tweakDetResults, sigma, factor)
+                    bgLevel = self.calculateThreshold(exposure, seed, sigma=sigma).additive
+                finally:
+                    maskedImage.mask.array[:] = originalMask
+                self.tweakBackground(exposure, bgLevel, results.background)
 
         return results
 
@@ -270,6 +409,8 @@ class DynamicDetectionTask(SourceDetectionTask):
         """
         self.log.info("Tweaking background by %f to match sky photometry", bgLevel)
         exposure.image -= bgLevel
+        self.markImageModified(exposure.maskedImage)
+        self._updateBackgroundBinStatistics(exposure.maskedImage, bgLevel)
         bgStats = lsst.afw.image.MaskedImageF(1, 1)
         bgStats.set(bgLevel, 0, bgLevel)
         bg = lsst.afw.math.BackgroundMI(exposure.getBBox(), bgStats)
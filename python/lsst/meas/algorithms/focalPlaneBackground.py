@@ -0,0 +1,303 @@
+# This file is part of meas_algorithms.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["FocalPlaneBackgroundConfig", "FocalPlaneBackgroundTask"]
+
+import numpy as np
+
+import lsst.afw.cameraGeom as cameraGeom
+import lsst.afw.image as afwImage
+import lsst.afw.math as afwMath
+import lsst.geom
+import lsst.pex.config as pexConfig
+import lsst.pipe.base as pipeBase
+
+from .subtractBackground import SubtractBackgroundTask, getBinEdges
+
+
+class FocalPlaneBackgroundConfig(pexConfig.Config):
+    """Configuration for FocalPlaneBackgroundTask"""
+    background = pexConfig.ConfigurableField(
+        target=SubtractBackgroundTask,
+        doc="Measurement of the statistics of the background bins of each detector; only the bins "
+            "are used, not the model fit to them",
+    )
+    order = pexConfig.RangeField(
+        dtype=int, default=6, min=0,
+        doc="Maximum total order of the Chebyshev polynomial fit over the focal plane",
+    )
+    weighting = pexConfig.Field(
+        dtype=bool, default=True,
+        doc="Weight the bins by their inverse variance in the fit?",
+    )
+    numSigmaClip = pexConfig.Field(
+        dtype=float, default=3.0,
+        doc="Rejection threshold for the residuals of the bins, in units of their robust scatter",
+    )
+    numIter = pexConfig.RangeField(
+        dtype=int, default=3, min=0,
+        doc="Number of rejection iterations after the first fit",
+    )
+
+
+class FocalPlaneBackgroundTask(pipeBase.Task):
+    """Fit a single smooth background over the focal plane
+
+    The background bins of every detector are measured with
+    `SubtractBackgroundTask.fitBackground` (with a single configuration),
+    and their centers mapped to focal-plane coordinates with
+    the camera geometry of each detector. A Chebyshev polynomial in the
+    focal-plane coordinates is fit to all the bins at once, so the
+    large-scale background is continuous across the gaps between detectors
+    and constrained near their edges by their neighbours. The model is then
+    evaluated on the grid of bins of each detector, and interpolated like any
+    other `lsst.afw.math.BackgroundMI`.
+    """
+    ConfigClass = FocalPlaneBackgroundConfig
+    _DefaultName = "focalPlaneBackground"
+
+    def __init__(self, **kwargs):
+        pipeBase.Task.__init__(self, **kwargs)
+        self.makeSubtask("background")
+
+    @pipeBase.timeMethod
+    def run(self, exposures, backgrounds=None):
+        """Fit and subtract the background of the detectors of a focal plane
+
+        Parameters
+        ----------
+        exposures : `list` of `lsst.afw.image.Exposure`
+            Exposures of the detectors, each with a `lsst.afw.cameraGeom.Detector`;
+            the background is subtracted from them.
+        backgrounds : `list` of `lsst.afw.math.BackgroundList`, optional
+            Background models already subtracted from each of ``exposures``,
+            to which the focal-plane model is appended.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Results as a struct with attributes:
+
+            ``backgrounds``
+                Background model of each exposure, including the focal-plane
+                model (`list` of `lsst.afw.math.BackgroundList`).
+            ``model``
+                Focal-plane model, as returned by `fitModel`
+                (`lsst.pipe.base.Struct`).
+            ``bins``
+                Statistics of the bins of each exposure, as returned by
+                `measureBins` (`list` of `lsst.pipe.base.Struct`).
+        """
+        if backgrounds is None:
+            backgrounds = [afwMath.BackgroundList() for _ in exposures]
+        if len(backgrounds) != len(exposures):
+            raise ValueError("Got %d background lists for %d exposures" % (len(backgrounds), len(exposures)))
+
+        bins = [self.measureBins(exposure) for exposure in exposures]
+
+        model = self.fitModel(np.concatenate([b.x.ravel() for b in bins]),
+                              np.concatenate([b.y.ravel() for b in bins]),
+                              np.concatenate([b.value.ravel() for b in bins]),
+                              np.concatenate([b.variance.ravel() for b in bins]))
+        self.log.info("Fit focal-plane background to %d of %d bins on %d detectors; rms residual %g",
+                      model.numUsed, model.numBins, len(exposures), model.rms)
+        self.metadata.add("numUsedBins", model.numUsed)
+        self.metadata.add("rmsResidual", model.rms)
+
+        for exposure, background, detectorBins in zip(exposures, backgrounds, bins):
+            bg = self.makeDetectorBackground(model, detectorBins)
+            self.background.subtractBackgroundModel(exposure.maskedImage, bg)
+            background.append((bg, getattr(afwMath.Interpolate, self.background.config.algorithm),
+                               bg.getAsUsedUndersampleStyle(), afwMath.ApproximateControl.UNKNOWN,
+                               0, 0, False))
+
+        return pipeBase.Struct(backgrounds=backgrounds, model=model, bins=bins)
+
+    def measureBins(self, exposure):
+        """Measure the background bins of a detector, in focal-plane
+        coordinates
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Exposure of the detector, with a `lsst.afw.cameraGeom.Detector`.
+
+        Returns
+        -------
+        bins : `lsst.pipe.base.Struct`
+            Statistics of the bins as a struct with attributes:
+
+            ``bbox``
+                Bounding box of the exposure (`lsst.geom.Box2I`).
+            ``x``, ``y``
+                Focal-plane coordinates of the centers of the bins
+                (`numpy.ndarray`, indexed by bin row and column).
+            ``value``, ``variance``
+                Background level of the bins and its variance
+                (`numpy.ndarray`, indexed by bin row and column); NaN for
+                bins without any good pixels.
+        """
+        detector = exposure.getDetector()
+        if detector is None:
+            raise RuntimeError("Exposure has no detector, so it cannot be placed on the focal plane")
+        statsImage = self.background.fitBackground(exposure.maskedImage).getStatsImage()
+        ny, nx = statsImage.image.array.shape
+        bbox = exposure.getBBox()
+        xEdges = getBinEdges(bbox.getWidth(), nx)
+        yEdges = getBinEdges(bbox.getHeight(), ny)
+        pixelX, pixelY = np.meshgrid(bbox.getMinX() + 0.5*(xEdges[:-1] + xEdges[1:] - 1),
+                                     bbox.getMinY() + 0.5*(yEdges[:-1] + yEdges[1:] - 1))
+        transform = detector.getTransform(cameraGeom.PIXELS, cameraGeom.FOCAL_PLANE)
+        points = transform.applyForward([lsst.geom.Point2D(x, y) for x, y in zip(pixelX.flat, pixelY.flat)])
+        return pipeBase.Struct(
+            bbox=bbox,
+            x=np.array([point.getX() for point in points]).reshape(ny, nx),
+            y=np.array([point.getY() for point in points]).reshape(ny, nx),
+            value=statsImage.image.array.astype(np.float64),
+            variance=statsImage.variance.array.astype(np.float64),
+        )
+
+    def fitModel(self, x, y, value, variance):
+        """Fit a Chebyshev polynomial to background bins over the focal plane
+
+        Bins whose residuals exceed ``numSigmaClip`` times the robust scatter
+        of the residuals are rejected, and the fit repeated, ``numIter``
+        times.
+
+        Parameters
+        ----------
+        x, y : `numpy.ndarray`
+            Focal-plane coordinates of the bins.
+        value, variance : `numpy.ndarray`
+            Background level of the bins and its variance; bins for which
+            either is not finite are ignored.
+
+        Returns
+        -------
+        model : `lsst.pipe.base.Struct`
+            The model as a struct with attributes:
+
+            ``coefficients``
+                Chebyshev coefficients, indexed by the order in x and y
+                (`numpy.ndarray`).
+            ``xRange``, ``yRange``
+                Ranges of the focal-plane coordinates mapped to [-1, 1]
+                (`tuple` of `float`).
+            ``numBins``, ``numUsed``
+                Number of bins, and of bins used in the final fit (`int`).
+            ``rms``
+                Weighted rms residual of the bins used (`float`).
+
+        Raises
+        ------
+        RuntimeError
+            Raised if there are fewer usable bins than coefficients.
+        """
+        order = self.config.order
+        good = np.isfinite(value) & np.isfinite(variance)
+        if self.config.weighting:
+            good &= variance > 0
+        xRange = (x[good].min(), x[good].max()) if good.any() else (-1.0, 1.0)
+        yRange = (y[good].min(), y[good].max()) if good.any() else (-1.0, 1.0)
+        design = np.polynomial.chebyshev.chebvander2d(self._scale(x, xRange), self._scale(y, yRange),
+                                                      [order, order])
+        # Only the terms of total order up to the configured order
+        xOrder, yOrder = np.divmod(np.arange((order + 1)**2), order + 1)
+        terms = xOrder + yOrder <= order
+        design = design[:, terms]
+        if good.sum() < design.shape[1]:
+            raise RuntimeError("Too few bins (%d) to fit %d coefficients" % (good.sum(), design.shape[1]))
+        weights = 1.0/np.sqrt(variance) if self.config.weighting else np.ones_like(value)
+
+        use = good.copy()
+        for iteration in range(self.config.numIter + 1):
+            solution = np.linalg.lstsq(design[use]*weights[use, np.newaxis], value[use]*weights[use],
+                                       rcond=None)[0]
+            residuals = np.where(good, (value - design @ solution)*weights, np.nan)
+            lower, upper = np.percentile(residuals[use], [25.0, 75.0])
+            scatter = 0.741301109*(upper - lower)
+            if iteration == self.config.numIter or scatter == 0:
+                break
+            newUse = good & (np.abs(residuals) <= self.config.numSigmaClip*scatter)
+            if np.array_equal(newUse, use) or newUse.sum() < design.shape[1]:
+                break
+            use = newUse
+
+        coefficients = np.zeros((order + 1, order + 1))
+        coefficients[xOrder[terms], yOrder[terms]] = solution
+        return pipeBase.Struct(
+            coefficients=coefficients,
+            xRange=xRange,
+            yRange=yRange,
+            numBins=len(value),
+            numUsed=int(use.sum()),
+            rms=float(np.sqrt(np.mean(residuals[use]**2))),
+        )
+
+    def evaluateModel(self, model, x, y):
+        """Evaluate the focal-plane model
+
+        Parameters
+        ----------
+        model : `lsst.pipe.base.Struct`
+            Focal-plane model, as returned by `fitModel`.
+        x, y : `numpy.ndarray`
+            Focal-plane coordinates at which to evaluate the model.
+
+        Returns
+        -------
+        values : `numpy.ndarray`
+            Background level at each position.
+        """
+        return np.polynomial.chebyshev.chebval2d(self._scale(x, model.xRange), self._scale(y, model.yRange),
+                                                 model.coefficients)
+
+    def makeDetectorBackground(self, model, bins):
+        """Make the background model of a detector from the focal-plane model
+
+        The focal-plane model is evaluated at the centers of the bins of the
+        detector, which are interpolated with the interpolation algorithm
+        configured for ``background``.
+
+        Parameters
+        ----------
+        model : `lsst.pipe.base.Struct`
+            Focal-plane model, as returned by `fitModel`.
+        bins : `lsst.pipe.base.Struct`
+            Bins of the detector, as returned by `measureBins`.
+
+        Returns
+        -------
+        bg : `lsst.afw.math.BackgroundMI`
+            Background model of the detector.
+        """
+        ny, nx = bins.value.shape
+        statsImage = afwImage.MaskedImageF(nx, ny)
+        statsImage.image.array[:] = self.evaluateModel(model, bins.x, bins.y)
+        return self.background.makeBackgroundFromStats(bins.bbox, statsImage)
+
+    @staticmethod
+    def _scale(values, valueRange):
+        """Map values linearly from a range to [-1, 1]"""
+        low, high = valueRange
+        if high == low:
+            return np.zeros_like(values)
+        return (2.0*values - (low + high))/(high - low)
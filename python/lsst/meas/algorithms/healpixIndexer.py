@@ -0,0 +1,218 @@
+# This file is part of meas_algorithms.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["HealpixIndexer"]
+
+import healpy
+import numpy as np
+
+# Fractional margin added to the maximum pixel radius, so that the cap
+# around a pixel centre is guaranteed to contain the whole (curved) pixel.
+_PIXRAD_MARGIN = 1.01
+
+
+class HealpixIndexer:
+    """Manage a spatial index of HEALPix shards, in nested ordering.
+
+    In nested ordering every pixel at order ``k`` covers a contiguous range
+    of ``4**(depth - k)`` pixel IDs at order ``depth``, so a region query is
+    planned hierarchically: pixels that are fully inside the region at a
+    coarse order become a single ID range, and only pixels straddling the
+    region boundary are refined further.
+
+    Parameters
+    ----------
+    depth : `int`
+        HEALPix order of the shards; ``nside = 2**depth``.
+    """
+    def __init__(self, depth=7):
+        self.depth = depth
+        self.nside = 2**depth
+
+    def getPixelRange(self):
+        """Get the range of valid shard IDs.
+
+        Returns
+        -------
+        pixelRange : `tuple` [`int`]
+            Half-open range of shard IDs, ``(start, end)``.
+        """
+        return 0, healpy.nside2npix(self.nside)
+
+    def getShardRanges(self, ctrCoord, radius):
+        """Get the shard IDs that touch a circular aperture, as ranges.
+
+        Parameters
+        ----------
+        ctrCoord : `lsst.geom.SpherePoint`
+            ICRS center of search region.
+        radius : `lsst.geom.Angle`
+            Radius of search region.
+
+        Returns
+        -------
+        results : `tuple`
+            A tuple containing:
+
+            - interiorRanges : `numpy.ndarray` of `int`, (N, 2)
+                Merged, sorted half-open ``[begin, end)`` ranges of shard IDs
+                that are fully enclosed by the search region.
+            - boundaryIds : `numpy.ndarray` of `int`
+                Sorted IDs of shards that touch, but are not fully enclosed
+                by, the search region.
+        """
+        center = np.array(healpy.ang2vec(ctrCoord.getLongitude().asDegrees(),
+                                         ctrCoord.getLatitude().asDegrees(), lonlat=True))
+        radius = radius.asRadians()
+
+        begins = []
+        ends = []
+        candidates = np.arange(12, dtype=np.int64)
+        for order in range(self.depth + 1):
+            nside = 2**order
+            pixrad = healpy.max_pixrad(nside)*_PIXRAD_MARGIN
+            vectors = np.array(healpy.pix2vec(nside, candidates, nest=True)).T
+            distance = np.arccos(np.clip(vectors @ center, -1.0, 1.0))
+            inside = distance + pixrad <= radius
+            touches = distance - pixrad <= radius
+            shift = 2*(self.depth - order)
+            begins.append(candidates[inside] << shift)
+            ends.append((candidates[inside] + 1) << shift)
+            candidates = candidates[touches & ~inside]
+            if order < self.depth:
+                candidates = (4*candidates[:, np.newaxis] + np.arange(4)).ravel()
+
+        interiorRanges = self._mergeRanges(np.concatenate(begins), np.concatenate(ends))
+        return interiorRanges, np.sort(candidates)
+
+    def getShardIds(self, ctrCoord, radius):
+        """Get the IDs of all shards that touch a circular aperture.
+
+        Parameters
+        ----------
+        ctrCoord : `lsst.geom.SpherePoint`
+            ICRS center of search region.
+        radius : `lsst.geom.Angle`
+            Radius of search region.
+
+        Returns
+        -------
+        results : `tuple`
+            A tuple containing:
+
+            - shardIdList : `numpy.ndarray` of `int`
+                Shard IDs.
+            - isOnBoundary : `numpy.ndarray` of `bool`
+                For each shard in ``shardIdList`` is the shard on the
+                boundary (not fully enclosed by the search region)?
+        """
+        interiorRanges, boundaryIds = self.getShardRanges(ctrCoord, radius)
+        interiorIds = self._expandRanges(interiorRanges)
+        shardIdList = np.concatenate([interiorIds, boundaryIds])
+        isOnBoundary = np.concatenate([np.zeros(len(interiorIds), dtype=bool),
+                                       np.ones(len(boundaryIds), dtype=bool)])
+        return shardIdList, isOnBoundary
+
+    def indexPoints(self, raList, decList):
+        """Generate shard IDs for sky positions.
+
+        Parameters
+        ----------
+        raList : `list` of `float`
+            List of right ascensions, in degrees.
+        decList : `list` of `float`
+            List of declinations, in degrees.
+
+        Returns
+        -------
+        shardIds : `numpy.ndarray` of `int`
+            Shard IDs.
+        """
+        return healpy.ang2pix(self.nside, np.asarray(raList), np.asarray(decList), nest=True, lonlat=True)
+
+    @staticmethod
+    def makeDataId(shardId, datasetName):
+        """Make a data id from a shard ID.
+
+        Parameters
+        ----------
+        shardId : `int`
+            ID of shard in question.
+        datasetName : `str`
+            Name of dataset to use.
+
+        Returns
+        -------
+        dataId : `dict`
+            Data ID for shard.
+        """
+        if shardId is None:
+            # NoneType doesn't format, so make dummy pixel
+            shardId = 0
+        return {'pixel_id': shardId, 'name': datasetName}
+
+    @staticmethod
+    def _expandRanges(ranges):
+        """Expand half-open ranges into the IDs they contain.
+
+        The IDs are generated with a single vectorized operation, rather
+        than one ``numpy.arange`` per range.
+
+        Parameters
+        ----------
+        ranges : `numpy.ndarray` of `int`, (N, 2)
+            Sorted, disjoint ``[begin, end)`` ranges.
+
+        Returns
+        -------
+        ids : `numpy.ndarray` of `int`
+            Sorted IDs in the ranges.
+        """
+        lengths = ranges[:, 1] - ranges[:, 0]
+        # offset of the first ID of each range in the output
+        starts = np.cumsum(lengths) - lengths
+        return np.arange(lengths.sum(), dtype=np.int64) + np.repeat(ranges[:, 0] - starts, lengths)
+
+    @staticmethod
+    def _mergeRanges(begins, ends):
+        """Sort half-open ranges and merge those that are contiguous.
+
+        Parameters
+        ----------
+        begins, ends : `numpy.ndarray` of `int`
+            Start (inclusive) and end (exclusive) of each range; the ranges
+            must not overlap.
+
+        Returns
+        -------
+        ranges : `numpy.ndarray` of `int`, (N, 2)
+            Merged ``[begin, end)`` ranges, sorted by ``begin``.
+        """
+        if len(begins) == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        order = np.argsort(begins)
+        begins = begins[order]
+        ends = ends[order]
+        # a new range starts wherever the previous one does not end exactly here
+        starts = np.ones(len(begins), dtype=bool)
+        starts[1:] = begins[1:] != ends[:-1]
+        lasts = np.append(np.nonzero(starts)[0][1:] - 1, len(begins) - 1)
+        return np.stack([begins[starts], ends[lasts]], axis=1)
@@ -20,7 +20,19 @@
 # the GNU General Public License along with this program.  If not,
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
+from collections import OrderedDict
+
 import esutil
+import numpy as np
+
+import lsst.sphgeom
+
+# Unit vectors used as the vertices of the eight HTM root trixels.
+_V0, _V1, _V2, _V3, _V4, _V5 = np.array([[0, 0, 1], [1, 0, 0], [0, 1, 0],
+                                         [-1, 0, 0], [0, -1, 0], [0, 0, -1]], dtype=float)
+# Vertices of the root trixels S0, S1, S2, S3, N0, N1, N2, N3 (ids 8-15).
+_ROOT_VERTICES = np.array([[_V1, _V5, _V2], [_V2, _V5, _V3], [_V3, _V5, _V4], [_V4, _V5, _V1],
+                           [_V1, _V0, _V4], [_V4, _V0, _V3], [_V3, _V0, _V2], [_V2, _V0, _V1]])
 
 
 class HtmIndexer:
@@ -31,9 +43,24 @@ class HtmIndexer:
     ----------
     depth : `int`
         Depth of the HTM hierarchy to construct.
+    cacheSize : `int`, optional
+        Number of recent ``getShardIds`` results to memoize, keyed on the
+        search circle; 0 disables the cache.
     """
-    def __init__(self, depth=8):
+    def __init__(self, depth=8, cacheSize=32):
         self.htm = esutil.htm.HTM(depth)
+        self.cacheSize = cacheSize
+        self._cache = OrderedDict()
+
+    def getPixelRange(self):
+        """Get the range of valid shard IDs.
+
+        Returns
+        -------
+        pixelRange : `tuple` [`int`]
+            Half-open range of shard IDs, ``(start, end)``.
+        """
+        return lsst.sphgeom.HtmPixelization(self.htm.get_depth()).universe()[0]
 
     def getShardIds(self, ctrCoord, radius):
         """Get the IDs of all shards that touch a circular aperture.
@@ -50,20 +77,123 @@ class HtmIndexer:
         results : `tuple`
             A tuple containing:
 
-            - shardIdList : `list` of `int`
-                List of shard IDs
-            - isOnBoundary : `list` of `bool`
+            - shardIdList : `numpy.ndarray` of `int`
+                Shard IDs.
+            - isOnBoundary : `numpy.ndarray` of `bool`
                 For each shard in ``shardIdList`` is the shard on the
                 boundary (not fully enclosed by the search region)?
+
+        Notes
+        -----
+        The returned arrays may be shared with the cache, and are therefore
+        read-only.
+        """
+        return self.getShardIdsBatch([ctrCoord], [radius])[0]
+
+    def getShardIdsBatch(self, ctrCoordList, radiusList):
+        """Get the IDs of all shards that touch each of several circular
+        apertures.
+
+        The trixel geometry needed to classify boundary shards is computed
+        once for all of the circles.
+
+        Parameters
+        ----------
+        ctrCoordList : `list` of `lsst.geom.SpherePoint`
+            ICRS centers of the search regions.
+        radiusList : `list` of `lsst.geom.Angle`
+            Radii of the search regions.
+
+        Returns
+        -------
+        results : `list` of `tuple`
+            For each circle, a tuple of ``(shardIdList, isOnBoundary)`` as
+            returned by `getShardIds`.
+        """
+        circles = [(ctrCoord.getLongitude().asDegrees(), ctrCoord.getLatitude().asDegrees(),
+                    radius.asDegrees()) for ctrCoord, radius in zip(ctrCoordList, radiusList)]
+        results = {}
+        for circle in circles:
+            if circle in self._cache:
+                self._cache.move_to_end(circle)
+                results[circle] = self._cache[circle]
+        missing = [circle for circle in dict.fromkeys(circles) if circle not in results]
+
+        if missing:
+            idLists = [np.asarray(self.htm.intersect(ra, dec, radius, inclusive=True), dtype=np.int64)
+                       for ra, dec, radius in missing]
+            uniqueIds, inverse = np.unique(np.concatenate(idLists), return_inverse=True)
+            vertices = self._getTrixelVertices(uniqueIds)
+            offsets = np.cumsum([0] + [len(shardIds) for shardIds in idLists])
+            for circle, shardIds, start, end in zip(missing, idLists, offsets[:-1], offsets[1:]):
+                isOnBoundary = self._isOnBoundary(shardIds, vertices[inverse[start:end]], *circle)
+                shardIds.flags.writeable = False
+                isOnBoundary.flags.writeable = False
+                results[circle] = (shardIds, isOnBoundary)
+                self._addToCache(circle, results[circle])
+        return [results[circle] for circle in circles]
+
+    def _addToCache(self, circle, result):
+        """Memoize the shards for a circle, evicting the least recently
+        used entry if the cache is full.
+        """
+        if self.cacheSize <= 0:
+            return
+        self._cache[circle] = result
+        while len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
+
+    def _isOnBoundary(self, shardIds, vertices, ra, dec, radius):
+        """Classify shards touching a circle as enclosed or on its boundary.
+
+        Parameters
+        ----------
+        shardIds : `numpy.ndarray` of `int`
+            IDs of the shards touching the circle.
+        vertices : `numpy.ndarray`, (N, 3, 3)
+            Unit vectors of the vertices of each shard.
+        ra, dec, radius : `float`
+            Center and radius of the circle, in degrees.
+
+        Returns
+        -------
+        isOnBoundary : `numpy.ndarray` of `bool`
+            Is each shard not fully enclosed by the circle?
+        """
+        if radius >= 90:
+            # The circle is not convex, so the vertices do not bound the
+            # trixels it contains; ask esutil for the covered trixels.
+            coveredIds = self.htm.intersect(ra, dec, radius, inclusive=False)
+            return ~np.isin(shardIds, coveredIds)
+        # A trixel is a convex spherical triangle, so it is enclosed by a
+        # convex circle if and only if all three of its vertices are.
+        center = np.array(esutil.coords.eq2xyz(ra, dec)).ravel()
+        return ~np.all(vertices @ center >= np.cos(np.radians(radius)), axis=1)
+
+    def _getTrixelVertices(self, shardIds):
+        """Compute the vertices of a set of trixels.
+
+        Parameters
+        ----------
+        shardIds : `numpy.ndarray` of `int`
+            IDs of trixels at the depth of this indexer.
+
+        Returns
+        -------
+        vertices : `numpy.ndarray`, (N, 3, 3)
+            Unit vectors of the three vertices of each trixel.
         """
-        shardIdList = self.htm.intersect(ctrCoord.getLongitude().asDegrees(),
-                                         ctrCoord.getLatitude().asDegrees(),
-                                         radius.asDegrees(), inclusive=True)
-        coveredShardIdList = self.htm.intersect(ctrCoord.getLongitude().asDegrees(),
-                                                ctrCoord.getLatitude().asDegrees(),
-                                                radius.asDegrees(), inclusive=False)
-        isOnBoundary = (shardId not in coveredShardIdList for shardId in shardIdList)
-        return shardIdList, isOnBoundary
+        depth = self.htm.get_depth()
+        shardIds = np.asarray(shardIds, dtype=np.int64)
+        vertices = _ROOT_VERTICES[(shardIds >> (2*depth)) - 8]
+        rows = np.arange(len(shardIds))
+        for level in range(depth - 1, -1, -1):
+            v0, v1, v2 = vertices[:, 0], vertices[:, 1], vertices[:, 2]
+            w0, w1, w2 = (w/np.linalg.norm(w, axis=1, keepdims=True) for w in (v1 + v2, v0 + v2, v0 + v1))
+            children = np.stack([np.stack(child, axis=1) for child in
+                                 ((v0, w2, w1), (v1, w0, w2), (v2, w1, w0), (w0, w1, w2))])
+            vertices = children[(shardIds >> (2*level)) & 3, rows]
+        return vertices
 
     def indexPoints(self, raList, decList):
         """Generate shard IDs for sky positions.
@@ -48,3 +48,24 @@ def makeHtmIndexer(config):
 
 makeHtmIndexer.ConfigClass = HtmIndexerConfig
 IndexerRegistry.register("HTM", makeHtmIndexer)
+
+
+class HealpixIndexerConfig(Config):
+    depth = Field(
+        doc="HEALPix order (nside = 2**depth) of the shards.  Default is depth=7 which gives "
+            "~ 0.2 sq. deg. per pixel.",
+        dtype=int,
+        default=7,
+    )
+
+
+def makeHealpixIndexer(config):
+    """Make a HealpixIndexer
+    """
+    # healpy is only needed by catalogs that use this indexer
+    from .healpixIndexer import HealpixIndexer
+    return HealpixIndexer(depth=config.depth)
+
+
+makeHealpixIndexer.ConfigClass = HealpixIndexerConfig
+IndexerRegistry.register("HEALPix", makeHealpixIndexer)
@@ -21,10 +21,13 @@
 
 __all__ = ["IngestIndexManager", "IngestGaiaManager"]
 
+from collections import Counter
 from ctypes import c_int
+import gzip
 import os.path
 import itertools
 import multiprocessing
+import shutil
 
 import astropy.time
 import astropy.units as u
@@ -55,23 +58,29 @@ class IngestIndexManager:
         The Task configuration holding the field names.
     file_reader : `lsst.pipe.base.Task`
         The file reader to use to load the files.
-    indexer : `lsst.meas.algorithms.HtmIndexer`
-        The class used to compute the HTM pixel per coordinate.
+    indexer : `lsst.meas.algorithms.HtmIndexer` or `lsst.meas.algorithms.HealpixIndexer`
+        The class used to compute the shard (HTM or HEALPix pixel) per
+        coordinate.
     schema : `lsst.afw.table.Schema`
         The schema of the output catalog.
     key_map : `dict` [`str`, `lsst.afw.table.Key`]
         The mapping from output field names to keys in the Schema.
     htmRange : `tuple` [`int`]
-        The start and end HTM pixel ids.
+        The start and end (exclusive) shard pixel ids. Only records that
+        fall in this range are written, so that disjoint ranges can be
+        ingested independently.
     addRefCatMetadata : callable
         A function called to add extra metadata to each output Catalog.
     log : `lsst.log.Log`
         The log to send messages to.
+    datasetConfig : `lsst.meas.algorithms.DatasetConfig`, optional
+        The storage configuration of the output reference catalog, if not
+        ``config.dataset_config`` (e.g. when adding to an existing catalog).
     """
     _flags = ['photometric', 'resolved', 'variable']
 
     def __init__(self, filenames, config, file_reader, indexer,
-                 schema, key_map, htmRange, addRefCatMetadata, log):
+                 schema, key_map, htmRange, addRefCatMetadata, log, datasetConfig=None):
         self.filenames = filenames
         self.config = config
         self.file_reader = file_reader
@@ -81,6 +90,7 @@ class IngestIndexManager:
         self.htmRange = htmRange
         self.addRefCatMetadata = addRefCatMetadata
         self.log = log
+        self.datasetConfig = datasetConfig if datasetConfig is not None else config.dataset_config
         if self.config.coord_err_unit is not None:
             # cache this to speed up coordinate conversions
             self.coord_err_unit = u.Unit(self.config.coord_err_unit)
@@ -93,6 +103,11 @@ class IngestIndexManager:
         ----------
         inputFiles : `list`
             A list of file paths to read data from.
+
+        Returns
+        -------
+        shardCounts : `dict` [`int`, `int`]
+            The number of records written to each shard pixel id.
         """
         global COUNTER, FILE_PROGRESS
         self.nInputFiles = len(inputFiles)
@@ -106,7 +121,53 @@ class IngestIndexManager:
                 fileLocks[i] = manager.Lock()
             self.log.info("File locks created.")
             with multiprocessing.Pool(self.config.n_processes) as pool:
-                pool.starmap(self._ingestOneFile, zip(inputFiles, itertools.repeat(fileLocks)))
+                fileCounts = pool.starmap(self._ingestOneFile, zip(inputFiles, itertools.repeat(fileLocks)))
+                shardCounts = Counter()
+                for counts in fileCounts:
+                    shardCounts.update(counts)
+
+                # Compress once each shard is complete, rather than on every
+                # append, so that each file is only compressed once.
+                if self.datasetConfig.compression != "none":
+                    self.log.info("Compressing %d shards with %s level %d.", len(shardCounts),
+                                  self.datasetConfig.compression, self.datasetConfig.compression_level)
+                    pool.map(self._compressOneShard, sorted(shardCounts))
+        return dict(shardCounts)
+
+    def _compressOneShard(self, pixelId):
+        """Compress the output file of one pixel in place.
+
+        Parameters
+        ----------
+        pixelId : `int`
+            The pixel whose file to compress.
+        """
+        self.compressShard(self.filenames[pixelId], self.datasetConfig.compression_level)
+
+    @staticmethod
+    def compressShard(filename, level):
+        """Gzip-compress a shard file in place.
+
+        cfitsio recognizes gzip-compressed files by their content rather than
+        their name, so the file keeps its name and is still readable with
+        `lsst.afw.table.SimpleCatalog.readFits`.
+
+        Parameters
+        ----------
+        filename : `str`
+            The shard file to compress; nothing is done if it is already
+            compressed.
+        level : `int`
+            The gzip compression level, from 1 (fastest) to 9 (smallest).
+        """
+        with open(filename, "rb") as infile:
+            if infile.read(2) == b"\x1f\x8b":
+                return
+            infile.seek(0)
+            tempname = filename + ".tmp"
+            with gzip.open(tempname, "wb", compresslevel=level) as outfile:
+                shutil.copyfileobj(infile, outfile)
+        os.replace(tempname, filename)
 
     def _ingestOneFile(self, filename, fileLocks):
         """Read and process one file, and write its records to the correct
@@ -120,6 +181,11 @@ class IngestIndexManager:
         fileLocks : `dict` [`int`, `multiprocessing.Lock`]
             A Lock for each HTM pixel; each pixel gets one file written, and
             we need to block when one process is accessing that file.
+
+        Returns
+        -------
+        counts : `dict` [`int`, `int`]
+            The number of records written to each shard pixel id.
         """
         global FILE_PROGRESS
         inputData = self.file_reader.run(filename)
@@ -127,10 +193,11 @@ class IngestIndexManager:
         coordErr = self._getCoordErr(inputData)
         matchedPixels = self.indexer.indexPoints(inputData[self.config.ra_name],
                                                  inputData[self.config.dec_name])
-        pixel_ids = set(matchedPixels)
-        for pixelId in pixel_ids:
+        inRange = (matchedPixels >= self.htmRange[0]) & (matchedPixels < self.htmRange[1])
+        counts = {}
+        for pixelId in np.unique(matchedPixels[inRange]):
             with fileLocks[pixelId]:
-                self._doOnePixel(inputData, matchedPixels, pixelId, fluxes, coordErr)
+                counts[int(pixelId)] = self._doOnePixel(inputData, matchedPixels, pixelId, fluxes, coordErr)
         with FILE_PROGRESS.get_lock():
             oldPercent = 100 * FILE_PROGRESS.value / self.nInputFiles
             FILE_PROGRESS.value += 1
@@ -141,6 +208,7 @@ class IngestIndexManager:
                               FILE_PROGRESS.value,
                               self.nInputFiles,
                               percent)
+        return counts
 
     def _doOnePixel(self, inputData, matchedPixels, pixelId, fluxes, coordErr):
         """Process one HTM pixel, appending to an existing catalog or creating
@@ -160,6 +228,11 @@ class IngestIndexManager:
         coordErr : `dict` [`str`, `numpy.ndarray`]
             The values that will go into the coord_raErr, coord_decErr, and
             coord_ra_dec_Cov fields in the output catalog (in radians).
+
+        Returns
+        -------
+        nRecords : `int`
+            The number of records added to the pixel's catalog.
         """
         idx = np.where(matchedPixels == pixelId)[0]
         catalog = self.getCatalog(pixelId, self.schema, len(idx))
@@ -179,6 +252,7 @@ class IngestIndexManager:
             catalog[name][-len(idx):] = array[idx]
 
         catalog.writeFits(self.filenames[pixelId])
+        return len(idx)
 
     def _setIds(self, inputData, catalog):
         """Fill the `id` field of catalog with a running index, filling the
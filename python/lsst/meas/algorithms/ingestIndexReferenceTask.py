@@ -24,14 +24,16 @@
 __all__ = ["IngestIndexedReferenceConfig", "IngestIndexedReferenceTask", "DatasetConfig",
            "IngestGaiaReferenceTask"]
 
+import copy
+import datetime
+import itertools
+import json
 import os.path
 
 import astropy.units
 
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
-import lsst.geom
-import lsst.sphgeom
 import lsst.afw.table as afwTable
 from lsst.daf.base import PropertyList
 from .indexerRegistry import IndexerRegistry
@@ -83,9 +85,20 @@ class IngestReferenceRunner(pipeBase.TaskRunner):
         files = parsedCmd.files
         butler = parsedCmd.butler
         task = self.TaskClass(config=self.config, log=self.log, butler=butler)
-        task.writeConfig(parsedCmd.butler, clobber=self.clobberConfig, doBackup=self.doBackup)
-
-        task.createIndexedCatalog(files)
+        if parsedCmd.partition is not None:
+            # Partitions may run concurrently, so only the final merge
+            # writes anything shared with the other partitions.
+            task.createIndexedCatalog(files, partition=parsedCmd.partition)
+        elif parsedCmd.incremental:
+            # The provenance of an increment is recorded in the dataset
+            # config, so the task config of the original ingest is kept.
+            task.ingestIncrement(files)
+        else:
+            task.writeConfig(parsedCmd.butler, clobber=self.clobberConfig, doBackup=self.doBackup)
+            if parsedCmd.merge_partitions:
+                task.mergePartitions(files)
+            else:
+                task.createIndexedCatalog(files)
         if self.doReturnResults:
             return pipeBase.Struct()
 
@@ -110,6 +123,34 @@ class DatasetConfig(pexConfig.Config):
         default='HTM',
         doc='Name of indexer algoritm to use.  Default is HTM',
     )
+    compression = pexConfig.ChoiceField(
+        dtype=str,
+        doc="Compression applied to each shard file once it has been ingested. Compressed shards are "
+            "decompressed transparently by cfitsio when they are read, so loaders need no changes.",
+        default="none",
+        allowed={
+            "none": "Uncompressed FITS binary tables.",
+            "gzip": "Whole-file gzip compression of each shard FITS file.",
+        },
+    )
+    compression_level = pexConfig.RangeField(
+        dtype=int,
+        doc="Compression level for the shard codec: 1 is fastest, 9 gives the smallest files.",
+        default=6,
+        min=1,
+        max=9,
+    )
+    input_files = pexConfig.ListField(
+        dtype=str,
+        doc="Input files of the initial ingest of the catalog.",
+        default=[],
+    )
+    increments = pexConfig.ListField(
+        dtype=str,
+        doc="Provenance of each increment added to the catalog after its initial ingest, as JSON "
+            "records of the UTC time, input files and number of records ingested.",
+        default=[],
+    )
 
 
 class IngestIndexedReferenceConfig(pexConfig.Config):
@@ -122,6 +163,14 @@ class IngestIndexedReferenceConfig(pexConfig.Config):
         doc=("Number of python processes to use when ingesting."),
         default=1
     )
+    n_partitions = pexConfig.Field(
+        dtype=int,
+        doc=("Number of disjoint pixel-range partitions to split the ingest into. Each partition is run "
+             "independently (``--partition``) over all input files, then combined with "
+             "``--merge-partitions``."),
+        default=1,
+        check=lambda x: x >= 1,
+    )
     file_reader = pexConfig.ConfigurableField(
         target=ReadTextCatalogTask,
         doc='Task to use to read the files.  Default is to expect text files.'
@@ -282,6 +331,9 @@ class IngestIndexedReferenceConfig(pexConfig.Config):
         if (self.pm_ra_name or self.parallax_name) and not self.epoch_name:
             raise ValueError(
                 '"epoch_name" must be specified if "pm_ra/dec_name" or "parallax_name" are specified')
+        if self.n_partitions > 1 and not self.id_name:
+            # the running id counter is not shared between partitions
+            raise ValueError('"id_name" must be specified if "n_partitions" > 1')
 
 
 class IngestIndexedReferenceTask(pipeBase.CmdLineTask):
@@ -319,6 +371,14 @@ class IngestIndexedReferenceTask(pipeBase.CmdLineTask):
         """
         parser = pipeBase.InputOnlyArgumentParser(name=cls._DefaultName)
         parser.add_argument("files", nargs="+", help="Names of files to index")
+        partitionGroup = parser.add_mutually_exclusive_group()
+        partitionGroup.add_argument("--partition", type=int, default=None,
+                                    help="Only ingest this partition (of config.n_partitions) of the pixels")
+        partitionGroup.add_argument("--merge-partitions", action="store_true", default=False,
+                                    help="Merge the outputs of all partitions ingested with --partition")
+        partitionGroup.add_argument("--incremental", action="store_true", default=False,
+                                    help="Add the files to the existing reference catalog in the input "
+                                    "repository, instead of creating a new one")
         return parser
 
     def __init__(self, *args, butler=None, **kwargs):
@@ -329,7 +389,7 @@ class IngestIndexedReferenceTask(pipeBase.CmdLineTask):
         self.makeSubtask('file_reader')
         self.IngestManager = ingestIndexManager.IngestIndexManager
 
-    def createIndexedCatalog(self, inputFiles):
+    def createIndexedCatalog(self, inputFiles, partition=None):
         """Index a set of files comprising a reference catalog.
 
         Outputs are persisted in the butler repository.
@@ -338,25 +398,238 @@ class IngestIndexedReferenceTask(pipeBase.CmdLineTask):
         ----------
         inputFiles : `list`
             A list of file paths to read.
+        partition : `int`, optional
+            If set, only write the shards in this partition of
+            ``config.n_partitions``, and record them in a partition manifest
+            instead of writing the master schema and dataset config; those
+            are written by `mergePartitions` once all partitions are done.
         """
-        schema, key_map = self._saveMasterSchema(inputFiles[0])
-        # create an HTM we can interrogate about pixel ids
-        htm = lsst.sphgeom.HtmPixelization(self.indexer.htm.get_depth())
-        filenames = self._getButlerFilenames(htm)
+        pixelRange = self.indexer.getPixelRange()
+        filenames = self._getButlerFilenames(pixelRange)
+        if partition is None:
+            schema, key_map = self._saveMasterSchema(inputFiles[0])
+        else:
+            pixelRange = self.getPartitionRange(pixelRange, partition)
+            schema, key_map = self.makeMasterSchema(inputFiles[0])
+            catalog = afwTable.SimpleCatalog(schema)
+            addRefCatMetadata(catalog)
+            catalog.writeFits(self._getPartitionFilename(filenames, partition, "master_schema.fits"))
+            self.log.info("Ingesting partition %d of %d: pixels [%d, %d)",
+                          partition, self.config.n_partitions, *pixelRange)
+
         worker = self.IngestManager(filenames,
                                     self.config,
                                     self.file_reader,
                                     self.indexer,
                                     schema,
                                     key_map,
-                                    htm.universe()[0],
+                                    pixelRange,
                                     addRefCatMetadata,
                                     self.log)
-        worker.run(inputFiles)
+        shardCounts = worker.run(inputFiles)
+
+        if partition is not None:
+            manifest = dict(partition=partition,
+                            n_partitions=self.config.n_partitions,
+                            pixel_range=[int(pixelRange[0]), int(pixelRange[1])],
+                            input_files=list(inputFiles),
+                            shards={str(pixelId): count for pixelId, count in sorted(shardCounts.items())})
+            with open(self._getPartitionFilename(filenames, partition, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+            return
 
         # write the config that was used to generate the refcat
         dataId = self.indexer.makeDataId(None, self.config.dataset_config.ref_dataset_name)
-        self.butler.put(self.config.dataset_config, 'ref_cat_config', dataId=dataId)
+        self.butler.put(self._makeDatasetConfig(inputFiles), 'ref_cat_config', dataId=dataId)
+
+    def mergePartitions(self, inputFiles):
+        """Combine the outputs of a partitioned ingest into one reference
+        catalog.
+
+        Check that every partition of ``config.n_partitions`` has been
+        ingested from the same input files with the same schema, then write
+        the master schema, a merged manifest of the shards, and the dataset
+        config. The per-partition manifests and schemas are then deleted.
+
+        Parameters
+        ----------
+        inputFiles : `list`
+            The file paths that each partition was ingested from.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if a partition is missing or inconsistent with the others.
+        """
+        filenames = self._getButlerFilenames(self.indexer.getPixelRange())
+        masterSchema = None
+        shards = {}
+        for partition in range(self.config.n_partitions):
+            manifestFile = self._getPartitionFilename(filenames, partition, "manifest.json")
+            if not os.path.exists(manifestFile):
+                raise RuntimeError(f"Partition {partition} has not been ingested: {manifestFile} not found")
+            with open(manifestFile) as f:
+                manifest = json.load(f)
+            if manifest["n_partitions"] != self.config.n_partitions:
+                raise RuntimeError(f"Partition {partition} was ingested with n_partitions="
+                                   f"{manifest['n_partitions']}, not {self.config.n_partitions}")
+            if manifest["input_files"] != list(inputFiles):
+                raise RuntimeError(f"Partition {partition} was ingested from different input files")
+            shards.update(manifest["shards"])
+
+            schemaCatalog = afwTable.SimpleCatalog.readFits(
+                self._getPartitionFilename(filenames, partition, "master_schema.fits"))
+            if masterSchema is None:
+                masterSchema = schemaCatalog
+            elif (schemaCatalog.schema.compare(masterSchema.schema, afwTable.Schema.IDENTICAL)
+                  != afwTable.Schema.IDENTICAL):
+                raise RuntimeError(f"Partition {partition} has a different schema than partition 0")
+
+        dataId = self.indexer.makeDataId('master_schema', self.config.dataset_config.ref_dataset_name)
+        self.butler.put(masterSchema, 'ref_cat', dataId=dataId)
+        manifest = dict(n_partitions=self.config.n_partitions, input_files=list(inputFiles), shards=shards)
+        with open(os.path.join(os.path.dirname(next(iter(filenames.values()))), "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        self.log.info("Merged %d partitions with %d shards and %d records", self.config.n_partitions,
+                      len(shards), sum(shards.values()))
+
+        dataId = self.indexer.makeDataId(None, self.config.dataset_config.ref_dataset_name)
+        self.butler.put(self._makeDatasetConfig(inputFiles), 'ref_cat_config', dataId=dataId)
+
+        # delete the bookkeeping only once the merge is complete, so that a failed merge can be re-run
+        for partition in range(self.config.n_partitions):
+            for suffix in ("manifest.json", "master_schema.fits"):
+                os.remove(self._getPartitionFilename(filenames, partition, suffix))
+
+    def _makeDatasetConfig(self, inputFiles):
+        """Make the dataset config to persist with a newly ingested catalog.
+
+        Parameters
+        ----------
+        inputFiles : `list`
+            The file paths the catalog was ingested from.
+
+        Returns
+        -------
+        datasetConfig : `DatasetConfig`
+            A copy of ``config.dataset_config``, recording ``inputFiles``.
+        """
+        datasetConfig = copy.deepcopy(self.config.dataset_config)
+        datasetConfig.input_files = list(inputFiles)
+        return datasetConfig
+
+    def ingestIncrement(self, inputFiles):
+        """Add a set of files to an existing reference catalog.
+
+        The master schema and dataset config of the existing catalog are
+        reused, only the shards that receive new records are rewritten, and
+        the increment is recorded in the ``increments`` field of the dataset
+        config.
+
+        Parameters
+        ----------
+        inputFiles : `list`
+            A list of file paths to read.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if the new files cannot be added to the existing catalog:
+            ids are not read from the input (``config.id_name``), the catalog
+            is in an old format, a file was already ingested, or the new
+            files do not produce the catalog's schema.
+        """
+        refCatName = self.config.dataset_config.ref_dataset_name
+        if not self.config.id_name:
+            raise RuntimeError("Incremental ingest requires id_name, so that new ids do not collide.")
+        datasetConfig = self.butler.get("ref_cat_config", name=refCatName, immediate=True)
+        if datasetConfig.format_version != LATEST_FORMAT_VERSION:
+            raise RuntimeError(f"Cannot add to {refCatName}: its format_version="
+                               f"{datasetConfig.format_version} is not the latest ({LATEST_FORMAT_VERSION}).")
+        previousFiles = set(itertools.chain(datasetConfig.input_files,
+                                            *(json.loads(increment)["files"]
+                                              for increment in datasetConfig.increments)))
+        repeated = previousFiles.intersection(inputFiles)
+        if repeated:
+            raise RuntimeError(f"Files already ingested into {refCatName}: {sorted(repeated)}")
+
+        indexer = IndexerRegistry[datasetConfig.indexer.name](datasetConfig.indexer.active)
+        masterSchema = self.butler.get('ref_cat', dataId=indexer.makeDataId('master_schema', refCatName),
+                                       immediate=True).schema
+        schema, key_map = self.makeMasterSchema(inputFiles[0])
+        flags = afwTable.Schema.EQUAL_KEYS | afwTable.Schema.EQUAL_NAMES
+        if schema.compare(masterSchema, flags) != flags:
+            raise RuntimeError(f"The schema of the new files is not compatible with {refCatName}:\n"
+                               f"{schema}\nis not\n{masterSchema}")
+
+        pixelRange = indexer.getPixelRange()
+        filenames = self._getButlerFilenames(pixelRange, indexer=indexer, refCatName=refCatName)
+        worker = self.IngestManager(filenames,
+                                    self.config,
+                                    self.file_reader,
+                                    indexer,
+                                    masterSchema,
+                                    key_map,
+                                    pixelRange,
+                                    addRefCatMetadata,
+                                    self.log,
+                                    datasetConfig=datasetConfig)
+        shardCounts = worker.run(inputFiles)
+        self.log.info("Added %d records to %d shards of %s", sum(shardCounts.values()), len(shardCounts),
+                      refCatName)
+
+        increment = dict(time=datetime.datetime.utcnow().isoformat(),
+                         files=list(inputFiles),
+                         n_records=sum(shardCounts.values()))
+        datasetConfig.increments.append(json.dumps(increment))
+        dataId = indexer.makeDataId(None, refCatName)
+        self.butler.put(datasetConfig, 'ref_cat_config', dataId=dataId)
+
+    def getPartitionRange(self, pixelRange, partition):
+        """Get the pixel range of one partition of the ingest.
+
+        Parameters
+        ----------
+        pixelRange : `tuple` [`int`]
+            The start and end (exclusive) of all shard pixel ids.
+        partition : `int`
+            The partition index, in ``[0, config.n_partitions)``.
+
+        Returns
+        -------
+        partitionRange : `tuple` [`int`]
+            The start and end (exclusive) shard pixel ids of the partition.
+        """
+        if not 0 <= partition < self.config.n_partitions:
+            raise ValueError(f"partition={partition} is not in [0, {self.config.n_partitions})")
+        start, end = pixelRange
+        size = end - start
+        return (start + size*partition//self.config.n_partitions,
+                start + size*(partition + 1)//self.config.n_partitions)
+
+    @staticmethod
+    def _getPartitionFilename(filenames, partition, suffix):
+        """Get the path of a per-partition bookkeeping file, next to the
+        shards.
+        """
+        return os.path.join(os.path.dirname(next(iter(filenames.values()))),
+                            f"partition_{partition}_{suffix}")
+
+    def makeMasterSchema(self, filename):
+        """Generate the master catalog schema.
+
+        Parameters
+        ----------
+        filename : `str`
+            An input file to read to get the input dtype.
+
+        Returns
+        -------
+        schemaAndKeyMap : `tuple` of (`lsst.afw.table.Schema`, `dict`)
+            The output schema and key map, as from `makeSchema`.
+        """
+        arr = self.file_reader.run(filename)
+        return self.makeSchema(arr.dtype)
 
     def _saveMasterSchema(self, filename):
         """Generate and save the master catalog schema.
@@ -366,8 +639,7 @@ class IngestIndexedReferenceTask(pipeBase.CmdLineTask):
         filename : `str`
             An input file to read to get the input dtype.
         """
-        arr = self.file_reader.run(filename)
-        schema, key_map = self.makeSchema(arr.dtype)
+        schema, key_map = self.makeMasterSchema(filename)
         dataId = self.indexer.makeDataId('master_schema',
                                          self.config.dataset_config.ref_dataset_name)
 
@@ -376,12 +648,27 @@ class IngestIndexedReferenceTask(pipeBase.CmdLineTask):
         self.butler.put(catalog, 'ref_cat', dataId=dataId)
         return schema, key_map
 
-    def _getButlerFilenames(self, htm):
-        """Get filenames from the butler for each output pixel."""
+    def _getButlerFilenames(self, pixelRange, indexer=None, refCatName=None):
+        """Get filenames from the butler for each output pixel.
+
+        Parameters
+        ----------
+        pixelRange : `tuple` [`int`]
+            The start and end (exclusive) shard ids to make filenames for.
+        indexer : `HtmIndexer` or `HealpixIndexer`, optional
+            Indexer of the catalog; if `None`, use ``self.indexer``.
+        refCatName : `str`, optional
+            Name of the catalog; if `None`, use
+            ``config.dataset_config.ref_dataset_name``.
+        """
+        if indexer is None:
+            indexer = self.indexer
+        if refCatName is None:
+            refCatName = self.config.dataset_config.ref_dataset_name
         filenames = {}
-        start, end = htm.universe()[0]
+        start, end = pixelRange
         # path manipulation because butler.get() per pixel will take forever
-        dataId = self.indexer.makeDataId(start, self.config.dataset_config.ref_dataset_name)
+        dataId = indexer.makeDataId(start, refCatName)
         path = self.butler.get('ref_cat_filename', dataId=dataId)[0]
         base = os.path.join(os.path.dirname(path), "%d"+os.path.splitext(path)[1])
         for pixelId in range(start, end):
@@ -1,7 +1,9 @@
 
-__all__ = ["SkyObjectsConfig", "SkyObjectsTask", "generateSkyObjects"]
+__all__ = ["SkyObjectsConfig", "SkyObjectsTask", "generateSkyObjects", "sampleAllowedCenters"]
 
-from lsst.pex.config import Config, Field, ListField
+import numpy as np
+
+from lsst.pex.config import Config, Field, ListField, ChoiceField
 from lsst.pipe.base import Task
 
 import lsst.afw.detection
@@ -24,6 +26,10 @@ class SkyObjectsConfig(Config):
                                     doc="Set nTrialSkySources to\n"
                                         "    nSkySources*nTrialSkySourcesMultiplier\n"
                                         "if nTrialSkySources is None")
+    algorithm = ChoiceField(dtype=str, default="trial", doc="Algorithm for placing sky objects",
+                            allowed={"trial": "Test up to nTrialSources random positions against the mask",
+                                     "erode": "Erode the allowed region by the sky object radius once, "
+                                              "then draw positions from what remains"})
 
 
 def generateSkyObjects(mask, seed, config):
@@ -33,9 +39,14 @@ def generateSkyObjects(mask, seed, config):
     through the provided `mask` (in which objects are typically flagged
     as `DETECTED`).
 
-    The algorithm for determining sky objects is random trial and error:
-    we try up to `nTrialSkySources` random positions to find `nSources`
-    sky objects.
+    The default algorithm for determining sky objects is random trial and
+    error: we try up to `nTrialSkySources` random positions to find
+    `nSources` sky objects. With ``algorithm="erode"``, the avoided pixels
+    are instead dilated once by the sky object radius (equivalent to
+    thresholding their distance transform), and the positions are drawn
+    uniformly from the pixels that remain, so every position drawn is
+    usable; the number of positions drawn is still limited by
+    `nTrialSkySources`.
 
     Parameters
     ----------
@@ -73,6 +84,16 @@ def generateSkyObjects(mask, seed, config):
 
     rng = lsst.afw.math.Random(seed=seed)
 
+    if config.algorithm == "erode":
+        skyFootprints = []
+        numCenters = min(nSkySources, nTrialSkySources)
+        for x, y in sampleAllowedCenters(avoid, box, int(skySourceRadius), numCenters, rng):
+            spans = lsst.afw.geom.SpanSet.fromShape(int(skySourceRadius), offset=(x, y))
+            fp = lsst.afw.detection.Footprint(spans, mask.getBBox())
+            fp.addPeak(x, y, 0)
+            skyFootprints.append(fp)
+        return skyFootprints
+
     skyFootprints = []
     for _ in range(nTrialSkySources):
         if len(skyFootprints) == nSkySources:
@@ -91,6 +112,47 @@ def generateSkyObjects(mask, seed, config):
     return skyFootprints
 
 
+def sampleAllowedCenters(avoid, box, radius, numCenters, rng):
+    """Draw random positions of circles that avoid a set of pixels
+
+    The avoided pixels are dilated by the circle radius, so that the
+    remaining pixels are exactly the centers for which a circle of that
+    radius does not overlap ``avoid``. Positions are drawn uniformly from
+    those pixels.
+
+    Parameters
+    ----------
+    avoid : `lsst.afw.geom.SpanSet`
+        Pixels to avoid.
+    box : `lsst.geom.Box2I`
+        Box within which to place the centers.
+    radius : `int`
+        Radius of the circles, in pixels.
+    numCenters : `int`
+        Number of centers to draw.
+    rng : `lsst.afw.math.Random`
+        Random number generator.
+
+    Returns
+    -------
+    centers : `list` of `tuple` of `int`
+        Positions ``(x, y)`` of the centers; empty if no position is allowed.
+    """
+    allowed = lsst.afw.geom.SpanSet(box).intersectNot(avoid.dilated(radius))
+    spans = [(span.getY(), span.getMinX(), span.getWidth()) for span in allowed]
+    if not spans:
+        return []
+    yy, x0, width = (np.array(values) for values in zip(*spans))
+    ends = np.cumsum(width)
+    centers = []
+    for _ in range(numCenters):
+        index = int(rng.flat(0, float(ends[-1])))
+        spanIndex = np.searchsorted(ends, index, side="right")
+        start = ends[spanIndex] - width[spanIndex]
+        centers.append((int(x0[spanIndex] + index - start), int(yy[spanIndex])))
+    return centers
+
+
 class SkyObjectsTask(Task):
     ConfigClass = SkyObjectsConfig
 
@@ -103,7 +165,7 @@ class SkyObjectsTask(Task):
 
         The algorithm for determining sky objects is random trial and error:
         we try up to `nTrialSkySources` random positions to find `nSources`
-        sky objects.
+        sky objects, unless ``algorithm="erode"`` (see `generateSkyObjects`).
 
         Parameters
         ----------
@@ -20,9 +20,11 @@
 # the GNU General Public License along with this program.  If not,
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
-__all__ = ("SubtractBackgroundConfig", "SubtractBackgroundTask")
+__all__ = ("SubtractBackgroundConfig", "SubtractBackgroundTask", "getBinEdges")
 
+from concurrent.futures import ThreadPoolExecutor
 import itertools
+import warnings
 
 import numpy
 
@@ -30,12 +32,25 @@ from lsstDebug import getDebugFrame
 from lsst.utils import suppress_deprecations
 
 import lsst.afw.display as afwDisplay
+import lsst.geom
 import lsst.afw.image as afwImage
 import lsst.afw.math as afwMath
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
 
 
+def getBinEdges(length, numBins):
+    """!Get the edges of the bins into which lsst.afw.math.makeBackground divides an axis
+
+    @param[in] length  number of pixels along the axis
+    @param[in] numBins  number of bins
+
+    @return edges of the bins (a numpy array of numBins + 1 ints), starting at 0
+    """
+    ends = numpy.minimum((numpy.arange(1, numBins + 1)*length + numBins//2)//numBins, length)
+    return numpy.concatenate([[0], ends])
+
+
 class SubtractBackgroundConfig(pexConfig.Config):
     """!Config for SubtractBackgroundTask
 
@@ -114,6 +129,31 @@ class SubtractBackgroundConfig(pexConfig.Config):
         doc="Use inverse variance weighting in calculation (valid only with useApprox=True)",
         dtype=bool, default=True,
     )
+    statisticsEngine = pexConfig.ChoiceField(
+        doc="How to compute the statistics of the bins of the background grid",
+        dtype=str, default="afw",
+        allowed={
+            "afw": "lsst.afw.math.makeBackground, one bin at a time",
+            "numpy": "vectorized numpy over all the bins in each row of bins; pixels that are not finite "
+                     "are always ignored",
+        },
+    )
+    numThreads = pexConfig.RangeField(
+        doc="Number of threads between which to divide the rows of bins (statisticsEngine=numpy only)",
+        dtype=int, default=1, min=1,
+    )
+    subtractBlockHeight = pexConfig.RangeField(
+        doc=("Number of rows of the background model to evaluate at a time when subtracting it, so that "
+             "no image of the full background is allocated; if 0, the whole model is evaluated at once. "
+             "An approximated (useApprox) model is always evaluated at once"),
+        dtype=int, default=0, min=0,
+    )
+    statsSampleSpacing = pexConfig.RangeField(
+        doc=("Spacing, in rows and columns, of the pixels at which the background model is evaluated to "
+             "measure the mean and variance recorded in the metadata; if 1, all pixels are used. "
+             "An approximated (useApprox) model is always evaluated at all pixels"),
+        dtype=int, default=1, min=1,
+    )
 
 
 ## @addtogroup LSST_task_documentation
@@ -237,7 +277,7 @@ class SubtractBackgroundTask(pipeBase.Task):
 
         maskedImage = exposure.getMaskedImage()
         fitBg = self.fitBackground(maskedImage)
-        maskedImage -= fitBg.getImageF(self.config.algorithm, self.config.undersampleStyle)
+        self.subtractBackgroundModel(maskedImage, fitBg)
 
         actrl = fitBg.getBackgroundControl().getApproximateControl()
         background.append((fitBg, getattr(afwMath.Interpolate, self.config.algorithm),
@@ -262,33 +302,136 @@ class SubtractBackgroundTask(pipeBase.Task):
             background=background,
         )
 
+    def subtractBackgroundModel(self, maskedImage, bg):
+        """!Subtract a fit background model from a masked image
+
+        If config.subtractBlockHeight is not 0 and bg is not an approximation (which afw evaluates
+        over the whole image, whatever bounding box is requested), the model is evaluated and
+        subtracted that many rows at a time, so that no full-size image of the background is allocated.
+
+        @param[in,out] maskedImage  masked image from which to subtract the background
+        @param[in] bg  fit background (an lsst.afw.math.Background), as returned by fitBackground
+
+        @return image of the background that was subtracted (an lsst.afw.image.ImageF), or None
+            if it was subtracted a block of rows at a time
+        """
+        if self.config.subtractBlockHeight == 0 or self._isApproximated(bg):
+            bgImage = bg.getImageF(self.config.algorithm, self.config.undersampleStyle)
+            maskedImage -= bgImage
+            return bgImage
+        for block in self._getBlocks(maskedImage.getBBox(), self.config.subtractBlockHeight):
+            subImage = maskedImage.Factory(maskedImage, block, afwImage.PARENT, False)
+            subImage -= bg.getImageF(block, self.config.algorithm, self.config.undersampleStyle)
+        return None
+
     def _addStats(self, exposure, background, statsKeys=None):
         """Add statistics about the background to the exposure's metadata
 
+        Unless config.subtractBlockHeight is 0 and config.statsSampleSpacing is 1, the statistics
+        are measured from the model evaluated a block of rows, or a sampled row, at a time
+        (see _measureSampledStats).
+
         @param[in,out] exposure  exposure whose background was subtracted
         @param[in,out] background  background model (an lsst.afw.math.BackgroundList)
         @param[in] statsKeys  key names used to store the mean and variance of the background
             in the exposure's metadata (a pair of strings); if None then use ("BGMEAN", "BGVAR");
             ignored if stats is false
         """
-        netBgImg = background.getImage()
         if statsKeys is None:
             statsKeys = ("BGMEAN", "BGVAR")
         mnkey, varkey = statsKeys
         meta = exposure.getMetadata()
-        s = afwMath.makeStatistics(netBgImg, afwMath.MEAN | afwMath.VARIANCE)
-        bgmean = s.getValue(afwMath.MEAN)
-        bgvar = s.getValue(afwMath.VARIANCE)
+        if self.config.subtractBlockHeight == 0 and self.config.statsSampleSpacing == 1:
+            netBgImg = background.getImage()
+            s = afwMath.makeStatistics(netBgImg, afwMath.MEAN | afwMath.VARIANCE)
+            bgmean = s.getValue(afwMath.MEAN)
+            bgvar = s.getValue(afwMath.VARIANCE)
+        else:
+            bgmean, bgvar = self._measureSampledStats(background, exposure.getBBox())
         meta.addDouble(mnkey, bgmean)
         meta.addDouble(varkey, bgvar)
 
-    def fitBackground(self, maskedImage, nx=0, ny=0, algorithm=None):
+    def _measureSampledStats(self, background, bbox):
+        """!Measure the mean and variance of a background model without evaluating it all at once
+
+        With config.statsSampleSpacing > 1, the model is evaluated only on every
+        config.statsSampleSpacing-th row, and those rows are subsampled by the same factor;
+        otherwise it is evaluated config.subtractBlockHeight rows at a time. Approximated entries
+        of the list, which afw evaluates over the whole image whatever bounding box is requested,
+        are evaluated in full once, and sliced.
+
+        @param[in] background  background model (an lsst.afw.math.BackgroundList)
+        @param[in] bbox  bounding box of the exposure whose background is modelled
+
+        @return the mean and (sample) variance of the model (a pair of floats)
+        """
+        spacing = self.config.statsSampleSpacing
+        if spacing > 1:
+            blocks = (lsst.geom.Box2I(lsst.geom.Point2I(bbox.getMinX(), y),
+                                      lsst.geom.Extent2I(bbox.getWidth(), 1))
+                      for y in range(bbox.getMinY(), bbox.getEndY(), spacing))
+        else:
+            blocks = self._getBlocks(bbox, self.config.subtractBlockHeight)
+        fullImages = [bg.getImageF(interpStyle, undersampleStyle).array
+                      if approxStyle != afwMath.ApproximateControl.UNKNOWN else None
+                      for bg, interpStyle, undersampleStyle, approxStyle, *_ in background]
+        count = 0
+        sum1 = 0.0
+        sum2 = 0.0
+        reference = None
+        for block in blocks:
+            values = None
+            for (bg, interpStyle, undersampleStyle, *_), fullImage in zip(background, fullImages):
+                if fullImage is not None:
+                    y0 = block.getMinY() - bbox.getMinY()
+                    blockValues = fullImage[y0:y0 + block.getHeight(), ::spacing]
+                else:
+                    blockValues = bg.getImageF(block, interpStyle, undersampleStyle).array[:, ::spacing]
+                values = blockValues.astype(numpy.float64) if values is None else values + blockValues
+            # Accumulate relative to the first value, to avoid cancellation in the variance
+            if reference is None:
+                reference = values.flat[0]
+            values = values - reference
+            count += values.size
+            sum1 += values.sum()
+            sum2 += (values**2).sum()
+        mean = sum1/count
+        variance = (sum2 - sum1*mean)/(count - 1) if count > 1 else numpy.nan
+        return reference + mean, variance
+
+    @staticmethod
+    def _isApproximated(bg):
+        """!Return whether a background model is a (Chebyshev) approximation
+
+        @param[in] bg  background model (an lsst.afw.math.Background)
+        """
+        style = bg.getBackgroundControl().getApproximateControl().getStyle()
+        return style != afwMath.ApproximateControl.UNKNOWN
+
+    @staticmethod
+    def _getBlocks(bbox, height):
+        """!Divide a bounding box into blocks of rows
+
+        @param[in] bbox  bounding box to divide (an lsst.geom.Box2I)
+        @param[in] height  number of rows per block; the last block may have fewer
+
+        @return a generator of the blocks (lsst.geom.Box2I), from the bottom up
+        """
+        for y0 in range(bbox.getMinY(), bbox.getEndY(), height):
+            yield lsst.geom.Box2I(lsst.geom.Point2I(bbox.getMinX(), y0),
+                                  lsst.geom.Extent2I(bbox.getWidth(), min(height, bbox.getEndY() - y0)))
+
+    def fitBackground(self, maskedImage, nx=0, ny=0, algorithm=None, binStats=None):
         """!Estimate the background of a masked image
 
         @param[in] maskedImage  masked image whose background is to be computed
         @param[in] nx  number of x bands; if 0 compute from width and config.binSizeX
         @param[in] ny  number of y bands; if 0 compute from height and config.binSizeY
         @param[in] algorithm  name of interpolation algorithm; if None use self.config.algorithm
+        @param[in,out] binStats  statistics of the bins from a previous fit of maskedImage (an
+            lsst.pipe.base.Struct filled by that fit), or an empty Struct to be filled; if not None,
+            only the bins whose good pixels have changed since are measured again (see
+            updateBinStatistics), and binStats is updated. Requires config.statisticsEngine=numpy.
 
         @return fit background as an lsst.afw.math.Background
 
@@ -384,7 +527,224 @@ class SubtractBackgroundTask(pipeBase.Task):
                                                self.config.weighting)
             bctrl.setApproximateControl(actrl)
 
-        bg = afwMath.makeBackground(maskedImage, bctrl)
+        if binStats is not None and self.config.statisticsEngine != "numpy":
+            raise ValueError("Cached bin statistics require statisticsEngine=numpy")
+        if self.config.statisticsEngine == "numpy":
+            bg = self._makeBackgroundNumpy(maskedImage, bctrl, badMask, algorithm, binStats=binStats)
+        else:
+            bg = afwMath.makeBackground(maskedImage, bctrl)
         if bg is None:
             raise RuntimeError("lsst.afw.math.makeBackground failed to fit a background model")
         return bg
+
+    def updateBinStatistics(self, binStats, maskedImage, model):
+        """!Update cached statistics of the background bins after a model is subtracted from an image
+
+        Where the model is constant over the good pixels of a bin, the statistics of the bin are
+        shifted by that constant, which is exact for all the statistics. The other bins are
+        marked to be measured again by the next fit, since a varying model changes a clipped
+        mean or a median by other than its mean.
+
+        @param[in,out] binStats  statistics of the bins, as filled by fitBackground
+        @param[in] maskedImage  masked image from which model has been subtracted
+        @param[in] model  model subtracted from maskedImage: a float, a numpy array of the same
+            shape as the image, or an lsst.afw.math.Background, which is evaluated one row of
+            bins at a time unless it is an approximation
+        """
+        if not numpy.isscalar(model) and not isinstance(model, numpy.ndarray) and self._isApproximated(model):
+            model = model.getImageF(self.config.algorithm, self.config.undersampleStyle).array
+        if numpy.isscalar(model):
+            binStats.value -= model
+            constant = numpy.ones(binStats.value.shape, dtype=bool)
+        else:
+            if isinstance(model, numpy.ndarray):
+                low, high = self._rangeBins(model, binStats.good, binStats.xEdges, binStats.yEdges)
+            else:
+                bbox = maskedImage.getBBox()
+                low = numpy.zeros(binStats.value.shape)
+                high = numpy.zeros(binStats.value.shape)
+                for iy, (y0, y1) in enumerate(zip(binStats.yEdges[:-1], binStats.yEdges[1:])):
+                    block = lsst.geom.Box2I(lsst.geom.Point2I(bbox.getMinX(), bbox.getMinY() + y0),
+                                            lsst.geom.Extent2I(bbox.getWidth(), y1 - y0))
+                    blockModel = model.getImageF(block, self.config.algorithm,
+                                                 self.config.undersampleStyle).array
+                    blockLow, blockHigh = self._rangeBins(blockModel, binStats.good[y0:y1],
+                                                          binStats.xEdges, [0, y1 - y0])
+                    low[iy] = blockLow[0]
+                    high[iy] = blockHigh[0]
+            # Bins without good pixels have low=inf and high=-inf, and need no shift
+            constant = high <= low
+            binStats.value -= numpy.where(constant & numpy.isfinite(low), low, 0.0)
+        binStats.checksum = self._sumBins(numpy.where(binStats.good, maskedImage.image.array, 0.0),
+                                          binStats.xEdges, binStats.yEdges)
+        binStats.checksum[~constant] = numpy.nan
+
+    def _makeBackgroundNumpy(self, maskedImage, bctrl, badMask, algorithm, binStats=None):
+        """!Estimate the background of a masked image with vectorized numpy statistics
+
+        The image is divided into the same grid of bins as by lsst.afw.math.makeBackground,
+        and the statistic of all the bins in a row of bins is computed at once; the rows
+        are shared between config.numThreads threads.
+
+        If binStats holds the statistics of a previous fit on the same grid, a bin is only
+        measured again if its good pixels, or the sum of their values, have changed.
+
+        @param[in] maskedImage  masked image whose background is to be computed
+        @param[in] bctrl  background control (an lsst.afw.math.BackgroundControl), providing
+            the size of the grid, the statistics control and the approximation control
+        @param[in] badMask  bit mask of pixels to ignore
+        @param[in] algorithm  name of interpolation algorithm
+        @param[in,out] binStats  statistics of the bins from a previous fit (an
+            lsst.pipe.base.Struct), or an empty Struct; updated if not None
+
+        @return fit background as an lsst.afw.math.BackgroundMI, made from the grid of bin statistics
+        """
+        nx = bctrl.getNxSample()
+        ny = bctrl.getNySample()
+        sctrl = bctrl.getStatisticsControl()
+        width = maskedImage.getWidth()
+        xEdges = getBinEdges(width, nx)
+        yEdges = getBinEdges(maskedImage.getHeight(), ny)
+        # Columns of each bin, padded to the widest bin with a column of NaNs
+        binWidths = numpy.diff(xEdges)
+        columns = numpy.full((nx, binWidths.max()), width)
+        for ix in range(nx):
+            columns[ix, :binWidths[ix]] = numpy.arange(xEdges[ix], xEdges[ix + 1])
+
+        value = numpy.full((ny, nx), numpy.nan)
+        variance = numpy.full((ny, nx), numpy.nan)
+        changed = numpy.ones((ny, nx), dtype=bool)
+        if binStats is not None:
+            good = ((maskedImage.mask.array & badMask) == 0) & numpy.isfinite(maskedImage.image.array)
+            checksum = self._sumBins(numpy.where(good, maskedImage.image.array, 0.0), xEdges, yEdges)
+            if (getattr(binStats, "good", None) is not None and binStats.good.shape == good.shape
+                    and numpy.array_equal(binStats.xEdges, xEdges)
+                    and numpy.array_equal(binStats.yEdges, yEdges)):
+                changed = ((checksum != binStats.checksum)
+                           | (self._sumBins(good != binStats.good, xEdges, yEdges) > 0))
+                value[:] = binStats.value
+                variance[:] = binStats.variance
+
+        def measureRow(iy):
+            binColumns = columns[changed[iy]]
+            rows = slice(yEdges[iy], yEdges[iy + 1])
+            image = maskedImage.image.array[rows]
+            values = numpy.full((image.shape[0], width + 1), numpy.nan)
+            rowGood = ((maskedImage.mask.array[rows] & badMask) == 0) & numpy.isfinite(image)
+            values[:, :width][rowGood] = image[rowGood]
+            values = values[:, binColumns].transpose(1, 0, 2).reshape(len(binColumns), -1)
+            value[iy, changed[iy]], variance[iy, changed[iy]] = self._measureBinStatistics(
+                values, self.config.statisticsProperty, sctrl.getNumSigmaClip(), sctrl.getNumIter())
+
+        with ThreadPoolExecutor(max_workers=self.config.numThreads) as executor:
+            list(executor.map(measureRow, numpy.nonzero(changed.any(axis=1))[0]))
+
+        if binStats is not None:
+            binStats.xEdges = xEdges
+            binStats.yEdges = yEdges
+            binStats.value = value
+            binStats.variance = variance
+            binStats.good = good
+            binStats.numGood = self._sumBins(good, xEdges, yEdges)
+            binStats.checksum = checksum
+            binStats.numMeasured = int(changed.sum())
+
+        statsImage = afwImage.MaskedImageF(nx, ny)
+        statsImage.image.array[:] = value
+        statsImage.variance.array[:] = variance
+        return self.makeBackgroundFromStats(maskedImage.getBBox(), statsImage, algorithm,
+                                            bctrl.getApproximateControl())
+
+    def makeBackgroundFromStats(self, bbox, statsImage, algorithm=None, approxControl=None):
+        """!Make a background model from a grid of bin statistics
+
+        @param[in] bbox  bounding box of the image modelled (an lsst.geom.Box2I)
+        @param[in] statsImage  value and variance of each bin (an lsst.afw.image.MaskedImageF),
+            the bins dividing bbox as by lsst.afw.math.makeBackground
+        @param[in] algorithm  name of interpolation algorithm; if None use self.config.algorithm
+        @param[in] approxControl  approximation control (an lsst.afw.math.ApproximateControl);
+            if None the bins are interpolated
+
+        @return background model (an lsst.afw.math.BackgroundMI)
+        """
+        if algorithm is None:
+            algorithm = self.config.algorithm
+        bg = afwMath.BackgroundMI(bbox, statsImage)
+        newCtrl = bg.getBackgroundControl()
+        with suppress_deprecations():
+            newCtrl.setInterpStyle(algorithm)
+        newCtrl.setUndersampleStyle(self.config.undersampleStyle)
+        if approxControl is not None:
+            newCtrl.setApproximateControl(approxControl)
+        return bg
+
+    @staticmethod
+    def _sumBins(array, xEdges, yEdges):
+        """!Sum an image over each bin of a grid
+
+        @param[in] array  image to sum (a 2-d numpy array)
+        @param[in] xEdges  edges of the bins in x, as returned by getBinEdges
+        @param[in] yEdges  edges of the bins in y, as returned by getBinEdges
+
+        @return sum over each bin (a 2-d numpy array of float64, indexed by [y, x])
+        """
+        rowSums = numpy.add.reduceat(array, yEdges[:-1], axis=0, dtype=numpy.float64)
+        return numpy.add.reduceat(rowSums, xEdges[:-1], axis=1)
+
+    @staticmethod
+    def _rangeBins(array, good, xEdges, yEdges):
+        """!Find the range of an image over the good pixels of each bin of a grid
+
+        @param[in] array  image (a 2-d numpy array)
+        @param[in] good  which pixels to include (a 2-d numpy array of bool)
+        @param[in] xEdges  edges of the bins in x, as returned by getBinEdges
+        @param[in] yEdges  edges of the bins in y, as returned by getBinEdges
+
+        @return minimum and maximum over each bin (a pair of 2-d numpy arrays, indexed by
+            [y, x]); inf and -inf for bins without good pixels
+        """
+        low = numpy.minimum.reduceat(numpy.where(good, array, numpy.inf), yEdges[:-1], axis=0)
+        high = numpy.maximum.reduceat(numpy.where(good, array, -numpy.inf), yEdges[:-1], axis=0)
+        return (numpy.minimum.reduceat(low, xEdges[:-1], axis=1),
+                numpy.maximum.reduceat(high, xEdges[:-1], axis=1))
+
+    @staticmethod
+    def _measureBinStatistics(values, statistic, numSigmaClip, numIter):
+        """!Compute a statistic of many bins at once
+
+        The clipped mean follows lsst.afw.math: starting from the median, and a width
+        estimated from the interquartile range, the mean and standard deviation of the
+        pixels within numSigmaClip standard deviations are computed numIter times.
+
+        @param[in] values  pixel values of each bin (a 2-d numpy array, one row per bin),
+            with ignored pixels set to NaN
+        @param[in] statistic  name of the statistic: MEANCLIP, MEAN or MEDIAN
+        @param[in] numSigmaClip  number of standard deviations at which to clip (MEANCLIP only)
+        @param[in] numIter  number of clipping iterations (MEANCLIP only)
+
+        @return the statistic for each bin and its variance (a pair of 1-d numpy arrays);
+            NaN for bins without any good pixels
+        """
+        with warnings.catch_warnings():
+            # Bins without any good pixels
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            count = numpy.sum(numpy.isfinite(values), axis=1)
+            if statistic == "MEDIAN":
+                value = numpy.nanmedian(values, axis=1)
+                variance = 0.5*numpy.pi*numpy.nanvar(values, axis=1, ddof=1)/count
+            elif statistic == "MEAN":
+                value = numpy.nanmean(values, axis=1)
+                variance = numpy.nanvar(values, axis=1, ddof=1)/count
+            else:
+                lower, value, upper = numpy.nanpercentile(values, [25, 50, 75], axis=1)
+                halfWidth = numSigmaClip*0.741301109*(upper - lower)
+                variance = numpy.full(len(values), numpy.nan)
+                for _ in range(numIter):
+                    use = numpy.abs(values - value[:, numpy.newaxis]) < halfWidth[:, numpy.newaxis]
+                    count = numpy.sum(use, axis=1)
+                    value = numpy.sum(numpy.where(use, values, 0.0), axis=1)/count
+                    residuals = numpy.where(use, values - value[:, numpy.newaxis], 0.0)
+                    variance = numpy.sum(residuals**2, axis=1)/(count - 1)
+                    halfWidth = numSigmaClip*numpy.sqrt(variance)
+                variance = variance/count
+        return value, variance
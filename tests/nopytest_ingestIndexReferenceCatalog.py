@@ -26,6 +26,8 @@
 # Note that it is invoked independently by SCons, so the tests are still run
 # as part of the build.
 
+import glob
+import multiprocessing
 import os.path
 import tempfile
 import unittest
@@ -81,6 +83,47 @@ class TestIngestReferenceCatalogParallel(ingestIndexTestBase.IngestIndexCatalogT
         runTest(withRaDecErr=True)
         runTest(withRaDecErr=False)
 
+    def testIngestPartitioned(self):
+        """Ingest disjoint pixel partitions in separate processes, as on a
+        batch cluster, then merge them.
+        """
+        inPath1 = tempfile.mkdtemp()
+        skyCatalogFile1, _, skyCatalog1 = self.makeSkyCatalog(inPath1, idStart=25, seed=123)
+        inPath2 = tempfile.mkdtemp()
+        skyCatalogFile2, _, skyCatalog2 = self.makeSkyCatalog(inPath2, idStart=5432, seed=11)
+        config = ingestIndexTestBase.makeIngestIndexConfig(withRaDecErr=True, withMagErr=True)
+        config.dataset_config.indexer.active.depth = 2
+        config.file_reader.format = 'ascii.commented_header'
+        config.id_name = 'id'
+        config.n_partitions = 3
+        outpath = os.path.join(self.outPath, "output_partitioned")
+        args = [self.input_dir, "--output", outpath, skyCatalogFile1, skyCatalogFile2]
+
+        # create the output repo before the partitions try to write to it concurrently
+        dafPersist.Butler(inputs=self.input_dir, outputs=outpath)
+        processes = [multiprocessing.Process(target=IngestIndexedReferenceTask.parseAndRun,
+                                             kwargs=dict(args=args + ["--partition", str(partition)],
+                                                         config=config))
+                     for partition in range(config.n_partitions)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        # the catalog is not usable until the partitions are merged
+        butler = dafPersist.Butler(outpath)
+        self.assertFalse(butler.datasetExists("ref_cat_config", name=config.dataset_config.ref_dataset_name))
+        IngestIndexedReferenceTask.parseAndRun(args=args + ["--merge-partitions"], config=config)
+        # the per-partition bookkeeping files are replaced by the merged manifest
+        self.assertEqual(glob.glob(os.path.join(outpath, "**", "partition_*"), recursive=True), [])
+        self.assertEqual(len(glob.glob(os.path.join(outpath, "**", "manifest.json"), recursive=True)), 1)
+
+        butler = dafPersist.Butler(outpath)
+        loader = LoadIndexedReferenceObjectsTask(butler=butler, config=LoadIndexedReferenceObjectsConfig())
+        self.checkAllRowsInRefcat(loader, skyCatalog1, config)
+        self.checkAllRowsInRefcat(loader, skyCatalog2, config)
+
 
 class TestIngestIndexManager(ingestIndexTestBase.IngestIndexCatalogTestBase,
                              lsst.utils.tests.TestCase):
@@ -185,6 +228,24 @@ class TestIngestIndexManager(ingestIndexTestBase.IngestIndexCatalogTestBase,
         self.assertFloatsAlmostEqual(newcat['coord_ra'], newElements['ra_icrs']*np.pi/180)
         self.assertFloatsAlmostEqual(newcat['coord_dec'], newElements['dec_icrs']*np.pi/180)
 
+    def test_compressShard(self):
+        """Test that a compressed shard is smaller and reads back unchanged."""
+        pixelId = 1
+        catalog = self._createFakeCatalog(nOld=100)
+        catalog.writeFits(self.filenames[pixelId])
+        size = os.path.getsize(self.filenames[pixelId])
+
+        IngestIndexManager.compressShard(self.filenames[pixelId], 6)
+        compressedSize = os.path.getsize(self.filenames[pixelId])
+        self.assertLess(compressedSize, size)
+        # compressing twice is a no-op
+        IngestIndexManager.compressShard(self.filenames[pixelId], 6)
+        self.assertEqual(os.path.getsize(self.filenames[pixelId]), compressedSize)
+
+        newcat = lsst.afw.table.SimpleCatalog.readFits(self.filenames[pixelId])
+        np.testing.assert_equal(newcat['id'], catalog['id'])
+        self.assertFloatsEqual(newcat['coord_ra'], catalog['coord_ra'])
+
     def test_getCatalog(self):
         """Test that getCatalog returns a properly expanded new catalog."""
         pixelId = 3
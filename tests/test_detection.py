@@ -20,13 +20,18 @@
 # the GNU General Public License along with this program.  If not,
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
+import tracemalloc
 import unittest
+import unittest.mock
 import numpy as np
 
 import lsst.geom
+import lsst.pex.config
+import lsst.afw.detection as afwDet
 import lsst.afw.table as afwTable
 import lsst.afw.image as afwImage
-from lsst.meas.algorithms import SourceDetectionTask
+import lsst.afw.math as afwMath
+from lsst.meas.algorithms import SourceDetectionTask, SingleGaussianPsf
 from lsst.meas.algorithms.testUtils import plantSources
 import lsst.utils.tests
 
@@ -97,6 +102,444 @@ class DetectionTestCase(lsst.utils.tests.TestCase):
                 counts += dCounts
         return coordList
 
+    def testFftConvolution(self):
+        """Test that convolving with FFTs gives the same image, variance, mask
+        and detections as direct convolution
+        """
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(200, 157))
+        coordList = self.makeCoordList(bbox=bbox, numX=5, numY=4, minCounts=5000, maxCounts=50000,
+                                       sigma=1.5)
+        original = plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList, addPoissonNoise=True)
+        original.mask.array[50:53, 60:62] |= original.mask.getPlaneBitMask("SAT")
+
+        def convolveAndDetect(engine):
+            config = SourceDetectionTask.ConfigClass()
+            config.reEstimateBackground = False
+            config.convolutionEngine = engine
+            task = SourceDetectionTask(config=config)
+            exposure = original.clone()
+            psf = task.getPsf(exposure, sigma=2.2)
+            middle = task.convolveImage(exposure.maskedImage, psf).middle
+            return exposure, middle, task.detectFootprints(exposure, sigma=2.2)
+
+        directExposure, directMiddle, direct = convolveAndDetect("direct")
+        fftExposure, fftMiddle, fft = convolveAndDetect("fft")
+        self.assertEqual(fftMiddle.getBBox(), directMiddle.getBBox())
+        self.assertFloatsAlmostEqual(fftMiddle.image.array, directMiddle.image.array, rtol=1.0e-5)
+        self.assertFloatsAlmostEqual(fftMiddle.variance.array, directMiddle.variance.array, rtol=1.0e-5)
+        np.testing.assert_array_equal(fftMiddle.mask.array, directMiddle.mask.array)
+        np.testing.assert_array_equal(fftExposure.mask.array, directExposure.mask.array)
+        self.assertEqual(fft.numPos, direct.numPos)
+        self.assertEqual(fft.numPosPeaks, direct.numPosPeaks)
+
+        config = SourceDetectionTask.ConfigClass()
+        config.convolutionEngine = "auto"
+        task = SourceDetectionTask(config=config)
+        self.assertEqual(task.chooseConvolutionEngine(bbox, 5), "direct")
+        self.assertEqual(task.chooseConvolutionEngine(bbox, 101), "fft")
+
+    def testBinnedDetection(self):
+        """Test detection on a binned image"""
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(301, 258))
+        coordList = self.makeCoordList(bbox=bbox, numX=4, numY=3, minCounts=50000, maxCounts=500000,
+                                       sigma=4.0)
+        original = plantSources(bbox=bbox, kwid=41, sky=2000, coordList=coordList, addPoissonNoise=True)
+
+        binFactor = 3
+        binned = SourceDetectionTask.binImage(original.maskedImage, binFactor)
+        self.assertEqual(binned.getDimensions(), lsst.geom.Extent2I(100, 86))
+        self.assertFloatsAlmostEqual(binned.image.array[0, 0], original.image.array[:3, :3].mean(),
+                                     rtol=1.0e-6)
+        self.assertFloatsAlmostEqual(binned.variance.array[0, 0],
+                                     original.variance.array[:3, :3].sum()/binFactor**4, rtol=1.0e-6)
+
+        config = SourceDetectionTask.ConfigClass()
+        config.reEstimateBackground = False
+        config.binFactor = binFactor
+        task = SourceDetectionTask(config=config)
+        exposure = original.clone()
+        results = task.detectFootprints(exposure, sigma=4.0)
+        self.assertEqual(results.numPos, len(coordList))
+        detected = exposure.mask.getPlaneBitMask("DETECTED")
+        for fp in results.positive.getFootprints():
+            self.assertTrue(bbox.contains(fp.getBBox()))
+            for peak in fp.getPeaks():
+                self.assertTrue(fp.contains(lsst.geom.Point2I(peak.getIx(), peak.getIy())))
+        for x, y, _, _ in coordList:
+            self.assertTrue(exposure.mask[lsst.geom.Point2I(int(x), int(y)), afwImage.PARENT] & detected)
+        # Pixels beyond the last full bin cannot be detected on
+        edge = exposure.mask.getPlaneBitMask("EDGE")
+        self.assertTrue(np.all(exposure.mask.array[:, -1] & edge))
+
+    def testStripDetection(self):
+        """Test that detecting in strips gives the same footprints and peaks
+        as detecting on the whole image
+        """
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(200, 257))
+        coordList = self.makeCoordList(bbox=bbox, numX=5, numY=6, minCounts=5000, maxCounts=50000,
+                                       sigma=1.5)
+        # Extended sources crossing several strips
+        coordList += [[bbox.getMinX() + 50, bbox.getMinY() + 100, 200000, 8.0],
+                      [bbox.getMinX() + 150, bbox.getMinY() + 60, 200000, 6.0]]
+        original = plantSources(bbox=bbox, kwid=51, sky=2000, coordList=coordList, addPoissonNoise=True)
+
+        def detect(stripHeight, multiplier):
+            config = SourceDetectionTask.ConfigClass()
+            config.reEstimateBackground = False
+            config.doTempLocalBackground = False
+            config.thresholdType = "pixel_stdev"
+            config.thresholdPolarity = "both"
+            config.stripHeight = stripHeight
+            config.includeThresholdMultiplier = multiplier
+            config.validate()
+            task = SourceDetectionTask(config=config)
+            exposure = original.clone()
+            return exposure, task.detectFootprints(exposure, sigma=2.2)
+
+        # With a multiplier, the extended sources have strips whose pixels are all below the
+        # multiplied threshold, which must be kept as parts of the whole footprint
+        for multiplier in (1.0, 5.0):
+            wholeExposure, whole = detect(0, multiplier)
+            for stripHeight in (7, 32, 1000):
+                with self.subTest(stripHeight=stripHeight, multiplier=multiplier):
+                    exposure, strips = detect(stripHeight, multiplier)
+                    self.assertEqual(strips.numPos, whole.numPos)
+                    self.assertEqual(strips.numNeg, whole.numNeg)
+                    np.testing.assert_array_equal(exposure.mask.array, wholeExposure.mask.array)
+                    for polarity in ("positive", "negative"):
+                        for fp1, fp2 in zip(getattr(strips, polarity).getFootprints(),
+                                            getattr(whole, polarity).getFootprints()):
+                            self.assertEqual(fp1.spans, fp2.spans)
+                            self.assertEqual(
+                                sorted((peak.getIx(), peak.getIy()) for peak in fp1.getPeaks()),
+                                sorted((peak.getIx(), peak.getIy()) for peak in fp2.getPeaks()))
+
+        config = SourceDetectionTask.ConfigClass()
+        config.stripHeight = 32
+        with self.assertRaises(lsst.pex.config.FieldValidationError):
+            config.validate()
+
+    def testNoSmoothing(self):
+        """Test that detection without smoothing works on the input pixels
+        without copying or modifying them
+        """
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(128, 127))
+        coordList = self.makeCoordList(bbox=bbox, numX=3, numY=3, minCounts=5000, maxCounts=50000,
+                                       sigma=3.0)
+        original = plantSources(bbox=bbox, kwid=21, sky=2000, coordList=coordList, addPoissonNoise=True)
+        config = SourceDetectionTask.ConfigClass()
+        config.reEstimateBackground = False
+        task = SourceDetectionTask(config=config)
+
+        exposure = original.clone()
+        psf = task.getPsf(exposure, sigma=3.0)
+        middle = task.convolveImage(exposure.maskedImage, psf, doSmooth=False).middle
+        self.assertTrue(np.shares_memory(middle.image.array, exposure.image.array))
+
+        results = task.detectFootprints(exposure, doSmooth=False, sigma=3.0)
+        self.assertEqual(results.numPos, len(coordList))
+        self.assertFloatsEqual(exposure.image.array, original.image.array)
+        self.assertFloatsEqual(exposure.variance.array, original.variance.array)
+        detected = exposure.mask.getPlaneBitMask("DETECTED")
+        np.testing.assert_array_equal(exposure.mask.array & ~detected, original.mask.array)
+
+    def testNoSmoothingLowAmplitude(self):
+        """Test that the temporary local background leaves the input pixels
+        bit-identical when detecting without smoothing, even when the
+        background is large compared to the pixel values
+        """
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(128, 127))
+        coordList = self.makeCoordList(bbox=bbox, numX=3, numY=3, minCounts=5000, maxCounts=50000,
+                                       sigma=3.0)
+        original = plantSources(bbox=bbox, kwid=21, sky=2000, coordList=coordList, addPoissonNoise=True)
+        # Background-subtracted, low-amplitude pixels with a residual ramp
+        yy, xx = np.mgrid[0:bbox.getHeight(), 0:bbox.getWidth()]
+        original.image.array[:] = 1.0e-3*(original.image.array - 2000.0) + 1.0e-2*(xx + yy)
+        original.variance.array *= 1.0e-6
+        config = SourceDetectionTask.ConfigClass()
+        config.reEstimateBackground = False
+        config.doTempLocalBackground = True
+        config.nPeaksMaxSimple = 0
+        for thresholdType in ("pixel_stdev", "stdev"):
+            with self.subTest(thresholdType=thresholdType):
+                config.thresholdType = thresholdType
+                task = SourceDetectionTask(config=config)
+                exposure = original.clone()
+                task.detectFootprints(exposure, doSmooth=False, sigma=3.0)
+                np.testing.assert_array_equal(exposure.image.array, original.image.array)
+                np.testing.assert_array_equal(exposure.variance.array, original.variance.array)
+
+    def testRunMany(self):
+        """Test that detecting on several exposures at once gives the same
+        results as detecting on each in turn
+        """
+        originals = []
+        for ii in range(4):
+            bbox = lsst.geom.Box2I(lsst.geom.Point2I(100*ii, 50), lsst.geom.Extent2I(128, 127))
+            coordList = self.makeCoordList(bbox=bbox, numX=ii + 1, numY=2, minCounts=5000,
+                                           maxCounts=50000, sigma=1.5)
+            originals.append(plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList,
+                                          addPoissonNoise=True))
+        config = SourceDetectionTask.ConfigClass()
+        config.reEstimateBackground = False
+        config.thresholdPolarity = "both"
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        task = SourceDetectionTask(config=config, schema=schema)
+
+        table = afwTable.SourceTable.make(schema)
+        expected = [task.run(table, exposure.clone()) for exposure in originals]
+        table = afwTable.SourceTable.make(schema)
+        exposures = [exposure.clone() for exposure in originals]
+        numSigmas = len(task.metadata.getArray("sigma"))
+        resultsList = task.runMany(table, exposures)
+        self.assertEqual(len(resultsList), len(originals))
+        self.assertEqual(task.metadata.getScalar("runManyNumExposures"), len(originals))
+        # The PSFs are distinct objects with the same sigma
+        self.assertEqual(task.metadata.getScalar("runManyNumPsfs"), 1)
+        # The metadata of each detection is kept
+        self.assertEqual(len(task.metadata.getArray("sigma")), numSigmas + len(originals))
+        previousId = 0
+        for results, expect in zip(resultsList, expected):
+            self.assertEqual(results.numPos, expect.numPos)
+            self.assertTrue(results.metadata.exists("sigma"))
+            self.assertTrue(results.metadata.exists("thresholdTime"))
+            self.assertEqual(results.numNeg, expect.numNeg)
+            self.assertEqual(len(results.sources), len(expect.sources))
+            self.assertGreater(results.sources[0].getId(), previousId)
+            previousId = results.sources[-1].getId()
+
+        # PSFs share a sigma only if they agree to within the tolerance
+        exposures = [exposure.clone() for exposure in originals[:3]]
+        exposures[1].setPsf(SingleGaussianPsf(11, 11, 1.5*(1.0 + 1.0e-5)))
+        exposures[2].setPsf(SingleGaussianPsf(11, 11, 2.0))
+        resultsList = task.runMany(afwTable.SourceTable.make(schema), exposures)
+        self.assertEqual(task.metadata.getScalar("runManyNumPsfs"), 2)
+        sigmas = [results.metadata.getScalar("sigma") for results in resultsList]
+        self.assertEqual(sigmas[0], sigmas[1])
+        self.assertNotEqual(sigmas[0], sigmas[2])
+
+    def testDistanceGrow(self):
+        """Test that growing footprints with a distance transform sets the
+        same mask as growing with afw
+        """
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(200, 157))
+        coordList = self.makeCoordList(bbox=bbox, numX=8, numY=6, minCounts=5000, maxCounts=50000,
+                                       sigma=1.5)
+        original = plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList, addPoissonNoise=True)
+
+        def detect(growEngine, combinedGrow, isotropicGrow):
+            config = SourceDetectionTask.ConfigClass()
+            config.reEstimateBackground = False
+            config.nSigmaToGrow = 4.0
+            config.growEngine = growEngine
+            config.combinedGrow = combinedGrow
+            config.isotropicGrow = isotropicGrow
+            task = SourceDetectionTask(config=config)
+            exposure = original.clone()
+            return exposure, task.detectFootprints(exposure, sigma=2.2)
+
+        for combinedGrow in (True, False):
+            for isotropicGrow in (True, False):
+                with self.subTest(combinedGrow=combinedGrow, isotropicGrow=isotropicGrow):
+                    afwExposure, afwResults = detect("afw", combinedGrow, isotropicGrow)
+                    exposure, results = detect("distance", combinedGrow, isotropicGrow)
+                    np.testing.assert_array_equal(exposure.mask.array, afwExposure.mask.array)
+                    self.assertEqual(results.numPos, afwResults.numPos)
+                    self.assertEqual(results.numPosPeaks, afwResults.numPosPeaks)
+                    if not combinedGrow:
+                        # Footprints don't overlap
+                        area = sum(fp.getArea() for fp in results.positive.getFootprints())
+                        detected = exposure.mask.getPlaneBitMask("DETECTED")
+                        self.assertEqual(area, np.sum(exposure.mask.array & detected != 0))
+
+    def testThresholdHierarchy(self):
+        """Test that the single-pass threshold hierarchy matches detecting at
+        each threshold separately, and is nested
+        """
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(200, 157))
+        coordList = self.makeCoordList(bbox=bbox, numX=5, numY=4, minCounts=5000, maxCounts=50000,
+                                       sigma=1.5)
+        # Blended pairs, which separate at the higher thresholds
+        coordList += [[bbox.getMinX() + 20, bbox.getMinY() + 60, 20000, 1.5],
+                      [bbox.getMinX() + 26, bbox.getMinY() + 62, 30000, 1.5]]
+        exposure = plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList, addPoissonNoise=True)
+
+        factors = [4.0, 0.6, 1.0]
+        # A multiplier other than 1 only keeps footprints whose peak reaches
+        # that multiple of the threshold, as for afw's FootprintSet
+        for multiplier in (1.0, 3.0):
+            with self.subTest(multiplier=multiplier):
+                config = SourceDetectionTask.ConfigClass()
+                config.reEstimateBackground = False
+                config.doTempLocalBackground = False
+                config.thresholdType = "pixel_stdev"
+                config.thresholdPolarity = "both"
+                config.minPixels = 3
+                config.includeThresholdMultiplier = multiplier
+                config.thresholdHierarchyFactors = factors
+                config.validate()
+                task = SourceDetectionTask(config=config)
+                results = task.detectFootprints(exposure, sigma=2.2)
+                self.assertEqual([level.factor for level in results.hierarchy], sorted(factors))
+
+                middle = task.convolveImage(exposure.maskedImage, task.getPsf(exposure, sigma=2.2)).middle
+                numFootprints = []
+                for ii, level in enumerate(results.hierarchy):
+                    expected = task.applyThreshold(middle, exposure.getBBox(), level.factor)
+                    for polarity in ("positive", "negative"):
+                        footprints = list(getattr(level, polarity).getFootprints())
+                        expectedFootprints = list(getattr(expected, polarity).getFootprints())
+                        self.assertEqual(len(footprints), len(expectedFootprints))
+                        for fp1, fp2 in zip(footprints, expectedFootprints):
+                            self.assertEqual(fp1.spans, fp2.spans)
+                            self.assertEqual(sorted((peak.getIx(), peak.getIy()) for peak in fp1.getPeaks()),
+                                             sorted((peak.getIx(), peak.getIy()) for peak in fp2.getPeaks()))
+                        parents = getattr(level, polarity + "Parents")
+                        self.assertEqual(len(parents), len(footprints))
+                        if ii == 0:
+                            self.assertTrue(np.all(parents == -1))
+                            continue
+                        previous = list(getattr(results.hierarchy[ii - 1], polarity).getFootprints())
+                        for fp, parent in zip(footprints, parents):
+                            self.assertTrue(previous[parent].spans.contains(fp.spans))
+                    numFootprints.append(len(level.positive.getFootprints()))
+                self.assertGreater(numFootprints[-1], 0)
+
+        config = SourceDetectionTask.ConfigClass()
+        config.thresholdHierarchyFactors = [1.0, 2.0]
+        config.binFactor = 2
+        with self.assertRaises(lsst.pex.config.FieldValidationError):
+            config.validate()
+
+    def testUpdatePeaks(self):
+        """Test that updating the peaks of blended footprints keeps simple
+        footprints, replaces peaks by those detected within each footprint,
+        and falls back to the brightest peak
+        """
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(200, 157))
+        coordList = self.makeCoordList(bbox=bbox, numX=4, numY=3, minCounts=5000, maxCounts=50000,
+                                       sigma=1.5)
+        # A bright and a faint blend
+        coordList += [[bbox.getMinX() + 20, bbox.getMinY() + 80, 40000, 1.5],
+                      [bbox.getMinX() + 25, bbox.getMinY() + 82, 60000, 1.5],
+                      [bbox.getMinX() + 170, bbox.getMinY() + 80, 2500, 1.5],
+                      [bbox.getMinX() + 175, bbox.getMinY() + 81, 2500, 1.5]]
+        exposure = plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList, addPoissonNoise=True)
+
+        config = SourceDetectionTask.ConfigClass()
+        config.reEstimateBackground = False
+        config.doTempLocalBackground = False
+        config.thresholdType = "pixel_stdev"
+        config.thresholdValue = 3.0
+        task = SourceDetectionTask(config=config)
+        middle = task.convolveImage(exposure.maskedImage, task.getPsf(exposure, sigma=2.2)).middle
+        fpSet = task.applyThreshold(middle, exposure.getBBox()).positive
+        before = [[(peak.getIx(), peak.getIy(), peak.getPeakValue()) for peak in fp.getPeaks()]
+                  for fp in fpSet.getFootprints()]
+        self.assertTrue(any(len(peaks) > 1 for peaks in before))
+
+        threshold = afwDet.createThreshold(30.0, "pixel_stdev")
+        task.updatePeaks(fpSet, middle, threshold)
+        for fp, oldPeaks in zip(fpSet.getFootprints(), before):
+            peaks = [(peak.getIx(), peak.getIy(), peak.getPeakValue()) for peak in fp.getPeaks()]
+            if len(oldPeaks) <= config.nPeaksMaxSimple:
+                self.assertEqual(peaks, oldPeaks)
+                continue
+            # Peaks are detected within the bounding box of each footprint, with minPixels applied
+            # there, so pixels outside the box can neither suppress nor join them
+            sub = middle.Factory(middle, fp.getBBox(), afwImage.PARENT, False)
+            expected = afwDet.FootprintSet(sub, threshold, "", config.minPixels)
+            found = [(peak.getIx(), peak.getIy()) for expectedFp in expected.getFootprints()
+                     for peak in expectedFp.getPeaks() if fp.contains(peak.getI())]
+            if found:
+                self.assertEqual(sorted(peak[:2] for peak in peaks), sorted(found))
+            else:
+                self.assertEqual(peaks, oldPeaks[:1])
+
+    def testProfileStages(self):
+        """Test that the time and memory of each stage are recorded"""
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(128, 127))
+        coordList = self.makeCoordList(bbox=bbox, numX=3, numY=3, minCounts=5000, maxCounts=50000,
+                                       sigma=1.5)
+        exposure = plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList, addPoissonNoise=True)
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        config = SourceDetectionTask.ConfigClass()
+        config.doProfileMemory = True
+        task = SourceDetectionTask(config=config, schema=schema)
+        task.run(afwTable.SourceTable.make(schema), exposure, sigma=2.2)
+        for stage in ("convolve", "threshold", "tempLocalBackground", "grow", "reEstimateBackground",
+                      "makeSources"):
+            self.assertGreaterEqual(min(task.metadata.getArray(stage + "Time")), 0.0)
+            self.assertGreaterEqual(min(task.metadata.getArray(stage + "PeakMemory")), 0)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def testRedetect(self):
+        """Test that redetecting in changed regions gives the same results
+        as detecting on the whole changed image
+        """
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(200, 157))
+        coordList = self.makeCoordList(bbox=bbox, numX=5, numY=4, minCounts=5000, maxCounts=50000,
+                                       sigma=1.5)
+        original = plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList, addPoissonNoise=True)
+
+        config = SourceDetectionTask.ConfigClass()
+        config.reEstimateBackground = False
+        config.doTempLocalBackground = False
+        config.thresholdType = "pixel_stdev"
+        config.thresholdPolarity = "both"
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        task = SourceDetectionTask(config=config, schema=schema)
+        table = afwTable.SourceTable.make(schema)
+
+        def addSource(exposure, x, y, flux):
+            """Add a Gaussian source, returning the changed box"""
+            box = lsst.geom.Box2I(lsst.geom.Point2I(int(x) - 8, int(y) - 8), lsst.geom.Extent2I(17, 17))
+            box.clip(bbox)
+            yy, xx = np.mgrid[box.getMinY():box.getMaxY() + 1, box.getMinX():box.getMaxX() + 1]
+            image = exposure.image[box, afwImage.PARENT]
+            image.array += flux*np.exp(-0.5*((xx - x)**2 + (yy - y)**2)/2.0**2)
+            return box
+
+        exposure = original.clone()
+        previous = task.run(table, exposure, sigma=2.2)
+        expected = original.clone()
+        dirtyBBoxes = []
+        # An isolated source, one next to an existing source, and a negative one
+        for x, y, flux in ((bbox.getMinX() + 40, bbox.getMinY() + 40, 20000),
+                           (coordList[7][0] + 6, coordList[7][1], 20000),
+                           (bbox.getMinX() + 140, bbox.getMinY() + 120, -20000)):
+            dirtyBBoxes.append(addSource(exposure, x, y, flux))
+            addSource(expected, x, y, flux)
+        whole = task.detectFootprints(expected, sigma=2.2)
+
+        results = task.redetect(exposure, previous, dirtyBBoxes, sigma=2.2)
+        np.testing.assert_array_equal(exposure.mask.array, expected.mask.array)
+        self.assertEqual(results.numPos, whole.numPos)
+        self.assertEqual(results.numNeg, whole.numNeg)
+        self.assertEqual(results.numPosPeaks, whole.numPosPeaks)
+        self.assertEqual(results.numNegPeaks, whole.numNegPeaks)
+        self.assertEqual(len(results.redetectedBBoxes), len(dirtyBBoxes))
+        self.assertLess(sum(box.getArea() for box in results.redetectedBBoxes), bbox.getArea())
+        for polarity in ("positive", "negative"):
+            def describe(fpSet):
+                return sorted((fp.getBBox().getMinX(), fp.getBBox().getMinY(), fp.getArea(),
+                               sorted((peak.getIx(), peak.getIy()) for peak in fp.getPeaks()))
+                              for fp in fpSet.getFootprints())
+            self.assertEqual(describe(getattr(results, polarity)), describe(getattr(whole, polarity)))
+
+        # Unaffected sources keep their records; new ones are flagged as before
+        self.assertEqual(len(results.sources), results.numPos + results.numNeg)
+        self.assertTrue(set(record.getId() for record in previous.sources)
+                        & set(record.getId() for record in results.sources))
+        self.assertEqual([record.get("flags_negative") for record in results.sources],
+                         [True]*results.numNeg + [False]*results.numPos)
+
+        config = SourceDetectionTask.ConfigClass()
+        config.thresholdType = "stdev"
+        task = SourceDetectionTask(config=config, schema=afwTable.SourceTable.makeMinimalSchema())
+        with self.assertRaises(RuntimeError):
+            task.redetect(exposure, results, dirtyBBoxes, sigma=2.2)
+
     def testTempBackgrounds(self):
         """Test that the temporary backgrounds we remove are properly restored"""
         bbox = lsst.geom.Box2I(lsst.geom.Point2I(12345, 67890), lsst.geom.Extent2I(128, 127))
@@ -127,6 +570,110 @@ class DetectionTestCase(lsst.utils.tests.TestCase):
         checkExposure(original, False, True)
         checkExposure(original, True, True)
 
+    def testWideBackgroundCache(self):
+        """Test that the temporary wide background is reused until the image
+        is modified, with the same results as fitting it again
+        """
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(300, 257))
+        coordList = self.makeCoordList(bbox=bbox, numX=4, numY=4, minCounts=5000, maxCounts=50000,
+                                       sigma=1.5)
+        original = plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList, addPoissonNoise=True)
+        config = SourceDetectionTask.ConfigClass()
+        config.reEstimateBackground = False
+        config.doTempWideBackground = True
+        config.tempWideBackground.binSize = 64
+        expectedExposure = original.clone()
+        uncachedTask = SourceDetectionTask(config=config)
+        for _ in range(3):
+            expected = uncachedTask.detectFootprints(expectedExposure, sigma=2.2)
+
+        config.doCacheTempWideBackground = True
+        task = SourceDetectionTask(config=config)
+        exposure = original.clone()
+        # The first pass sets the EDGE plane, which is ignored by the wide background
+        for _ in range(2):
+            task.detectFootprints(exposure, sigma=2.2)
+        numStats = len(exposure.getMetadata().getArray("BGMEAN"))
+        fitBackground = task.tempWideBackground.fitBackground
+        with unittest.mock.patch.object(task.tempWideBackground, "fitBackground",
+                                        wraps=fitBackground) as mockFit:
+            results = task.detectFootprints(exposure, sigma=2.2)
+            self.assertEqual(mockFit.call_count, 0)
+            self.assertEqual(len(exposure.getMetadata().getArray("BGMEAN")), numStats + 1)
+            self.assertFloatsEqual(exposure.image.array, original.image.array)
+            np.testing.assert_array_equal(exposure.mask.array, expectedExposure.mask.array)
+            self.assertEqual(results.numPos, expected.numPos)
+            self.assertEqual(results.numPosPeaks, expected.numPosPeaks)
+
+            task.markImageModified(exposure.maskedImage)
+            task.detectFootprints(exposure, sigma=2.2)
+            self.assertEqual(mockFit.call_count, 1)
+
+    def testConvolveCache(self):
+        """Test reuse of the convolved image until the image is modified"""
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(128, 127))
+        coordList = self.makeCoordList(bbox=bbox, numX=3, numY=3, minCounts=5000, maxCounts=50000,
+                                       sigma=1.5)
+        exposure = plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList, addPoissonNoise=True)
+        config = SourceDetectionTask.ConfigClass()
+        config.reEstimateBackground = False
+        task = SourceDetectionTask(config=config)
+        psf = task.getPsf(exposure, sigma=2.2)
+        maskedImage = exposure.maskedImage
+
+        with task.convolveCacheContext():
+            first = task.convolveImage(maskedImage, psf).middle
+            self.assertIs(task.convolveImage(maskedImage, psf).middle, first)
+
+            maskedImage.image.array[10:20, 10:20] *= 2.0
+            task.markImageModified(maskedImage)
+            modified = task.convolveImage(maskedImage, psf).middle
+            self.assertIsNot(modified, first)
+
+        # Outside of the context nothing is cached
+        self.assertIsNone(task._convolveCache)
+        expected = task.convolveImage(maskedImage, psf).middle
+        self.assertIsNot(task.convolveImage(maskedImage, psf).middle, expected)
+        self.assertFloatsAlmostEqual(modified.image.array, expected.image.array, rtol=1.0e-6)
+
+    def testIncrementalBackground(self):
+        """Test that re-estimating the background of the same image only
+        measures the bins whose good pixels changed
+        """
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(256, 100), lsst.geom.Extent2I(300, 257))
+        coordList = self.makeCoordList(bbox=bbox, numX=4, numY=4, minCounts=5000, maxCounts=50000,
+                                       sigma=1.5)
+        exposure = plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList, addPoissonNoise=True)
+        config = SourceDetectionTask.ConfigClass()
+        config.background.binSize = 32
+        config.background.statisticsEngine = "numpy"
+        config.doIncrementalBackground = True
+        task = SourceDetectionTask(config=config)
+        first = task.detectFootprints(exposure, sigma=2.2)
+        numBins = task.metadata.getArray("numMeasuredBackgroundBins")[-1]
+        self.assertEqual(numBins, first.background[0][0].getStatsImage().getBBox().getArea())
+
+        # The model subtracted varies within the bins, so they must all be measured again
+        task.reEstimateBackground(exposure.maskedImage, afwMath.BackgroundList())
+        self.assertEqual(task.metadata.getArray("numMeasuredBackgroundBins")[-1], numBins)
+
+        # A model that is constant over the bins is tracked exactly
+        exposure = plantSources(bbox=bbox, kwid=11, sky=2000, coordList=coordList, addPoissonNoise=True)
+        config.background.binSize = 512
+        config.background.useApprox = False
+        task = SourceDetectionTask(config=config)
+        task.detectFootprints(exposure, sigma=2.2)
+        self.assertEqual(task.metadata.getArray("numMeasuredBackgroundBins")[-1], 1)
+        bg = task.reEstimateBackground(exposure.maskedImage, afwMath.BackgroundList())
+        self.assertEqual(task.metadata.getArray("numMeasuredBackgroundBins")[-1], 0)
+        # The background has already been subtracted
+        self.assertLess(np.abs(bg.getImageF().array).max(), 1.0)
+
+        config = SourceDetectionTask.ConfigClass()
+        config.doIncrementalBackground = True
+        with self.assertRaises(lsst.pex.config.FieldValidationError):
+            config.validate()
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -6,6 +6,7 @@ import lsst.utils.tests
 from lsst.geom import Box2I, Point2I, Point2D, Extent2I, SpherePoint, degrees
 from lsst.afw.geom import makeCdMatrix, makeSkyWcs
 from lsst.afw.image import PARENT
+from lsst.afw.math import BackgroundList
 from lsst.afw.table import SourceTable
 from lsst.meas.algorithms import DynamicDetectionTask
 from lsst.meas.algorithms.testUtils import plantSources
@@ -80,6 +81,36 @@ class DynamicDetectionTest(lsst.utils.tests.TestCase):
         self.exposure.maskedImage.variance /= factor
         self.check(1.0/np.sqrt(factor))
 
+    def testFastSkyPhotometry(self):
+        """Vectorized sky photometry should give the same thresholds as the
+        measurement plugins
+        """
+        schema = SourceTable.makeMinimalSchema()
+        thresholds = []
+        for doFast in (False, True):
+            self.config.doFastSkyPhotometry = doFast
+            task = DynamicDetectionTask(config=self.config, schema=schema)
+            thresholds.append(task.calculateThreshold(self.exposure, 12345, sigma=3.21))
+        self.assertFloatsAlmostEqual(thresholds[1].multiplicative, thresholds[0].multiplicative, rtol=0.05)
+        self.assertFloatsAlmostEqual(thresholds[1].additive, thresholds[0].additive, rtol=0.05, atol=1.0)
+
+    def testIncrementalBackground(self):
+        """The tweak of the background is tracked in the kept statistics of
+        the background bins, when the re-estimated model is constant over
+        the bins
+        """
+        self.config.reEstimateBackground = True
+        self.config.doIncrementalBackground = True
+        self.config.background.statisticsEngine = "numpy"
+        self.config.background.binSize = 4096
+        self.config.background.useApprox = False
+        schema = SourceTable.makeMinimalSchema()
+        task = DynamicDetectionTask(config=self.config, schema=schema)
+        task.detectFootprints(self.exposure, sigma=2.0, expId=12345)
+        self.assertEqual(task.metadata.getArray("numMeasuredBackgroundBins")[-1], 1)
+        task.reEstimateBackground(self.exposure.maskedImage, BackgroundList())
+        self.assertEqual(task.metadata.getArray("numMeasuredBackgroundBins")[-1], 0)
+
     def testNoSources(self):
         self.config.skyObjects.nSources = self.config.minNumSources - 1
         self.check(1.0)
@@ -0,0 +1,109 @@
+# This file is part of meas_algorithms.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy as np
+
+import lsst.geom
+import lsst.afw.cameraGeom as cameraGeom
+from lsst.afw.cameraGeom.testUtils import DetectorWrapper
+import lsst.afw.image as afwImage
+import lsst.afw.math as afwMath
+from lsst.meas.algorithms import FocalPlaneBackgroundTask
+import lsst.utils.tests
+
+
+def focalPlaneSky(x, y):
+    """Smooth background over the focal plane (coordinates in mm)"""
+    return 1000.0 + 2.0*x - 0.5*y + 0.05*x*y
+
+
+class FocalPlaneBackgroundTestCase(lsst.utils.tests.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(12345)
+        size = 200
+        self.exposures = []
+        # A row of detectors 4 mm (200 pixels of 0.02 mm) wide, with gaps of 0.5 mm
+        for i in range(3):
+            detector = DetectorWrapper(
+                name=f"detector {i}", id=i,
+                bbox=lsst.geom.Box2I(lsst.geom.Point2I(0, 0), lsst.geom.Extent2I(size, size)),
+                orientation=cameraGeom.Orientation(lsst.geom.Point2D(4.5*i - 6.0, -2.0),
+                                                   lsst.geom.Point2D(-0.5, -0.5)),
+                radialDistortion=0.0,
+            ).detector
+            transform = detector.getTransform(cameraGeom.PIXELS, cameraGeom.FOCAL_PLANE)
+            yy, xx = np.mgrid[0:size, 0:size]
+            points = transform.applyForward([lsst.geom.Point2D(x, y) for x, y in zip(xx.flat, yy.flat)])
+            sky = focalPlaneSky(np.array([p.getX() for p in points]),
+                                np.array([p.getY() for p in points])).reshape(size, size)
+            exposure = afwImage.ExposureF(size, size)
+            exposure.image.array[:] = rng.normal(sky, 10.0)
+            exposure.variance.array[:] = 100.0
+            exposure.setDetector(detector)
+            self.exposures.append(exposure)
+
+    def makeConfig(self):
+        config = FocalPlaneBackgroundTask.ConfigClass()
+        config.background.binSize = 50
+        config.order = 2
+        return config
+
+    def testFit(self):
+        """The joint model must recover the focal-plane background, and be
+        subtracted from every detector
+        """
+        config = self.makeConfig()
+        task = FocalPlaneBackgroundTask(config=config)
+        originals = [exposure.image.array.copy() for exposure in self.exposures]
+        result = task.run(self.exposures)
+
+        self.assertEqual(len(result.backgrounds), len(self.exposures))
+        self.assertEqual(result.model.numBins, 3*5*5)
+        for bins in result.bins:
+            self.assertFloatsAlmostEqual(task.evaluateModel(result.model, bins.x, bins.y),
+                                         focalPlaneSky(bins.x, bins.y), atol=0.5)
+        for exposure, original, background in zip(self.exposures, originals, result.backgrounds):
+            self.assertIsInstance(background, afwMath.BackgroundList)
+            self.assertEqual(len(background), 1)
+            self.assertFloatsAlmostEqual(background.getImage().array, original - exposure.image.array,
+                                         atol=1.0e-3)
+            self.assertLess(np.abs(np.mean(exposure.image.array)), 1.0)
+
+    def testNoDetector(self):
+        self.exposures[0].setDetector(None)
+        task = FocalPlaneBackgroundTask(config=self.makeConfig())
+        with self.assertRaises(RuntimeError):
+            task.run(self.exposures)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,96 @@
+# This file is part of meas_algorithms.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy as np
+
+import lsst.geom
+from lsst.meas.algorithms import IndexerRegistry
+import lsst.utils.tests
+
+try:
+    import healpy
+except ImportError:
+    healpy = None
+
+
+@unittest.skipIf(healpy is None, "healpy is not available")
+class HealpixIndexerTestCase(lsst.utils.tests.TestCase):
+    def setUp(self):
+        config = IndexerRegistry['HEALPix'].ConfigClass()
+        config.depth = 5
+        self.indexer = IndexerRegistry['HEALPix'](config)
+        rng = np.random.RandomState(12345)
+        size = 20000
+        self.ras = rng.uniform(0, 360, size)
+        self.decs = np.degrees(np.arcsin(rng.uniform(-1, 1, size)))
+
+    def testPixelRange(self):
+        self.assertEqual(self.indexer.getPixelRange(), (0, 12*4**5))
+        pixelIds = self.indexer.indexPoints(self.ras, self.decs)
+        self.assertTrue(np.all(pixelIds >= 0))
+        self.assertTrue(np.all(pixelIds < 12*4**5))
+
+    def testGetShardIds(self):
+        """Every point in the circle must be in a returned shard, and no
+        point outside of it may be in an interior shard.
+        """
+        for ra, dec, radius in [(10, 20, 3), (0, 90, 10), (200, -45, 0.5), (33, 2, 40)]:
+            with self.subTest(ra=ra, dec=dec, radius=radius):
+                center = lsst.geom.SpherePoint(ra, dec, lsst.geom.degrees)
+                shardIds, isOnBoundary = self.indexer.getShardIds(center, radius*lsst.geom.degrees)
+                self.assertEqual(len(set(shardIds)), len(shardIds))
+
+                separation = np.array([center.separation(lsst.geom.SpherePoint(r, d, lsst.geom.degrees))
+                                       .asDegrees() for r, d in zip(self.ras, self.decs)])
+                pixelIds = self.indexer.indexPoints(self.ras, self.decs)
+                self.assertTrue(set(pixelIds[separation < radius]).issubset(shardIds))
+                self.assertFalse(set(pixelIds[separation > radius]) & set(shardIds[~isOnBoundary]))
+
+    def testShardRangesMerged(self):
+        center = lsst.geom.SpherePoint(33, 2, lsst.geom.degrees)
+        ranges, boundaryIds = self.indexer.getShardRanges(center, 40*lsst.geom.degrees)
+        self.assertGreater(len(ranges), 0)
+        self.assertTrue(np.all(ranges[:, 0] < ranges[:, 1]))
+        # sorted, disjoint and not contiguous (contiguous ranges are merged)
+        self.assertTrue(np.all(ranges[1:, 0] > ranges[:-1, 1]))
+        for begin, end in ranges:
+            self.assertFalse(np.any((boundaryIds >= begin) & (boundaryIds < end)))
+
+        # getShardIds expands the ranges
+        shardIds, isOnBoundary = self.indexer.getShardIds(center, 40*lsst.geom.degrees)
+        np.testing.assert_array_equal(shardIds[isOnBoundary], boundaryIds)
+        np.testing.assert_array_equal(shardIds[~isOnBoundary],
+                                      np.concatenate([np.arange(begin, end) for begin, end in ranges]))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
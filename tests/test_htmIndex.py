@@ -21,7 +21,9 @@
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
 
+import json
 import os
+import tempfile
 import unittest
 from collections import Counter
 
@@ -35,6 +37,7 @@ import lsst.afw.geom as afwGeom
 import lsst.daf.persistence as dafPersist
 from lsst.meas.algorithms import (IngestIndexedReferenceTask, LoadIndexedReferenceObjectsTask,
                                   LoadIndexedReferenceObjectsConfig, getRefFluxField)
+from lsst.meas.algorithms.htmIndexer import HtmIndexer
 from lsst.meas.algorithms.loadReferenceObjects import hasNanojanskyFluxUnits
 import lsst.utils
 
@@ -132,6 +135,58 @@ class IngestIndexTaskValidateTestCase(lsst.utils.tests.TestCase):
                 with self.assertRaises(ValueError, msg=name):
                     config.validate()
 
+    def testValidatePartitions(self):
+        """Partitioned ingest needs ids that do not depend on a shared counter.
+        """
+        config = makeIngestIndexConfig()
+        config.n_partitions = 4
+        with self.assertRaises(ValueError):
+            config.validate()
+        config.id_name = "id"
+        config.validate()
+
+
+class HtmIndexerTestCase(lsst.utils.tests.TestCase):
+    """Test shard classification of HtmIndexer."""
+    def setUp(self):
+        self.indexer = HtmIndexer(depth=7)
+        self.circles = [(make_coord(10, 20), 3*lsst.geom.degrees),
+                        (make_coord(0, 90), 10*lsst.geom.degrees),
+                        (make_coord(200, -45), 0.5*lsst.geom.degrees),
+                        (make_coord(33, 2), 40*lsst.geom.degrees),
+                        (make_coord(5, 5), 100*lsst.geom.degrees)]
+
+    def testGetShardIds(self):
+        """Boundary shards should match esutil's exclusive intersection."""
+        for center, radius in self.circles:
+            with self.subTest(center=center, radius=radius):
+                shardIds, isOnBoundary = self.indexer.getShardIds(center, radius)
+                coveredIds = self.indexer.htm.intersect(center.getLongitude().asDegrees(),
+                                                        center.getLatitude().asDegrees(),
+                                                        radius.asDegrees(), inclusive=False)
+                self.assertEqual(set(shardIds[~isOnBoundary]), set(coveredIds))
+
+    def testGetShardIdsBatch(self):
+        indexer = HtmIndexer(depth=7, cacheSize=0)
+        results = indexer.getShardIdsBatch([center for center, _ in self.circles],
+                                           [radius for _, radius in self.circles])
+        self.assertEqual(len(results), len(self.circles))
+        for (center, radius), (shardIds, isOnBoundary) in zip(self.circles, results):
+            expectIds, expectOnBoundary = self.indexer.getShardIds(center, radius)
+            np.testing.assert_array_equal(shardIds, expectIds)
+            np.testing.assert_array_equal(isOnBoundary, expectOnBoundary)
+
+    def testCache(self):
+        center, radius = self.circles[0]
+        first = self.indexer.getShardIds(center, radius)
+        self.assertIs(self.indexer.getShardIds(center, radius), first)
+        self.assertFalse(first[0].flags.writeable)
+
+        indexer = HtmIndexer(depth=7, cacheSize=2)
+        for center, radius in self.circles:
+            indexer.getShardIds(center, radius)
+        self.assertEqual(len(indexer._cache), 2)
+
 
 class IngestIndexReferenceTaskTestCase(IngestIndexCatalogTestBase, lsst.utils.tests.TestCase):
     """Tests of ingesting and validating an HTM Indexed Reference Catalog.
@@ -187,6 +242,44 @@ class IngestIndexReferenceTaskTestCase(IngestIndexCatalogTestBase, lsst.utils.te
         runTest(withRaDecErr=True)
         runTest(withRaDecErr=False)
 
+    def testIngestIncremental(self):
+        """Test adding a second catalog to an existing refcat."""
+        outputPath = os.path.join(self.outPath, "output_incremental")
+        inPath = tempfile.mkdtemp()
+        skyCatalogFile2, _, skyCatalog2 = self.makeSkyCatalog(inPath, size=100, idStart=5432, seed=11)
+        config = makeIngestIndexConfig(withRaDecErr=True, withMagErr=True)
+        config.dataset_config.indexer.active.depth = self.depth
+        config.file_reader.format = 'ascii.commented_header'
+        config.id_name = 'id'
+        IngestIndexedReferenceTask.parseAndRun(
+            args=[self.input_dir, "--output", outputPath, self.skyCatalogFile], config=config)
+        IngestIndexedReferenceTask.parseAndRun(args=[outputPath, skyCatalogFile2, "--incremental"],
+                                               config=config)
+
+        butler = dafPersist.Butler(outputPath)
+        loader = LoadIndexedReferenceObjectsTask(butler=butler)
+        self.checkAllRowsInRefcat(loader, self.skyCatalog, config)
+        self.checkAllRowsInRefcat(loader, skyCatalog2, config)
+        self.assertEqual(len(loader.dataset_config.increments), 1)
+        increment = json.loads(loader.dataset_config.increments[0])
+        self.assertEqual(increment["files"], [skyCatalogFile2])
+        self.assertEqual(increment["n_records"], len(skyCatalog2))
+
+        self.assertEqual(list(loader.dataset_config.input_files), [self.skyCatalogFile])
+
+        # the same file cannot be added twice, whether it was in the initial ingest or an increment
+        for skyCatalogFile in (self.skyCatalogFile, skyCatalogFile2):
+            with self.assertRaises(RuntimeError):
+                IngestIndexedReferenceTask.parseAndRun(args=[outputPath, skyCatalogFile, "--incremental"],
+                                                       config=config)
+
+        # an increment must produce the same schema as the existing refcat
+        skyCatalogFile3, _, _ = self.makeSkyCatalog(tempfile.mkdtemp(), size=10, idStart=9876)
+        config.extra_col_names = ['val1']
+        with self.assertRaises(RuntimeError):
+            IngestIndexedReferenceTask.parseAndRun(args=[outputPath, skyCatalogFile3, "--incremental"],
+                                                   config=config)
+
     def testIngestConfigOverrides(self):
         """Test IngestIndexedReferenceTask with different configs.
         """
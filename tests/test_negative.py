@@ -83,6 +83,9 @@ class NegativeMeasurementTestCase(lsst.utils.tests.TestCase):
         self.assertEqual(len(sources), numX*numY)
         self.assertEqual(fpSets.numPos, numX*numY/2)
         self.assertEqual(fpSets.numNeg, numX*numY/2)
+        self.assertEqual([source.get("flags_negative") for source in sources],
+                         [True]*fpSets.numNeg + [False]*fpSets.numPos)
+        self.assertTrue(sources.isContiguous())
 
         measurement.run(sources, exposure)
 
@@ -0,0 +1,90 @@
+# This file is part of meas_algorithms.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy as np
+
+import lsst.geom
+import lsst.afw.geom
+import lsst.afw.image
+import lsst.utils.tests
+from lsst.meas.algorithms import SkyObjectsTask
+
+
+class SkyObjectsTestCase(lsst.utils.tests.TestCase):
+    def setUp(self):
+        bbox = lsst.geom.Box2I(lsst.geom.Point2I(123, 456), lsst.geom.Extent2I(301, 257))
+        self.mask = lsst.afw.image.Mask(bbox)
+        self.mask.set(0)
+        # Crowded field: most of the image is covered by detections
+        rng = np.random.RandomState(12345)
+        detected = self.mask.getPlaneBitMask("DETECTED")
+        for x, y in zip(rng.randint(0, bbox.getWidth(), 400), rng.randint(0, bbox.getHeight(), 400)):
+            self.mask.array[max(y - 8, 0):y + 8, max(x - 8, 0):x + 8] |= detected
+        self.avoid = lsst.afw.geom.SpanSet.fromMask(self.mask, detected)
+
+    def makeTask(self, algorithm):
+        config = SkyObjectsTask.ConfigClass()
+        config.algorithm = algorithm
+        config.nSources = 50
+        config.growMask = 1
+        return SkyObjectsTask(config=config)
+
+    def testErode(self):
+        """Test that eroding the allowed region finds all the requested sky
+        objects, none of which overlap the avoided pixels
+        """
+        task = self.makeTask("erode")
+        skyFootprints = task.run(self.mask, 123)
+        self.assertEqual(len(skyFootprints), task.config.nSources)
+        avoid = self.avoid.dilated(task.config.growMask)
+        for fp in skyFootprints:
+            self.assertFalse(fp.spans.overlaps(avoid))
+            self.assertTrue(self.mask.getBBox().contains(fp.getBBox()))
+            peak = fp.getPeaks()[0]
+            self.assertEqual(fp.getCentroid(), lsst.geom.Point2D(peak.getIx(), peak.getIy()))
+
+        # Reproducible for the same seed, but not for another
+        centers = [fp.getCentroid() for fp in skyFootprints]
+        self.assertEqual([fp.getCentroid() for fp in task.run(self.mask, 123)], centers)
+        self.assertNotEqual([fp.getCentroid() for fp in task.run(self.mask, 321)], centers)
+
+        # Trial and error finds fewer in the same number of tries
+        self.assertLess(len(self.makeTask("trial").run(self.mask, 123)), len(skyFootprints))
+
+    def testNowhere(self):
+        """Test that no sky objects are returned if there is no room"""
+        self.mask.array[:] = self.mask.getPlaneBitMask("BAD")
+        self.assertEqual(self.makeTask("erode").run(self.mask, 123), [])
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,198 @@
+# This file is part of meas_algorithms.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+import lsst.afw.math as afwMath
+import lsst.pipe.base as pipeBase
+from lsst.meas.algorithms import SubtractBackgroundTask
+import lsst.utils.tests
+
+
+class SubtractBackgroundTestCase(lsst.utils.tests.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(12345)
+        width, height = 301, 257
+        yy, xx = np.mgrid[0:height, 0:width]
+        self.sky = 100.0 + 0.1*xx - 0.05*yy
+        self.exposure = afwImage.ExposureF(width, height)
+        self.exposure.image.array[:] = rng.normal(self.sky, 10.0)
+        self.exposure.variance.array[:] = 100.0
+        bad = rng.uniform(size=(height, width)) < 0.05
+        self.exposure.image.array[bad] = 1.0e4
+        self.exposure.mask.array[bad] = self.exposure.mask.getPlaneBitMask("BAD")
+
+    def makeConfig(self, statistic):
+        config = SubtractBackgroundTask.ConfigClass()
+        config.binSize = 64
+        config.statisticsProperty = statistic
+        config.ignoredPixelMask = ["BAD"]
+        return config
+
+    def testNumpyEngine(self):
+        """The numpy engine must reproduce the statistics of makeBackground"""
+        for statistic in ("MEAN", "MEDIAN", "MEANCLIP"):
+            for numThreads in (1, 3):
+                with self.subTest(statistic=statistic, numThreads=numThreads):
+                    config = self.makeConfig(statistic)
+                    afwBg = SubtractBackgroundTask(config=config).fitBackground(self.exposure.maskedImage)
+                    config.statisticsEngine = "numpy"
+                    config.numThreads = numThreads
+                    numpyBg = SubtractBackgroundTask(config=config).fitBackground(self.exposure.maskedImage)
+
+                    afwStats = afwBg.getStatsImage()
+                    numpyStats = numpyBg.getStatsImage()
+                    self.assertEqual(numpyStats.getDimensions(), afwStats.getDimensions())
+                    # Clipping and the median of an even number of pixels differ in detail
+                    self.assertFloatsAlmostEqual(numpyStats.image.array, afwStats.image.array,
+                                                 atol=0.5 if statistic != "MEAN" else 1.0e-3)
+                    self.assertFloatsAlmostEqual(numpyBg.getImageF(config.algorithm,
+                                                                   config.undersampleStyle).array,
+                                                 afwBg.getImageF(config.algorithm,
+                                                                 config.undersampleStyle).array,
+                                                 atol=0.5)
+
+    def testIncrementalFit(self):
+        """Only bins whose good pixels change must be measured again"""
+        config = self.makeConfig("MEANCLIP")
+        config.statisticsEngine = "numpy"
+        task = SubtractBackgroundTask(config=config)
+        maskedImage = self.exposure.maskedImage
+        maskedImage.mask.array[200, 200] = 0
+        binStats = pipeBase.Struct()
+        task.fitBackground(maskedImage, binStats=binStats)
+        self.assertEqual(binStats.numMeasured, binStats.value.size)
+
+        # Unchanged image: nothing to measure
+        task.fitBackground(maskedImage, binStats=binStats)
+        self.assertEqual(binStats.numMeasured, 0)
+
+        # Mask a region inside a single bin, and modify pixels in another
+        maskedImage.mask.array[10:20, 10:20] |= maskedImage.mask.getPlaneBitMask("BAD")
+        maskedImage.image.array[200, 200] += 50.0
+        bg = task.fitBackground(maskedImage, binStats=binStats)
+        self.assertEqual(binStats.numMeasured, 2)
+        fresh = task.fitBackground(maskedImage)
+        self.assertFloatsEqual(bg.getStatsImage().image.array, fresh.getStatsImage().image.array)
+
+        # Subtracting a constant is tracked exactly
+        maskedImage.image.array -= 3.0
+        task.updateBinStatistics(binStats, maskedImage, 3.0)
+        bg = task.fitBackground(maskedImage, binStats=binStats)
+        self.assertEqual(binStats.numMeasured, 0)
+        self.assertFloatsAlmostEqual(bg.getStatsImage().image.array,
+                                     fresh.getStatsImage().image.array - 3.0, atol=1.0e-4)
+
+        # Subtracting a model that varies within the bins invalidates them
+        ramp = np.zeros(maskedImage.image.array.shape, dtype=np.float32)
+        ramp[:, :binStats.xEdges[1]] = np.arange(binStats.xEdges[1])
+        maskedImage.image.array -= ramp
+        task.updateBinStatistics(binStats, maskedImage, ramp)
+        bg = task.fitBackground(maskedImage, binStats=binStats)
+        self.assertEqual(binStats.numMeasured, binStats.value.shape[0])
+        fresh = task.fitBackground(maskedImage)
+        self.assertFloatsEqual(bg.getStatsImage().image.array, fresh.getStatsImage().image.array)
+
+    def testRunNumpyEngine(self):
+        """The numpy engine's background must work as part of a BackgroundList"""
+        config = self.makeConfig("MEANCLIP")
+        config.statisticsEngine = "numpy"
+        task = SubtractBackgroundTask(config=config)
+        original = self.exposure.image.array.copy()
+        background = task.run(self.exposure).background
+        self.assertIsInstance(background, afwMath.BackgroundList)
+        self.assertEqual(len(background), 1)
+        self.assertFloatsAlmostEqual(background.getImage().array, original - self.exposure.image.array,
+                                     atol=1.0e-3)
+        self.assertLess(np.abs(np.mean(background.getImage().array - self.sky)), 1.0)
+        self.assertTrue(self.exposure.getMetadata().exists("BGMEAN"))
+
+    def testBlockSubtraction(self):
+        """Subtracting the background in blocks of rows must match
+        subtracting the full image, and sampling its statistics must be
+        close
+        """
+        config = self.makeConfig("MEANCLIP")
+        config.useApprox = False
+        fullExposure = self.exposure.clone()
+        SubtractBackgroundTask(config=config).run(fullExposure)
+        fullMetadata = fullExposure.getMetadata()
+
+        config.subtractBlockHeight = 50
+        config.validate()
+        blockExposure = self.exposure.clone()
+        SubtractBackgroundTask(config=config).run(blockExposure)
+        self.assertFloatsAlmostEqual(blockExposure.image.array, fullExposure.image.array, atol=1.0e-3)
+        blockMetadata = blockExposure.getMetadata()
+        self.assertFloatsAlmostEqual(blockMetadata.getScalar("BGMEAN"), fullMetadata.getScalar("BGMEAN"),
+                                     rtol=1.0e-6)
+        self.assertFloatsAlmostEqual(blockMetadata.getScalar("BGVAR"), fullMetadata.getScalar("BGVAR"),
+                                     rtol=1.0e-4)
+
+        config.statsSampleSpacing = 8
+        config.validate()
+        sampledExposure = self.exposure.clone()
+        SubtractBackgroundTask(config=config).run(sampledExposure)
+        sampledMetadata = sampledExposure.getMetadata()
+        self.assertFloatsAlmostEqual(sampledMetadata.getScalar("BGMEAN"), fullMetadata.getScalar("BGMEAN"),
+                                     rtol=1.0e-3)
+        self.assertFloatsAlmostEqual(sampledMetadata.getScalar("BGVAR"), fullMetadata.getScalar("BGVAR"),
+                                     rtol=0.05)
+
+    def testBlockSubtractionApprox(self):
+        """An approximated background, which afw evaluates over the whole
+        image, must be subtracted in full even with block subtraction and
+        sampled statistics
+        """
+        config = self.makeConfig("MEANCLIP")
+        self.assertTrue(config.useApprox)
+        fullExposure = self.exposure.clone()
+        SubtractBackgroundTask(config=config).run(fullExposure)
+        fullMetadata = fullExposure.getMetadata()
+
+        config.subtractBlockHeight = 50
+        self.assertLess(config.subtractBlockHeight, self.exposure.getHeight())
+        config.statsSampleSpacing = 8
+        config.validate()
+        blockExposure = self.exposure.clone()
+        SubtractBackgroundTask(config=config).run(blockExposure)
+        blockMetadata = blockExposure.getMetadata()
+        self.assertFloatsEqual(blockExposure.image.array, fullExposure.image.array)
+        self.assertFloatsAlmostEqual(blockMetadata.getScalar("BGMEAN"), fullMetadata.getScalar("BGMEAN"),
+                                     rtol=1.0e-3)
+        self.assertFloatsAlmostEqual(blockMetadata.getScalar("BGVAR"), fullMetadata.getScalar("BGVAR"),
+                                     rtol=0.05)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()